@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rows per second and bytes per row of every submit format, with the native module (orjson, msgpack)
+when installed and with the stdlib / built-in fallback, against the per-row json.dumps submitters used before.
+
+python3 -m bench.bench_encoders -n 100000
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from src.core import encoding
+
+
+def argBuilder():
+    argparser = argparse.ArgumentParser(sys.argv[0], description="Submit encoder benchmark")
+    argparser.add_argument("-n", "--rows", type=int, default=100000, help="rows per case", dest="rows")
+    argparser.add_argument("-b", "--batch", type=int, default=200, help="rows per batch", dest="batch")
+    return argparser.parse_args()
+
+
+def result(i: int):
+    return {'cmd': "result", 'name': f"perfmon_{i % 50}", 'params': {'datetime': "2026-01-01 00:00:00"},
+            'except': "real", 'value': i * 0.25, 'errno': 0, 'error': "", 'timestamp': 1767225600 + i,
+            'submit_time': "2026-01-01 00:00:01"}
+
+
+def legacy(rows: list, batch: int):
+    # what PrintSubmit / FileSubmit did for every row
+    size = 0
+    for begin in range(0, len(rows), batch):
+        for row in rows[begin:begin + batch]:
+            size += len(json.dumps(row, ensure_ascii=False).encode("utf-8")) + 1
+    return size
+
+
+def run(encoder: encoding.Encoder, rows: list, batch: int):
+    size = 0
+    for begin in range(0, len(rows), batch):
+        size += len(encoder.batch([encoder.encode(row) for row in rows[begin:begin + batch]]))
+    return size
+
+
+def main():
+    args = argBuilder()
+    rows = [result(i) for i in range(args.rows)]
+    begin = time.perf_counter()
+    size = legacy(rows, args.batch)
+    elapsed = time.perf_counter() - begin
+    print(f"{'json.dumps per row':>28}: {args.rows / elapsed:10.0f} rows/s, {size / args.rows:6.1f} bytes/row")
+    for name in encoding.EncoderTable:
+        for native in (True, False):
+            encoder = encoding.getEncoder(name, native)
+            if native and not encoder.native:
+                continue
+            label = f"{name} ({'native' if encoder.native else 'fallback'})"
+            begin = time.perf_counter()
+            size = run(encoder, rows, args.batch)
+            elapsed = time.perf_counter() - begin
+            data = encoder.batch([encoder.encode(row) for row in rows[:args.batch]])
+            begin = time.perf_counter()
+            decoded = sum(1 for row in encoder.stream(data))
+            decode_elapsed = time.perf_counter() - begin
+            print(f"{label:>28}: {args.rows / elapsed:10.0f} rows/s, {size / args.rows:6.1f} bytes/row, "
+                  f"decode {decoded / decode_elapsed:10.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
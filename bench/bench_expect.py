@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Expect of multi-sample values: per value Expect.expect versus column Expect.expectColumn
+(with numpy when it is installed), and a netdev-like dict converted by a samples schema, whose keys
+are checked to split into the right labels first (vlan devices like "eth0.100" keep their dot).
+
+python3 -m bench.bench_expect -n 5000 -r 200
+"""
+
+import argparse
+import sys
+import time
+
+from src.core import expect
+from src.core.expect import Expect
+
+
+def argBuilder():
+    argparser = argparse.ArgumentParser(sys.argv[0], description="Expect column benchmark")
+    argparser.add_argument("-n", "--samples", type=int, default=5000, help="values per column", dest="samples")
+    argparser.add_argument("-r", "--rounds", type=int, default=200, help="columns per case", dest="rounds")
+    return argparser.parse_args()
+
+
+def run(func, rounds: int, samples: int):
+    begin = time.perf_counter()
+    for i in range(rounds):
+        func()
+    return (time.perf_counter() - begin) / (rounds * samples)
+
+
+def netdevValue(samples: int):
+    fields = ("rx_bytes", "rx_packets", "tx_bytes", "tx_packets")
+    devices = [f"eth{i // 2}.{100 + i}" if i % 2 else f"eth{i // 2}" for i in range(max(samples // len(fields), 1))]
+    return {f"{device}.{field}": float(i) for i, (device, field) in
+            enumerate((device, field) for device in devices for field in fields)}
+
+
+def checkSamples(schema: dict, value: dict):
+    samples = Expect.expectSamples(schema, value)
+    for sample, key in zip(samples, value):
+        if f"{sample['labels']['device']}.{sample['labels']['field']}" != key or "." in sample['labels']['field']:
+            raise AssertionError(f"sample key '{key}' split into wrong labels {sample['labels']!r}")
+
+
+def main():
+    args = argBuilder()
+    columns = {
+        'real_str': [f"{i * 0.5}" for i in range(args.samples)],
+        'real_int': list(range(args.samples)),
+        'int_str': [str(i) for i in range(args.samples)],
+    }
+    print(f"numpy: {'yes' if expect.numpy is not None else 'no'}")
+    for name, values in columns.items():
+        typ = name.split("_")[0]
+        per = run(lambda: [Expect.expect(typ, value) for value in values], args.rounds, args.samples)
+        col = run(lambda: Expect.expectColumn(typ, values), args.rounds, args.samples)
+        print(f"{name:>10}: per value {per * 1e9:7.1f}ns, column {col * 1e9:7.1f}ns, {per / col:5.1f}x")
+
+    schema = {'type': "samples", 'value': "real", 'labels': ["device", "field"]}
+    value = netdevValue(args.samples)
+    checkSamples(schema, value)
+    per = run(lambda: Expect.expectSamples(schema, value), args.rounds, len(value))
+    print(f"{'samples':>10}: dict to samples {per * 1e9:7.1f}ns per key, dotted device keys split correctly")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Per-sample format overhead of walking the format config on every run (factory lookup per name,
+wrapper closure per call) versus the pipeline compiled once at task construction.
+
+python3 -m bench.bench_format -n 1000000
+"""
+
+import argparse
+import sys
+import time
+
+from src.formats import common  # register built-in formats
+from src.formats.format import FormatFactory
+
+
+def argBuilder():
+    argparser = argparse.ArgumentParser(sys.argv[0], description="Format pipeline benchmark")
+    argparser.add_argument("-n", "--samples", type=int, default=1000000, help="samples per case", dest="samples")
+    return argparser.parse_args()
+
+
+def wrapped(func):
+    # what the format decorator used to register
+    def inner(value):
+        if callable(func):
+            return func(value)
+        raise ValueError(f"Format function '{func}' is not callable")
+
+    return inner
+
+
+def legacy(spec, value):
+    # the recursive walk TaskBase used before compiled pipelines
+    def __doFormat(cur):
+        if isinstance(cur, str):
+            return wrapped(FormatFactory()[cur])(value)
+        elif isinstance(cur, list):
+            currentValue = value
+            for c in cur:
+                currentValue = __doFormat(c)
+                if not currentValue:
+                    return None
+            return currentValue
+        elif cur is None:
+            return value
+        else:
+            raise ValueError(f"format name type need str, but '{type(cur)}' found")
+
+    return __doFormat(spec)
+
+
+def run(func, samples: int):
+    begin = time.perf_counter()
+    for i in range(samples):
+        func(b"12345")
+    return (time.perf_counter() - begin) / samples
+
+
+def main():
+    args = argBuilder()
+    cases = {
+        'single': "toInt",
+        'chain_3': ["toFloat", "toInt", "toFloat"],
+        'nested_4': [["toInt", "toFloat"], ["toInt", "toFloat"]],
+    }
+    for name, spec in cases.items():
+        pipeline = FormatFactory().compile(spec)
+        old = run(lambda value: legacy(spec, value), args.samples)
+        new = run(pipeline, args.samples)
+        print(f"{name:>10}: legacy {old * 1e9:8.1f}ns/sample, compiled {new * 1e9:8.1f}ns/sample, "
+              f"{old / new:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Task throughput with forced gc.collect() after every run versus GcPolicy.
+
+python3 -m bench.bench_gc -n 200 -d 5
+"""
+
+import argparse
+import gc
+import sys
+import time
+
+from src.core.gc_policy import GcPolicy
+from src.task.dummy import Dummy
+
+
+def argBuilder():
+    argparser = argparse.ArgumentParser(sys.argv[0], description="GC policy benchmark")
+    argparser.add_argument("-n", "--tasks", type=int, default=200, help="task instances", dest="tasks")
+    argparser.add_argument("-d", "--duration", type=float, default=5.0, help="seconds per case", dest="duration")
+    return argparser.parse_args()
+
+
+def buildTasks(count: int):
+    # some garbage-collector tracked state per task, like real perfmon items keep
+    tasks = []
+    for i in range(count):
+        task = Dummy(f"dummy_{i}", {"method": "dummy", "text": f"text {i}", "format": None, "expect": "string",
+                                    "timeout": 10})
+        task.history = [{'index': j} for j in range(50)]
+        tasks.append(task)
+    return tasks
+
+
+def run(tasks: list, duration: float, step):
+    runs = 0
+    worst = 0.0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        for task in tasks:
+            begin = time.perf_counter()
+            task.task_run({'datetime': ""})
+            step()
+            worst = max(worst, time.perf_counter() - begin)
+            runs += 1
+    return runs / duration, worst
+
+
+def main():
+    args = argBuilder()
+    tasks = buildTasks(args.tasks)
+
+    cases = {
+        'collect_every_run': (None, gc.collect),
+        'interval_60s': ({"policy": "interval", "interval": 60, "freeze": False}, None),
+        'interval_60s_freeze': ({"policy": "interval", "interval": 60, "freeze": True}, None),
+        'runs_1000_freeze': ({"policy": "runs", "runs": 1000, "freeze": True}, None),
+    }
+    for name, (config, step) in cases.items():
+        gc.unfreeze()
+        if step is None:
+            policy = GcPolicy(config)
+            policy.setup()
+            step = policy.step
+        throughput, worst = run(tasks, args.duration, step)
+        print(f"{name:>22}: {throughput:12.1f} runs/s, worst run {worst * 1000:.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+HttpSubmit throughput and batch latency against a local stub report server,
+per compress setting, optionally with a failure rate to see backoff at work.
+
+python3 -m bench.bench_http_submit -n 20000 -c 200 --fail 0.0
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.core.agent_config import AgentConfig
+from src.submits import http_submit
+from src.submits.http_submit import HttpSubmit
+
+
+def argBuilder():
+    argparser = argparse.ArgumentParser(sys.argv[0], description="HttpSubmit benchmark")
+    argparser.add_argument("-n", "--results", type=int, default=20000, help="results per case", dest="results")
+    argparser.add_argument("-c", "--capacity", type=int, default=200, help="results per batch", dest="capacity")
+    argparser.add_argument("--fail", type=float, default=0.0, help="stub server failure rate", dest="fail")
+    return argparser.parse_args()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    fail = 0.0
+    requests = 0
+    received = 0
+    body_bytes = 0
+    mutex = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with StubHandler.mutex:
+            StubHandler.requests += 1
+            failed = StubHandler.fail and (StubHandler.requests * StubHandler.fail) % 1 < StubHandler.fail
+        if failed:
+            self.send_response(503)
+            self.end_headers()
+            return
+        match self.headers.get('Content-Encoding'):
+            case "gzip":
+                raw = gzip.decompress(body)
+            case "zstd":
+                raw = http_submit.zstandard.ZstdDecompressor().decompressobj().decompress(body)
+            case default:
+                raw = body
+        with StubHandler.mutex:
+            StubHandler.received += len(json.loads(raw))
+            StubHandler.body_bytes += len(body)
+        reply = b'{"errno": 0}'
+        self.send_response(200)
+        self.send_header('Content-Type', "application/json")
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, format, *args):
+        ...
+
+
+def result(i: int):
+    return {'cmd': "result", 'name': f"perfmon_{i % 50}", 'params': {'datetime': "2026-01-01 00:00:00"},
+            'except': "real", 'value': i * 0.25, 'errno': 0, 'error': "", 'timestamp': 1767225600 + i}
+
+
+def run(url: str, compress: str, args):
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as fd:
+        json.dump({'agent_name': "bench", 'perfmon': [{}], 'report': url,
+                   'submit': {'type': "http", 'compress': compress, 'backoff': 0.05, 'backoff_max': 0.2,
+                              'retry': 5}}, fd)
+    try:
+        submit = HttpSubmit(AgentConfig(fd.name), capacity=args.capacity, timeout=0.1)
+    finally:
+        os.unlink(fd.name)
+    StubHandler.received = StubHandler.body_bytes = StubHandler.requests = 0
+    latencies = []
+    begin = time.perf_counter()
+    for i in range(args.results):
+        before = time.perf_counter()
+        submit.submit(result(i))
+        latencies.append(time.perf_counter() - before)
+    while submit.buf or submit.sending:
+        time.sleep(0.01)
+        submit.doSend()
+    elapsed = time.perf_counter() - begin
+    submit.timerStop()
+    submit.timer.cancel()
+    latencies.sort()
+    return {
+        'results_per_s': round(args.results / elapsed, 1),
+        'submit_p50_us': round(latencies[len(latencies) // 2] * 1e6, 1),
+        'submit_p99_us': round(latencies[int(len(latencies) * 0.99)] * 1e6, 1),
+        'requests': StubHandler.requests,
+        'received': StubHandler.received,
+        'dropped': submit.dropped,
+        'body_bytes': StubHandler.body_bytes,
+    }
+
+
+def main():
+    args = argBuilder()
+    StubHandler.fail = args.fail
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(None, server.serve_forever, "stub_server", daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/report"
+    compresses = ["none", "gzip"] + (["zstd"] if http_submit.zstandard is not None else [])
+    for compress in compresses:
+        print(f"{compress:>5}: {json.dumps(run(url, compress, args))}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+End-to-end collection -> submit throughput: Scheduler + Processing + Submitting with synthetic perfmon items
+of each method against a null sink. Reports samples per second, scheduler lag (actual versus planned start)
+percentiles and RSS / CPU of the agent and every worker process, as one json document so runs of different
+commits can be compared with --baseline.
+
+python3 -m bench.bench_pipeline -n 20 -i 0.1 -d 10 -o pipeline.json
+python3 -m bench.bench_pipeline -n 20 -i 0.1 -d 10 --baseline pipeline.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+from src.base.submit_base import SubmitBase
+from src.core.perfmon import Perfmon
+from src.core.processing import Processing
+from src.core.scheduler import Scheduler
+from src.core.submitting import Submitting
+
+MethodEnum = ("dummy", "readfile", "execute")
+
+
+def argBuilder():
+    argparser = argparse.ArgumentParser(sys.argv[0], description="Collection to submit pipeline benchmark")
+    argparser.add_argument("-n", "--items", type=int, default=20, help="perfmon items per method", dest="items")
+    argparser.add_argument("-m", "--methods", type=str, default=",".join(MethodEnum),
+                           help=f"comma separated methods of {MethodEnum}", dest="methods")
+    argparser.add_argument("-i", "--interval", type=float, default=0.1, help="perfmon delay in seconds",
+                           dest="interval")
+    argparser.add_argument("-d", "--duration", type=float, default=10.0, help="measured seconds", dest="duration")
+    argparser.add_argument("-w", "--warmup", type=float, default=1.0, help="seconds before measuring", dest="warmup")
+    argparser.add_argument("-p", "--processes", type=int, default=2, help="worker processes", dest="processes")
+    argparser.add_argument("-t", "--threads", type=int, default=1, help="threads per worker", dest="threads")
+    argparser.add_argument("-c", "--capacity", type=int, default=200, help="null sink batch size", dest="capacity")
+    argparser.add_argument("-o", "--output", type=str, default=None, help="write json here instead of stdout",
+                           dest="output")
+    argparser.add_argument("--baseline", type=str, default=None, help="json of an earlier run to compare with",
+                           dest="baseline")
+    argparser.add_argument("--verbose", action="store_true", help="keep agent logging", dest="verbose")
+    return argparser.parse_args()
+
+
+class NullSubmit(SubmitBase):
+    """
+    Counts submitted results, nothing is written
+    """
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity, 1)
+        self.rows = 0
+        self.batches = 0
+
+    def _send(self, batch: list, encoded: list) -> bool:
+        self.rows += len(batch)
+        self.batches += 1
+        return True
+
+
+class LagScheduler(Scheduler):
+    """
+    Keeps every lag instead of the histogram buckets of metrics
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.lags = []
+
+    def _fire(self, entry, now: float):
+        self.lags.append(now - entry.deadline())
+        super()._fire(entry, now)
+
+
+def perfmonItem(method: str, i: int, interval: float):
+    match method:
+        case "readfile":
+            task = {'method': "readfile", 'path': "/proc/loadavg", 'format': None, 'expect': "string", 'timeout': 3}
+        case "execute":
+            task = {'method': "execute", 'exec': "true", 'params': [], 'format': None, 'expect': "string",
+                    'timeout': 3}
+        case default:
+            task = {'method': "dummy", 'text': f"text {i}", 'format': None, 'expect': "string", 'timeout': 3}
+    return {'name': f"{method}_{i}", 'type': "bench", 'delay': interval, 'tasks': task}
+
+
+def procStats(pid: int):
+    """
+    :return: (rss bytes, cpu seconds) of pid from procfs
+    """
+    with open(f"/proc/{pid}/stat", "r") as fd:
+        # fields after the command name, which may contain spaces
+        fields = fd.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu = (int(fields[11]) + int(fields[12])) / ticks
+    rss = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+    return rss, cpu
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def gitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(report: dict, baseline: dict):
+    rows = [("samples_per_sec", report['samples_per_sec'], baseline.get('samples_per_sec')),
+            ("lag_p50", report['lag']['p50'], baseline.get('lag', {}).get('p50')),
+            ("lag_p99", report['lag']['p99'], baseline.get('lag', {}).get('p99')),
+            ("rss_total", report['rss_total'], baseline.get('rss_total')),
+            ("cpu_total", report['cpu_total'], baseline.get('cpu_total'))]
+    print(f"compare with {baseline.get('commit')}:", file=sys.stderr)
+    for name, value, base in rows:
+        if value is None or not base:
+            print(f"{name:>16}: {value}", file=sys.stderr)
+            continue
+        print(f"{name:>16}: {base:>14.6g} -> {value:<14.6g} {(value - base) / base:+8.1%}", file=sys.stderr)
+
+
+def main():
+    args = argBuilder()
+    methods = [method.strip() for method in args.methods.split(",") if method.strip()]
+    for method in methods:
+        if method not in MethodEnum:
+            raise ValueError(f"method must be one of {MethodEnum}, but '{method}' found.")
+    if not args.verbose:
+        # per-result debug lines would measure the log handler, not the pipeline
+        logging.disable(logging.WARNING)
+
+    sink = NullSubmit(args.capacity)
+    submitting = Submitting(1, 1000)
+    submitting.register_submit(sink)
+    processing = Processing(args.processes, "bench", submitting.get_queue(), thread_count=args.threads)
+    scheduler = LagScheduler(processing.get_queue(), processing.get_feedback_queue(), processing.pinned_queue)
+    items = [perfmonItem(method, i, args.interval) for method in methods for i in range(args.items)]
+    for item in items:
+        scheduler.register_scheduler(Perfmon("bench", item, setup_tasks=False))
+        processing.register_perfmon(item)
+
+    window = {}
+
+    def measure():
+        time.sleep(args.warmup)
+        pids = {'agent': os.getpid()}
+        pids.update({name: item['process'].pid for name, item in processing.processes.items()})
+        window['begin'] = (time.monotonic(), sink.rows, {name: procStats(pid) for name, pid in pids.items()})
+        scheduler.lags.clear()
+        time.sleep(args.duration)
+        window['end'] = (time.monotonic(), sink.rows, {name: procStats(pid) for name, pid in pids.items()})
+        window['lags'] = list(scheduler.lags)
+        window['pids'] = pids
+        scheduler.stop()
+
+    submitting.start()
+    processing.start()
+    measurer = threading.Thread(None, measure, "measure", daemon=True)
+    measurer.start()
+    try:
+        scheduler.start()
+    finally:
+        scheduler.stop()
+        processing.stop()
+        submitting.stop()
+    if 'end' not in window:
+        raise RuntimeError("pipeline stopped before the measure window ended.")
+
+    begin_time, begin_rows, begin_procs = window['begin']
+    end_time, end_rows, end_procs = window['end']
+    elapsed = end_time - begin_time
+    processes = {}
+    for name, pid in window['pids'].items():
+        rss, cpu = end_procs[name]
+        processes[name] = {'pid': pid, 'rss': rss, 'cpu_percent': (cpu - begin_procs[name][1]) / elapsed * 100}
+    lags = window['lags']
+    schedule = scheduler.get_stats().values()
+    report = {
+        'bench': "pipeline",
+        'commit': gitCommit(),
+        'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'python': platform.python_version(),
+        'config': {'methods': methods, 'items': args.items, 'interval': args.interval, 'duration': args.duration,
+                   'processes': args.processes, 'threads': args.threads, 'capacity': args.capacity},
+        'samples': end_rows - begin_rows,
+        'samples_per_sec': (end_rows - begin_rows) / elapsed,
+        'expected_per_sec': len(items) / args.interval,
+        'lag': {'count': len(lags), 'p50': percentile(lags, 0.5), 'p99': percentile(lags, 0.99),
+                'max': max(lags, default=None)},
+        'schedule': {key: sum(stats[key] for stats in schedule)
+                     for key in ('skipped', 'dropped', 'overrun_skipped', 'late')},
+        'processes': processes,
+        'rss_total': sum(item['rss'] for item in processes.values()),
+        'cpu_total': sum(item['cpu_percent'] for item in processes.values()),
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as fd:
+            fd.write(text + "\n")
+    print(f"{report['samples_per_sec']:.0f} samples/s of {report['expected_per_sec']:.0f} planned, "
+          f"lag p50 {(report['lag']['p50'] or 0) * 1000:.3f} ms, p99 {(report['lag']['p99'] or 0) * 1000:.3f} ms, "
+          f"rss {report['rss_total'] / 1048576:.1f} MiB, cpu {report['cpu_total']:.1f}%", file=sys.stderr)
+    if args.baseline is not None:
+        with open(args.baseline, "r") as fd:
+            compare(report, json.load(fd))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Agent startup cost: wall time of fresh interpreters importing the agent and checking a config (--check),
+for a print-only agent and an http agent, and the slowest imports on the path from `python -X importtime`.
+Every case runs in a new process, the median of the runs is reported, -o writes json for comparing commits.
+
+python3 -m bench.bench_startup -r 20
+python3 -m bench.bench_startup -r 20 -o startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+Root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def argBuilder():
+    argparser = argparse.ArgumentParser(sys.argv[0], description="Agent startup benchmark")
+    argparser.add_argument("-r", "--runs", type=int, default=20, help="processes per case", dest="runs")
+    argparser.add_argument("-t", "--top", type=int, default=15, help="slowest imports listed", dest="top")
+    argparser.add_argument("-o", "--output", type=str, default=None, help="write json here", dest="output")
+    return argparser.parse_args()
+
+
+def environment():
+    env = dict(os.environ)
+    paths = [Root, os.path.join(Root, "src")]
+    if env.get("PYTHONPATH"):
+        paths.append(env["PYTHONPATH"])
+    env["PYTHONPATH"] = os.pathsep.join(paths)
+    return env
+
+
+def writeConfig(directory: str, name: str, submit: dict):
+    path = os.path.join(directory, f"{name}.json")
+    perfmon = [{'name': f"dummy_{i}", 'type': "bench", 'delay': 1, 'tasks': {
+        'method': "dummy", 'text': "text", 'format': None, 'expect': "string", 'timeout': 3}} for i in range(10)]
+    perfmon.append({'name': "loadavg", 'type': "bench", 'delay': 1, 'tasks': {
+        'method': "readfile", 'path': "/proc/loadavg", 'format': None, 'expect': "string", 'timeout': 3}})
+    with open(path, "w") as fd:
+        json.dump({'agent_name': "bench", 'report': "http://127.0.0.1:1/", 'process': 1, 'submit': submit,
+                   'perfmon': perfmon}, fd)
+    return path
+
+
+def timeRuns(command: list, runs: int, env: dict):
+    elapsed = []
+    for _ in range(runs):
+        begin = time.perf_counter()
+        result = subprocess.run(command, cwd=Root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        elapsed.append(time.perf_counter() - begin)
+        if result.returncode != 0:
+            raise RuntimeError(f"{' '.join(command)} failed: {result.stderr.decode('utf-8', 'replace')[-500:]}")
+    return {'median': statistics.median(elapsed), 'min': min(elapsed), 'max': max(elapsed)}
+
+
+def slowestImports(env: dict, top: int):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import src.main"], cwd=Root, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if not fields[0].strip().isdigit():
+            continue
+        imports.append({'module': fields[2].strip(), 'self_us': int(fields[0]), 'cumulative_us': int(fields[1])})
+    total = next((item['cumulative_us'] for item in imports if item['module'] == "src.main"), None)
+    modules = sorted(item['module'] for item in imports)
+    imports.sort(key=lambda item: item['self_us'], reverse=True)
+    return total, imports[:top], modules
+
+
+def main():
+    args = argBuilder()
+    env = environment()
+    with tempfile.TemporaryDirectory() as directory:
+        configs = {
+            'print': writeConfig(directory, "print", {'type': "print", 'device': "stdout", 'format': "JsonEachRow"}),
+            'http': writeConfig(directory, "http", {'type': "http"}),
+        }
+        cases = {'interpreter': timeRuns([sys.executable, "-c", "pass"], args.runs, env),
+                 'import': timeRuns([sys.executable, "-c", "import src.main"], args.runs, env)}
+        for name, path in configs.items():
+            cases[f"check_{name}"] = timeRuns([sys.executable, "src/main.py", "-c", path, "--check"], args.runs, env)
+
+    total, imports, modules = slowestImports(env, args.top)
+    heavy = [name for name in ("urllib3", "requests", "http.server", "cProfile", "pstats", "tracemalloc")
+             if name in modules]
+    report = {
+        'bench': "startup",
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        'cases': cases,
+        'import_total_us': total,
+        'heavy_modules_imported': heavy,
+        'slowest_imports': imports,
+    }
+
+    for name, case in cases.items():
+        print(f"{name:>12}: median {case['median'] * 1000:8.2f} ms, min {case['min'] * 1000:8.2f} ms")
+    print(f"import src.main: {total} us, heavy modules on the path: {', '.join(heavy) or 'none'}")
+    for item in imports:
+        print(f"{item['self_us']:>8} us self {item['cumulative_us']:>8} us cumulative  {item['module']}")
+    if args.output is not None:
+        with open(args.output, "w") as fd:
+            json.dump(report, fd, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,28 +5,79 @@ Submit base class
 """
 import abc
 import threading
+import time
 
 from src import util
+from src.core.backpressure import Backpressure
+from src.core.encoding import getEncoder
+from src.core.metrics import Histogram, Metrics
 from src.core.reentrant_timer import ReentrantTimer
+from src.core.spool import Spool, SpoolDrainer
 from src.logger import Logger
 
 
 class SubmitBase(object, metaclass=abc.ABCMeta):
-    def __init__(self, capacity: int = 20, timeout: float = 10.0):
+    BufferLimit = 10000
+    BlockInterval = 0.1
+    checking = False  # built by checkConfig, no file, socket or spool is opened
+
+    def __init__(self, capacity: int = 20, timeout: float = 10.0, max_bytes: int = None, spool: dict = None,
+                 buffer: dict = None, format: str = "JsonEachRow"):
+        """
+        :param capacity: send when buffered results reach this count
+        :param timeout: send buffered results at least every timeout seconds
+        :param max_bytes: send when buffered results reach this size in encoded bytes
+        :param spool: spool configs, batches failed to send go to disk and are replayed later
+            instead of staying in memory, see src.core.spool
+        :param buffer: backpressure configs of the buffer while results cannot be sent,
+            default holds at most 10000 results and drops the oldest, see src.core.backpressure
+        :param format: encoding of results, every result is encoded once when submitted, see src.core.encoding;
+            None for sinks writing the result dicts themselves, results are not encoded and measure no bytes
+        """
         self.capacity = capacity
         self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.encoder = getEncoder(format)
         self.buf = []
-        self.mutex = threading.Lock()
-        self.submit_mutex = threading.Lock()
+        self.encoded = []  # encoded bytes of each buffered result
+        self.buf_bytes = 0
+        self.buffer = Backpressure(buffer, "buffer", SubmitBase.BufferLimit, "drop_oldest")
+        self.interrupted = threading.Event()
+        self.sending = 0  # results of the batch being sent, out of buf until the send ends
+        self.sending_bytes = 0
+        self.mutex = threading.Lock()  # one send at a time, _send of submitters is not thread-safe
+        self.submit_mutex = threading.Lock()  # guards buf, encoded and the counters, never held while sending
 
         self.timer = ReentrantTimer(self.timeout, self._timerEvent)
 
         self.logger = Logger().getLogger(__name__)
 
+        if spool is not None and self.checking:
+            Spool.checkConfig(spool)
+            spool = None
+        self.spool = Spool(spool) if spool is not None else None
+        self.drainer = None
+        if self.spool is not None:
+            # started with the first submit, once the submitter is fully set up
+            self.drainer = SpoolDrainer(self.spool, self._replay, f"spool_{self.__class__.__name__}")
+
+    @classmethod
+    def checkConfig(cls, *args, **kwargs):
+        """
+        Parse and check a submit config with the constructor arguments, but open no file, socket or spool
+        """
+        submit = cls.__new__(cls)
+        submit.checking = True
+        submit.__init__(*args, **kwargs)
+        return submit
+
     def __del__(self):
         self.reset()
 
     def reset(self):
+        if isinstance(self.drainer, SpoolDrainer):
+            self.drainer.stop()
+            self.drainer = None
         if isinstance(self.timer, ReentrantTimer):
             if self.timer.is_alive():
                 self.timer.cancel()
@@ -36,27 +87,171 @@ class SubmitBase(object, metaclass=abc.ABCMeta):
                     self.logger.info(f"Submit buf still has '{length}' result{'s' if length != 1 else ''}, sending...")
                     self.doSend()
                     self.logger.info(f"Submit sent '{length}' result{'s' if length != 1 else ''}")
+        if isinstance(self.spool, Spool):
+            self.spool.close()
 
     @abc.abstractmethod
-    def _send(self) -> bool:
+    def _send(self, batch: list, encoded: list) -> bool:
+        """
+        Send a batch of results
+        :param encoded: bytes of each result in batch encoded by the submitter format
+        :return: True when the batch is delivered, on False the batch (minus results the sink deleted from the head
+            of both lists) goes back to the buffer
+        """
         raise NotImplementedError()
 
+    def getFormat(self):
+        return self.encoder.Name
+
+    def _clearBuf(self):
+        self.buf = []
+        self.encoded = []
+        self.buf_bytes = 0
+
+    def _popOldest(self) -> int:
+        """
+        Remove the oldest buffered result
+        :return: its encoded size
+        """
+        self.buf.pop(0)
+        return len(self.encoded.pop(0))
+
+    def interrupt(self):
+        """
+        Stop waiting for buffer room, called before submit threads are joined
+        """
+        self.interrupted.set()
+
+    def _full(self) -> bool:
+        # the batch being sent still counts, it comes back to the buffer if sending fails
+        return self.buffer.full(len(self.buf) + self.sending, self.buf_bytes + self.sending_bytes)
+
+    def _admit(self) -> bool:
+        """
+        Make room for a new result under the buffer backpressure policy
+        :return: True if the new result can be buffered
+        """
+        if not self._full():
+            return True
+        self.doSend()
+        if not self._full():
+            return True
+        match self.buffer.action():
+            case "block":
+                # submit thread waits here, the submit queue fills up and the workers see it next
+                begin = time.monotonic()
+                while self._full() and not self.interrupted.is_set():
+                    self.interrupted.wait(SubmitBase.BlockInterval)
+                    self.doSend()
+                self.buffer.block(time.monotonic() - begin)
+                return True
+            case "drop_oldest":
+                with self.submit_mutex:
+                    while self.buf and self._full():
+                        self.buf_bytes -= self._popOldest()
+                        self.buffer.dropOldest()
+                return True
+            case default:
+                self.buffer.dropNewest()
+                return False
+
+    def _takeBuf(self):
+        """
+        Swap the buffer out for sending, called with submit_mutex held
+        :return: (batch, encoded) of all buffered results
+        """
+        batch, encoded = self.buf, self.encoded
+        self.sending = len(batch)
+        self.sending_bytes = self.buf_bytes
+        self._clearBuf()
+        return batch, encoded
+
+    def _restoreBuf(self, batch: list, encoded: list):
+        """
+        Put a batch failed to send back in front of the results buffered meanwhile, called with submit_mutex held;
+        the sink may have dropped the head of the batch, so its size is counted again
+        """
+        self.buf = batch + self.buf
+        self.encoded = encoded + self.encoded
+        self.buf_bytes += sum(len(data) for data in encoded)
+
     def doSend(self):
-        if self.mutex.locked():
+        """
+        Send all buffered results, the buffer is only locked while the batch is swapped out,
+        so other submit threads keep buffering during a slow send; a call while a send is running returns at once
+        """
+        if not self.mutex.acquire(blocking=False):
             return
-        if self.mutex.acquire(blocking=False):
-            self.logger.debug("Ready to send result")
-            try:
-                result = self._send()
-                if result:
-                    self.logger.debug("Result submitted")
-                    self.buf = []
-            finally:
-                self.mutex.release()
-
-    def _checkBuf(self):
-        if len(self.buf) >= self.capacity:
-            self.doSend()
+        try:
+            while True:
+                with self.submit_mutex:
+                    batch, encoded = self._takeBuf()
+                if not batch:
+                    return
+                if not self._sendBatch(batch, encoded):
+                    return
+                with self.submit_mutex:
+                    # results which reached the threshold while sending go out now instead of on the next submit
+                    if not self._due():
+                        return
+        finally:
+            with self.submit_mutex:
+                self.sending = 0
+                self.sending_bytes = 0
+            self.mutex.release()
+
+    def _sendBatch(self, batch: list, encoded: list) -> bool:
+        """
+        Send a batch swapped out of the buffer, called with mutex held
+        :return: True if the batch left the buffer (sent, spooled or dropped by the spool)
+        """
+        self.logger.debug("Ready to send result")
+        metrics = Metrics()
+        label = self.__class__.__name__
+        begin = time.perf_counter()
+        try:
+            result = self._send(batch, encoded)
+        except BaseException:
+            with self.submit_mutex:
+                self._restoreBuf(batch, encoded)
+            raise
+        metrics.observe("submit_latency", time.perf_counter() - begin, label)
+        metrics.observe("submit_batch", len(batch), label, Histogram.SizeBounds)
+        if result:
+            self.logger.debug("Result submitted")
+            return True
+        metrics.inc("submit_failures", 1, label)
+        if isinstance(self.spool, Spool):
+            # memory stays bounded, the drainer replays the batch once the sink recovers
+            length = len(batch)
+            match self.spool.append(batch):
+                case "stored":
+                    self.logger.warning(f"Submit failed, spooled '{length}' result"
+                                        f"{'s' if length != 1 else ''}.")
+                    return True
+                case "dropped":
+                    self.logger.warning(f"Submit failed and spool is full, dropped '{length}' result"
+                                        f"{'s' if length != 1 else ''}.")
+                    return True
+        with self.submit_mutex:
+            self._restoreBuf(batch, encoded)
+        return False
+
+    def _replay(self, batch: list) -> bool:
+        encoded = [self.encoder.encode(data) for data in batch]
+        with self.mutex:
+            return self._send(batch, encoded)
+
+    def _due(self) -> bool:
+        return len(self.buf) >= self.capacity or bool(self.max_bytes and self.buf_bytes >= self.max_bytes)
+
+    def get_stats(self):
+        return {
+            'buffered': len(self.buf) + self.sending,
+            'buffered_bytes': self.buf_bytes + self.sending_bytes,
+            'buffer': self.buffer.get_stats(),
+            'spool': self.spool.get_stats() if isinstance(self.spool, Spool) else None,
+        }
 
     def _timerEvent(self):
         if len(self.buf) == 0:
@@ -72,14 +267,27 @@ class SubmitBase(object, metaclass=abc.ABCMeta):
         if not self.timer.is_active():
             self.timer.start_timer()
 
-    def submit(self, data: dict):
-        self.submit_mutex.acquire()
-        try:
-            if "submit_time" not in data:
-                data['submit_time'] = util.now()
+    def submit(self, data: dict, encoded: bytes = None):
+        """
+        :param encoded: data encoded by the submitter format already, fan-out encodes once for all submitters
+        """
+        with self.submit_mutex:
+            if isinstance(self.drainer, SpoolDrainer):
+                self.drainer.start()
+        if "submit_time" not in data:
+            data['submit_time'] = util.now()
+        if encoded is None:
+            encoded = self.encoder.encode(data)
+        if not self._admit():
+            return
+        with self.submit_mutex:
             self.buf.append(data)
+            self.encoded.append(encoded)
+            self.buf_bytes += len(encoded)
+            # a new result restarts the countdown of sending a partial batch
             self.timerStop()
-            self._checkBuf()
             self.timerStart()
-        finally:
-            self.submit_mutex.release()
+            due = self._due()
+        if due:
+            # sent outside submit_mutex, other submit threads keep buffering meanwhile
+            self.doSend()
@@ -6,23 +6,20 @@ Task base class
 
 """
 import abc
-import enum
-import signal
-import gc
 
 from src import util
-from src.core.expect import Expect
+from src.core.expect import Expect, ExpectError
+from src.core.metrics import Metrics
+from src.core.watchdog import Watchdog
 from src.logger import Logger
+from src.formats import common, extract  # register built-in formats
 from src.formats.format import FormatFactory
-from src.core.reentrant_timer import ReentrantTimer
 
 
 class TaskBase(object, metaclass=abc.ABCMeta):
     ValidExceptEnum = ('int', 'intOrNull', 'real', 'realOrNull', 'string', 'stringOrNull', 'null')
-
-    class TimeoutTypeEnum(enum.Enum):
-        KeyboardInterruptType = 0
-        CustomType = 1
+    checking = False  # built by checkConfig, nothing is set up or joined
+    Stateful = False  # keeps state between runs, e.g. counters of last run or a child process
 
     def __init__(self, name, config: dict):
         self.name = name
@@ -30,11 +27,9 @@ class TaskBase(object, metaclass=abc.ABCMeta):
 
         self.logger = Logger().getLogger(__name__)
 
-        self.timeoutType = TaskBase.TimeoutTypeEnum.KeyboardInterruptType
-
         self.method = util.checkKey("method", config, str, "task")
-        self.format = util.checkKey("format", config, (str, list), "task", canBeNone=True)
-        self.expect = util.checkKey("expect", config, str, "task")
+        self.format = util.checkKey("format", config, (str, list, dict), "task", canBeNone=True)
+        self.expect = util.checkKey("expect", config, (str, dict), "task")
         self.timeout = util.checkKey("timeout", config, (float, int), "task")
 
         try:
@@ -42,86 +37,112 @@ class TaskBase(object, metaclass=abc.ABCMeta):
         except ValueError:
             self.retry = 3
 
-        util.checkValueEnum(self.expect, TaskBase.ValidExceptEnum, valueName="expect")
+        if isinstance(self.expect, str):
+            util.checkValueEnum(self.expect, TaskBase.ValidExceptEnum, valueName="expect")
+        else:
+            Expect.checkSchema(self.expect)
+        # format names are resolved once, a wrong name fails the task config instead of every run
+        self.pipeline = FormatFactory().compile(self.format)
         self.params = {}
         self.value = None
         self.error = None
 
-        self.timer = None
-
         self._checkProcess()
-        self._setup()
+        if not self.checking:
+            self._setup()
 
-        self.timer_interrupt = False
+    @classmethod
+    def checkConfig(cls, name: str, config: dict):
+        """
+        Parse and check a task config like the constructor does, but never call '_setup',
+        so no file is opened and no process is started
+        """
+        task = cls.__new__(cls)
+        task.checking = True
+        task.__init__(name, config)
+        return task
 
-        match self.timeoutType:
-            case TaskBase.TimeoutTypeEnum.KeyboardInterruptType:
-                self._setupSignal()
-                self._setupTimer()
-            case default:
-                ...
+    @classmethod
+    def isStateful(cls, config: dict):
+        """
+        :return: True if a run depends on the runs before it, then all runs go to the one worker owning the perfmon
+        """
+        return cls.Stateful
 
     def __del__(self):
         self.reset()
 
     def reset(self):
-        if isinstance(self.timer, ReentrantTimer):
-            if self.timer.is_alive():
-                self.timer.cancel()
-                self.logger.debug(f"Task '{self.name}' internal timer deconstructed.")
-        self._join()
-        gc.collect()
-
-    def _setupSignal(self):
-        def _signalEvent(s, var2):
-            if s == signal.SIGINT:
-                if self.timer_interrupt:
-                    self.timer_interrupt = False
-                    raise TimeoutError(f"Task '{self.name}' running time exceeded in {self.timeout} second"
-                                       f"{'s' if self.timeout != 1 else ''}.")
-                else:
-                    raise KeyboardInterrupt
-
-        signal.signal(signal.SIGINT, _signalEvent)
+        if not self.checking:
+            self._join()
 
-    def _timerEvent(self):
-        self.logger.debug(f"Task '{self.name}' reached timeout.")
-        self.timer_interrupt = True
-        signal.raise_signal(signal.SIGINT)
-
-    def _setupTimer(self):
-        if not isinstance(self.timer, ReentrantTimer):
-            self.timer = ReentrantTimer(self.timeout, self._timerEvent)
+    def _cancel(self):
+        """
+        Called from the worker watchdog thread when task running time exceeded, tasks waiting on something killable
+        (e.g. subprocess) attach its cancel to the run by Watchdog().attach, others are cancelled
+        cooperatively when '_run' returns.
+        """
+        ...
 
     def getName(self):
         return self.name
 
+    def _formatValue(self, value):
+        return self.pipeline(value)
+
     def _doFormat(self):
         """
         从format工厂处理得到的值
+        a dict value (e.g. batch read of files) is formatted on each of its values
         :return:
         :rtype:
         """
+        if isinstance(self.value, dict):
+            self.value = {key: self._formatValue(value) for key, value in self.value.items()}
+        else:
+            self.value = self._formatValue(self.value)
+
+    def _doExpect(self):
+        """
+        a schema expect (record, samples) checks the whole value,
+        a type name expect checks each value of a dict value
+        """
+        if isinstance(self.expect, dict):
+            self.value = Expect.expect(self.expect, self.value)
+        elif isinstance(self.value, dict):
+            keys = list(self.value)
+            values, errors = Expect.expectColumn(self.expect, list(self.value.values()))
+            if errors:
+                raise ExpectError(Expect.describeErrors(errors, keys))
+            self.value = dict(zip(keys, values))
+        else:
+            self.value = Expect.expect(self.expect, self.value)
+
+    def _formatNames(self):
+        """
+        All format names of the task in order
+        :rtype: list
+        """
 
-        def __doFormat(cur):
+        def __names(cur):
             if isinstance(cur, str):
-                return FormatFactory()[cur](self.value)
+                return [cur]
+            elif isinstance(cur, dict):
+                return [cur.get('name')]
             elif isinstance(cur, list):
-                currentValue = self.value
-                for c in cur:
-                    currentValue = __doFormat(c)
-                    if not currentValue:
-                        return None
-                return currentValue
-            elif cur is None:
-                return self.value
-            else:
-                raise ValueError(f"format name type need str, but '{type(cur)}' found")
-
-        self.value = __doFormat(self.format)
+                return [name for c in cur for name in __names(c)]
+            return []
 
-    def _doExpect(self):
-        self.value = Expect.expect(self.expect, self.value)
+        return __names(self.format)
+
+    def acceptBytes(self):
+        """
+        Raw bytes value can go through format and expect without decoding
+        """
+        names = self._formatNames()
+        if names:
+            return all(FormatFactory().isBinary(name) for name in names)
+        return self.expect in ('int', 'intOrNull', 'real', 'realOrNull')
 
     @abc.abstractmethod
     def _checkProcess(self):
@@ -142,30 +163,37 @@ class TaskBase(object, metaclass=abc.ABCMeta):
     def task_run(self, params: dict):
         self.error = None
         self.params = params
+        metrics = Metrics()
         for attempt in range(self.retry):
-            if isinstance(self.timer, ReentrantTimer):
-                if self.timer.is_active():
-                    self.timer.stop_timer()
-                self.timer.start_timer()
+            if attempt > 0:
+                metrics.inc("task_retries", 1, self.name)
+            token = Watchdog().watch(self.name, self.timeout, self._cancel)
             try:
                 self._run(params)
-                self._doFormat()
-                self._doExpect()
+                if token.expired:
+                    raise TimeoutError(f"Task '{self.name}' running time exceeded in {self.timeout} second"
+                                       f"{'s' if self.timeout != 1 else ''}, watchdog latency "
+                                       f"{token.latency * 1000:.1f}ms.")
+                with metrics.timer("format_time", self.name):
+                    self._doFormat()
+                with metrics.timer("expect_time", self.name):
+                    self._doExpect()
                 self.error = None
                 break
             except TimeoutError as e:
                 self.error = e
                 util.printTraceback(e, self.logger.error)
                 continue
-            except BaseException as e:
+            except Exception as e:
+                # BaseException like KeyboardInterrupt goes to worker for stopping
                 self.logger.error(f"Task '{self.name}' exception occurred while processing: {e!r}")
                 util.printTraceback(e, self.logger.error)
                 self.error = e
                 continue
-        if isinstance(self.timer, ReentrantTimer):
-            if self.timer.is_active():
-                self.timer.stop_timer()
-        gc.collect()
+            finally:
+                Watchdog().unwatch(token)
+        if self.error is not None:
+            metrics.inc("task_errors", 1, self.name)
 
     def getValue(self):
         return self.value
@@ -28,7 +28,58 @@ class AgentConfig(config_base.ConfigBase):
         return self._findKey("report")
 
     def getSubmitConfig(self):
-        return self._findKey("submit")
+        """
+        获得配置文件中第一个提交器的配置
+        :return:
+        :rtype: dict
+        """
+        configs = self.getSubmitConfigs()
+        return configs[0] if configs else None
+
+    def getSubmitConfigs(self):
+        """
+        获得配置文件中所有提交器的配置, 'submit' 可以是一个提交器或提交器列表
+        :return:
+        :rtype: list
+        """
+        configs = self._findKey("submit")
+        if configs is None:
+            return []
+        if isinstance(configs, dict):
+            return [configs]
+        return list(configs)
+
+    def getSubmitQueueConfig(self):
+        """
+        获得配置文件中任务到提交队列的过载策略
+        :return:
+        :rtype: dict
+        """
+        return self._findKey("submit_queue")
+
+    def getMetricsConfig(self):
+        """
+        获得配置文件中Agent自身指标的配置
+        :return:
+        :rtype: dict
+        """
+        return self._findKey("metrics")
+
+    def getProfileConfig(self):
+        """
+        获得配置文件中运行时性能剖析的配置
+        :return:
+        :rtype: dict
+        """
+        return self._findKey("profile")
+
+    def getReloadConfig(self):
+        """
+        获得配置文件中热加载配置的设置
+        :return:
+        :rtype: dict
+        """
+        return self._findKey("reload")
 
     def getPerfmonItems(self):
         """
@@ -38,6 +89,14 @@ class AgentConfig(config_base.ConfigBase):
         """
         return self._findKey("perfmon")
 
+    def getGcConfig(self):
+        """
+        获得配置文件中垃圾回收策略
+        :return:
+        :rtype: dict
+        """
+        return self._findKey("gc")
+
     def getProcessCount(self):
         """
         获得配置文件中指定的进程数
@@ -45,3 +104,11 @@ class AgentConfig(config_base.ConfigBase):
         :rtype:
         """
         return self._findKey("process")
+
+    def getThreadCount(self):
+        """
+        获得配置文件中每个进程并发执行Perfmon项目的线程数
+        :return:
+        :rtype: int
+        """
+        return self._findKey("threads")
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+"""
+AsyncExecutor 异步子进程执行器
+每个工作进程一个asyncio事件循环线程, 多个命令可以在同一个工作进程中并发运行.
+子进程输出被增量读取到有界缓冲区, 超时由 asyncio.wait_for 控制, 到期后杀掉整个进程组.
+StreamProcess 常驻命令, 逐行解析输出保留最新样本, 退出后按退避时间重启.
+"""
+
+import asyncio
+import os
+import re
+import signal
+import threading
+import time
+from concurrent.futures import Future
+
+from src import util
+
+
+class ExecResult(object):
+    def __init__(self, returncode: int, stdout: bytes, stderr: bytes, timeout: bool, truncated: bool):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timeout = timeout
+        self.truncated = truncated
+
+
+class BoundedBuffer(object):
+    """
+    Keep the first `limit` bytes of a stream, drop the rest but keep count of it.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.buf = bytearray()
+        self.dropped = 0
+
+    def feed(self, data: bytes):
+        room = self.limit - len(self.buf)
+        if room > 0:
+            self.buf += data[:room]
+        self.dropped += max(len(data) - max(room, 0), 0)
+
+    def getvalue(self):
+        return bytes(self.buf)
+
+
+@util.singleton
+class AsyncExecutor(object):
+    ChunkSize = 65536
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.pid = None
+        self.mutex = threading.Lock()
+
+    def _ensure_loop(self):
+        if self.pid != os.getpid():
+            # the singleton is inherited by forked workers but its loop thread is not, start one per process
+            self.pid = os.getpid()
+            self.mutex = threading.Lock()
+            self.loop = None
+            self.thread = None
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.mutex:
+            if self.thread is None or not self.thread.is_alive():
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(None, self.loop.run_forever, "async_exec", daemon=True)
+                self.thread.start()
+
+    def run(self, command: list, stdin: str = "", timeout: float = None, limit: int = 4096) -> Future:
+        """
+        Run a command on the executor loop
+        :param limit: bytes kept for each of stdout and stderr
+        :return: future of ExecResult, cancel it to kill the command
+        """
+        self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._run(command, stdin, timeout, limit), self.loop)
+
+    def spawn(self, coro) -> Future:
+        """
+        Run a coroutine on the executor loop
+        """
+        self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    @staticmethod
+    async def _drain(stream: asyncio.StreamReader, buf: BoundedBuffer):
+        while True:
+            data = await stream.read(AsyncExecutor.ChunkSize)
+            if not data:
+                return
+            buf.feed(data)
+
+    @staticmethod
+    async def _feed(stream: asyncio.StreamWriter, data: str):
+        try:
+            if data:
+                stream.write(data.encode("utf-8"))
+                await stream.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            ...
+        finally:
+            stream.close()
+
+    @staticmethod
+    def _kill(process: asyncio.subprocess.Process):
+        if process.returncode is not None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            ...
+
+    async def _run(self, command: list, stdin: str, timeout: float, limit: int):
+        process = await asyncio.create_subprocess_exec(*command, stdin=asyncio.subprocess.PIPE,
+                                                       stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.PIPE,
+                                                       start_new_session=True)
+        stdout = BoundedBuffer(limit)
+        stderr = BoundedBuffer(limit)
+        timedout = False
+        gathering = asyncio.gather(self._feed(process.stdin, stdin), self._drain(process.stdout, stdout),
+                                   self._drain(process.stderr, stderr), process.wait())
+        # retrieve result of an interrupted gathering, keep asyncio from logging it
+        gathering.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            await asyncio.wait_for(gathering, timeout)
+        except asyncio.TimeoutError:
+            timedout = True
+            self._kill(process)
+            await process.wait()
+        except asyncio.CancelledError:
+            self._kill(process)
+            raise
+        return ExecResult(process.returncode, stdout.getvalue(), stderr.getvalue(), timedout,
+                          stdout.dropped > 0 or stderr.dropped > 0)
+
+
+class StreamProcess(object):
+    """
+    Long running command (vmstat 1, iostat -x 1...) supervised on the executor loop.
+    Every output line matching `match` becomes the latest sample, the command is restarted
+    with exponential backoff from `backoff_min` to `backoff_max` seconds when it exits.
+    """
+
+    def __init__(self, command: list, stdin: str = "", match: str = None, backoff_min: float = 1.0,
+                 backoff_max: float = 60.0):
+        self.command = command
+        self.stdin = stdin
+        self.match = re.compile(match) if match else None
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+
+        self.latest = None  # (monotonic time, line)
+        self.restarts = 0
+        self.returncode = None
+        self.running = False
+        self.future = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.future = AsyncExecutor().spawn(self._supervise())
+
+    def stop(self):
+        self.running = False
+        if isinstance(self.future, Future):
+            # cancelling the supervisor kills the process group
+            self.future.cancel()
+            self.future = None
+
+    def sample(self):
+        """
+        :return: (age in seconds, line) of the latest sample, or None if no line arrived yet
+        """
+        latest = self.latest
+        if latest is None:
+            return None
+        return time.monotonic() - latest[0], latest[1]
+
+    async def _supervise(self):
+        backoff = self.backoff_min
+        while self.running:
+            started = time.monotonic()
+            try:
+                await self._run_once()
+            except (OSError, ValueError):
+                # command not startable or line exceeds stream limit, retry after backoff
+                ...
+            if not self.running:
+                break
+            if time.monotonic() - started > self.backoff_max:
+                # ran long enough, it is not a crash loop
+                backoff = self.backoff_min
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.backoff_max)
+            self.restarts += 1
+
+    async def _run_once(self):
+        process = await asyncio.create_subprocess_exec(*self.command, stdin=asyncio.subprocess.PIPE,
+                                                       stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.DEVNULL,
+                                                       start_new_session=True)
+        try:
+            await AsyncExecutor._feed(process.stdin, self.stdin)
+            while True:
+                line = await process.stdout.readline()
+                if not line:
+                    break
+                text = line.decode("utf-8", errors="replace").rstrip("\r\n")
+                if self.match is None or self.match.search(text):
+                    self.latest = (time.monotonic(), text)
+        finally:
+            AsyncExecutor._kill(process)
+            self.returncode = await process.wait()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+Backpressure 过载策略类
+每个缓冲环节(任务→提交队列, 提交器缓冲区, 磁盘暂存)一个实例, 满了以后按策略阻塞或丢弃, 并统计丢弃数和阻塞时间
+
+configs:
+'limit'    : max results (queue: queue size) held by the stage (default: stage specific)
+'max_bytes': max bytes held by the stage, for stages measuring size (default: no limit)
+'policy'   : what to do with a new result when the stage is full
+             (choice: "block", "drop_oldest", "drop_newest", "sample", default: "block")
+             "block":       wait until there is room, the stage before fills up in turn
+             "drop_oldest": drop the oldest held result to make room
+             "drop_newest": drop the new result
+             "sample":      keep one of every 'sample' new results by dropping the oldest, drop the others
+'sample'   : sample rate of "sample" policy (default: 10)
+"""
+
+import time
+from queue import Empty, Full
+
+from src import util
+
+
+class Backpressure(object):
+    PolicyEnum = ('block', 'drop_oldest', 'drop_newest', 'sample')
+    StealTimeout = 0.05
+
+    def __init__(self, config: dict = None, name: str = "", limit: int = None, policy: str = "block"):
+        """
+        :param limit: default limit of the stage
+        :param policy: default policy of the stage
+        """
+        if config is None:
+            config = {}
+        self.name = name
+        try:
+            self.limit = util.checkKey("limit", config, int, "backpressure")
+        except ValueError:
+            self.limit = limit
+        try:
+            self.max_bytes = util.checkKey("max_bytes", config, int, "backpressure")
+        except ValueError:
+            self.max_bytes = None
+        try:
+            self.policy = util.checkKey("policy", config, str, "backpressure")
+        except ValueError:
+            self.policy = policy
+        self.policy = util.checkValueEnum(self.policy, Backpressure.PolicyEnum, valueName="policy")
+        try:
+            self.sample = util.checkKey("sample", config, int, "backpressure")
+        except ValueError:
+            self.sample = 10
+        if (self.limit is not None and self.limit <= 0) or (self.max_bytes is not None and self.max_bytes <= 0) \
+                or self.sample <= 0:
+            raise ValueError(f"backpressure '{name}' limit, max_bytes and sample must be positive.")
+
+        self.overflows = 0  # new results arrived while full
+        self.dropped_oldest = 0
+        self.dropped_newest = 0
+        self.blocked = 0  # results waited for room
+        self.blocked_time = 0.0  # seconds waited for room
+
+    def full(self, count: int, size: int = 0):
+        return (self.limit is not None and count >= self.limit) or \
+            (self.max_bytes is not None and size >= self.max_bytes)
+
+    def action(self):
+        """
+        Decide for a new result arrived while the stage is full
+        :return: "block", "drop_oldest" or "drop_newest"
+        """
+        self.overflows += 1
+        if self.policy == "sample":
+            return "drop_oldest" if self.overflows % self.sample == 0 else "drop_newest"
+        return self.policy
+
+    def dropOldest(self, count: int = 1):
+        self.dropped_oldest += count
+
+    def dropNewest(self, count: int = 1):
+        self.dropped_newest += count
+
+    def block(self, seconds: float):
+        self.blocked += 1
+        self.blocked_time += seconds
+
+    def put(self, queue, item):
+        """
+        Put item into a (multiprocessing) queue under the policy, the queue size is the limit
+        :return: True if item is queued
+        """
+        try:
+            queue.put_nowait(item)
+            return True
+        except Full:
+            ...
+        match self.action():
+            case "block":
+                begin = time.monotonic()
+                queue.put(item)
+                self.block(time.monotonic() - begin)
+                return True
+            case "drop_oldest":
+                try:
+                    # items put by this process may still be in the feeder buffer of a multiprocessing queue
+                    oldest = queue.get(timeout=Backpressure.StealTimeout)
+                    if isinstance(oldest, dict) and oldest.get('cmd') not in ("result", "error"):
+                        # a control command is never dropped, the new result is dropped instead
+                        queue.put(oldest)
+                        self.dropNewest()
+                        return False
+                    self.dropOldest()
+                except Empty:
+                    ...
+                try:
+                    queue.put_nowait(item)
+                    return True
+                except Full:
+                    self.dropNewest()
+                    return False
+            case default:
+                self.dropNewest()
+                return False
+
+    def dropped(self):
+        return self.dropped_oldest + self.dropped_newest
+
+    def get_stats(self):
+        return {
+            'policy': self.policy,
+            'overflows': self.overflows,
+            'dropped_oldest': self.dropped_oldest,
+            'dropped_newest': self.dropped_newest,
+            'blocked': self.blocked,
+            'blocked_time': round(self.blocked_time, 3),
+        }
@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+
+"""
+Columnar 列式存储类
+结果按列缓冲, 嵌套字典展开为列, 每次刷新写一个压缩列块, 键名只在列块头部出现一次.
+安装了 pyarrow 时每个列块写成一个 Parquet 文件, 否则写内置列块格式.
+
+builtin segment: <path>/<sequence>.pmc, magic b"PMC1" followed by chunks
+chunk: b"CHNK" + rows(4 bytes) + meta length(4 bytes, big endian) + meta json + column payloads
+    meta: {"columns": [{"path": [...], "type": "i8"|"f8"|"str"|"json", "nulls": bool, "size": <payload size>,
+                        "dict_length": <bytes of the dictionary>}]}
+    payload (zlib): null mask (1 byte per row, if nulls) + values
+        "i8": delta encoded int64, "f8": float64, "str"/"json": json array of distinct values + uint32 index per row
+arrow segment: <path>/<sequence>.parquet, one chunk, non numeric columns of mixed types stored as json strings
+
+reader:
+python3 -m src.core.columnar <path> [--info] [--columns name,...] [--limit N]
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+from src.logger import Logger
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+Magic = b"PMC1"
+ChunkHeader = struct.Struct(">4sII")
+ChunkTag = b"CHNK"
+BuiltinSuffix = ".pmc"
+ArrowSuffix = ".parquet"
+EngineEnum = ("auto", "arrow", "builtin")
+Int64Range = (-(2 ** 62), 2 ** 62)  # deltas of int64 columns stay in int64
+
+
+def flatten(row: dict, prefix: tuple = (), out: dict = None) -> dict:
+    """
+    :return: column path (tuple of keys) => value, nested non-empty dicts become columns of their own
+    """
+    if out is None:
+        out = {}
+    for key, value in row.items():
+        path = prefix + (str(key),)
+        if isinstance(value, dict) and value:
+            flatten(value, path, out)
+        else:
+            out[path] = value
+    return out
+
+
+def unflatten(columns: dict) -> dict:
+    """
+    Reverse of flatten, null values are left out
+    """
+    row = {}
+    for path, value in columns.items():
+        if value is None:
+            continue
+        node = row
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = value
+    return row
+
+
+def columnName(path) -> str:
+    return ".".join(path)
+
+
+def columnType(values: list) -> str:
+    kind = None
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            return "json"
+        if isinstance(value, int):
+            if not Int64Range[0] <= value < Int64Range[1]:
+                return "json"
+            kind = {None: "i8", 'i8': "i8", 'f8': "f8"}.get(kind, "json")
+        elif isinstance(value, float):
+            kind = "f8" if kind in (None, "i8", "f8") else "json"
+        elif isinstance(value, str):
+            kind = "str" if kind in (None, "str") else "json"
+        else:
+            return "json"
+        if kind == "json":
+            return kind
+    return kind or "json"
+
+
+def columnsOf(rows: list) -> dict:
+    """
+    :return: column path => values of every row, None where a row has no such column
+    """
+    flats = [flatten(row) for row in rows]
+    paths = {}
+    for flat in flats:
+        for path in flat:
+            paths[path] = None
+    return {path: [flat.get(path) for flat in flats] for path in paths}
+
+
+def _littleEndian(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _fromLittleEndian(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def _dictKey(value, kind: str):
+    return value if kind == "str" else json.dumps(value, sort_keys=True, default=str)
+
+
+def encodeColumn(values: list, kind: str) -> tuple:
+    """
+    :return: (raw payload, dictionary length, has nulls)
+    """
+    nulls = any(value is None for value in values)
+    parts = [bytes(value is None for value in values)] if nulls else []
+    dict_length = 0
+    match kind:
+        case "i8":
+            deltas = array("q")
+            previous = 0
+            for value in values:
+                value = previous if value is None else value
+                deltas.append(value - previous)
+                previous = value
+            parts.append(_littleEndian(deltas))
+        case "f8":
+            parts.append(_littleEndian(array("d", (0.0 if value is None else float(value) for value in values))))
+        case default:
+            index = {}
+            distinct = []
+            indexes = array("I")
+            for value in values:
+                key = _dictKey(value, kind)
+                if key not in index:
+                    index[key] = len(distinct)
+                    distinct.append(value)
+                indexes.append(index[key])
+            dictionary = json.dumps(distinct, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+            dict_length = len(dictionary)
+            parts.append(dictionary)
+            parts.append(_littleEndian(indexes))
+    return b"".join(parts), dict_length, nulls
+
+
+def decodeColumn(raw: bytes, kind: str, rows: int, nulls: bool, dict_length: int) -> list:
+    offset = rows if nulls else 0
+    mask = raw[:rows] if nulls else None
+    match kind:
+        case "i8":
+            values = []
+            previous = 0
+            for delta in _fromLittleEndian("q", raw[offset:]):
+                previous += delta
+                values.append(previous)
+        case "f8":
+            values = _fromLittleEndian("d", raw[offset:]).tolist()
+        case default:
+            distinct = json.loads(raw[offset:offset + dict_length])
+            values = [distinct[index] for index in _fromLittleEndian("I", raw[offset + dict_length:])]
+    if mask is not None:
+        values = [None if null else value for null, value in zip(mask, values)]
+    return values
+
+
+def encodeChunk(rows: list, level: int = 6) -> bytes:
+    columns = columnsOf(rows)
+    metas = []
+    payloads = []
+    for path, values in columns.items():
+        kind = columnType(values)
+        raw, dict_length, nulls = encodeColumn(values, kind)
+        payload = zlib.compress(raw, level)
+        metas.append({'path': list(path), 'type': kind, 'nulls': nulls, 'size': len(payload),
+                      'dict_length': dict_length})
+        payloads.append(payload)
+    meta = json.dumps({'columns': metas}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return ChunkHeader.pack(ChunkTag, len(rows), len(meta)) + meta + b"".join(payloads)
+
+
+def readChunks(fd, columns: set = None):
+    """
+    Read chunks of a builtin segment, a truncated or broken chunk (e.g. the agent was killed while writing)
+    ends the segment with a warning, chunks before it are still read
+    :param columns: names of columns decoded, all columns if None
+    :return: iterator of (rows, {path: values})
+    """
+    if fd.read(len(Magic)) != Magic:
+        raise ValueError(f"'{fd.name}' is not a columnar segment")
+    logger = Logger().getLogger(__name__)
+    size = os.fstat(fd.fileno()).st_size
+    while True:
+        offset = fd.tell()
+        header = fd.read(ChunkHeader.size)
+        if not header:
+            return
+        if len(header) < ChunkHeader.size:
+            logger.warning(f"'{fd.name}' has a truncated chunk header at {offset}, rest of the segment skipped.")
+            return
+        tag, rows, meta_length = ChunkHeader.unpack(header)
+        if tag != ChunkTag:
+            logger.warning(f"'{fd.name}' has a broken chunk at {offset}, rest of the segment skipped.")
+            return
+        try:
+            meta = fd.read(meta_length)
+            if len(meta) < meta_length:
+                raise ValueError(f"meta needs {meta_length} bytes, {len(meta)} found")
+            meta = json.loads(meta)
+            # skipped columns are seeked over, so check the payloads are all there first
+            payload = sum(column['size'] for column in meta['columns'])
+            if size - fd.tell() < payload:
+                raise ValueError(f"payload needs {payload} bytes, {size - fd.tell()} found")
+            decoded = {}
+            for column in meta['columns']:
+                path = tuple(column['path'])
+                if columns is not None and columnName(path) not in columns:
+                    fd.seek(column['size'], os.SEEK_CUR)
+                    continue
+                raw = zlib.decompress(fd.read(column['size']))
+                decoded[path] = decodeColumn(raw, column['type'], rows, column['nulls'], column['dict_length'])
+        except (ValueError, KeyError, TypeError, zlib.error) as e:
+            logger.warning(f"'{fd.name}' has a truncated chunk at {offset}, rest of the segment skipped: {e}")
+            return
+        yield rows, decoded
+
+
+def _arrowTable(rows: list):
+    columns = columnsOf(rows)
+    arrays = []
+    names = []
+    metas = []
+    for path, values in columns.items():
+        kind = columnType(values)
+        match kind:
+            case "i8":
+                arrays.append(pyarrow.array(values, pyarrow.int64()))
+            case "f8":
+                arrays.append(pyarrow.array([None if value is None else float(value) for value in values],
+                                            pyarrow.float64()))
+            case "str":
+                arrays.append(pyarrow.array(values, pyarrow.string()).dictionary_encode())
+            case default:
+                arrays.append(pyarrow.array([None if value is None else json.dumps(value, default=str)
+                                             for value in values], pyarrow.string()))
+        names.append(columnName(path))
+        metas.append({'path': list(path), 'type': kind})
+    schema_meta = {b"perfmon.columns": json.dumps(metas).encode("utf-8")}
+    return pyarrow.Table.from_arrays(arrays, names=names).replace_schema_metadata(schema_meta)
+
+
+def _readArrow(filepath: str, columns: set = None):
+    table = pyarrow.parquet.read_table(filepath)
+    metas = json.loads((table.schema.metadata or {}).get(b"perfmon.columns", b"[]"))
+    decoded = {}
+    for meta, name in zip(metas, table.column_names):
+        if columns is not None and name not in columns:
+            continue
+        values = table.column(name).to_pylist()
+        if meta['type'] == "json":
+            values = [None if value is None else json.loads(value) for value in values]
+        decoded[tuple(meta['path'])] = values
+    yield table.num_rows, decoded
+
+
+def resolveEngine(engine: str) -> str:
+    """
+    :return: "arrow" or "builtin" for a configured engine
+    """
+    if engine == "auto":
+        return "arrow" if pyarrow is not None else "builtin"
+    if engine == "arrow" and pyarrow is None:
+        raise ValueError(f"columnar engine 'arrow' needs module 'pyarrow' installed.")
+    return engine
+
+
+class ColumnWriter(object):
+    """
+    Write batches of results as column chunks into segments under a directory
+    """
+
+    def __init__(self, path: str, engine: str = "auto", level: int = 6, segment_bytes: int = 67108864):
+        self.path = path
+        self.engine = resolveEngine(engine)
+        self.level = level
+        self.segment_bytes = segment_bytes
+        os.makedirs(self.path, exist_ok=True)
+        self.sequence = max((sequence for sequence, filepath in segments(self.path)), default=0)
+        self.fd = None
+        self.size = 0
+        self.chunks = 0
+        self.rows = 0
+        self.bytes = 0
+
+    def _segmentPath(self, sequence: int, suffix: str):
+        return os.path.join(self.path, f"{sequence:016d}{suffix}")
+
+    def write(self, rows: list):
+        if not rows:
+            return
+        if self.engine == "arrow":
+            self.sequence += 1
+            filepath = self._segmentPath(self.sequence, ArrowSuffix)
+            compression = "zstd" if pyarrow.Codec.is_available("zstd") else "snappy"
+            pyarrow.parquet.write_table(_arrowTable(rows), filepath, compression=compression)
+            size = os.path.getsize(filepath)
+        else:
+            chunk = encodeChunk(rows, self.level)
+            if self.fd is None or self.size >= self.segment_bytes:
+                self.close()
+                self.sequence += 1
+                self.fd = open(self._segmentPath(self.sequence, BuiltinSuffix), "wb", buffering=0)
+                self.fd.write(Magic)
+                self.size = len(Magic)
+            self.fd.write(chunk)
+            self.size += len(chunk)
+            size = len(chunk)
+        self.chunks += 1
+        self.rows += len(rows)
+        self.bytes += size
+
+    def close(self):
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+
+    def get_stats(self):
+        return {'engine': self.engine, 'chunks': self.chunks, 'rows': self.rows, 'bytes': self.bytes}
+
+
+def segments(path: str):
+    """
+    :return: [(sequence, file path)] of segments under path (or path itself if it is a segment), in write order
+    """
+    if os.path.isfile(path):
+        return [(0, path)]
+    items = []
+    for name in os.listdir(path):
+        stem, suffix = os.path.splitext(name)
+        if suffix in (BuiltinSuffix, ArrowSuffix) and stem.isdigit():
+            items.append((int(stem), os.path.join(path, name)))
+    return sorted(items)
+
+
+class ColumnReader(object):
+    def __init__(self, path: str):
+        self.path = path
+
+    def chunks(self, columns: set = None):
+        """
+        :return: iterator of (rows, {path: values}) of every chunk
+        """
+        for sequence, filepath in segments(self.path):
+            if filepath.endswith(ArrowSuffix):
+                if pyarrow is None:
+                    raise ValueError(f"'{filepath}' needs module 'pyarrow' installed to read.")
+                yield from _readArrow(filepath, columns)
+            else:
+                with open(filepath, "rb") as fd:
+                    yield from readChunks(fd, columns)
+
+    def columns(self, names: list):
+        """
+        :return: column name => values of all rows, None where a chunk has no such column
+        """
+        result = {name: [] for name in names}
+        for rows, decoded in self.chunks(set(names)):
+            found = {columnName(path): values for path, values in decoded.items()}
+            for name in names:
+                result[name].extend(found.get(name, [None] * rows))
+        return result
+
+    def rows(self, columns: set = None):
+        for rows, decoded in self.chunks(columns):
+            for i in range(rows):
+                yield unflatten({path: values[i] for path, values in decoded.items()})
+
+    def info(self):
+        chunks = 0
+        rows = 0
+        names = {}
+        for count, decoded in self.chunks():
+            chunks += 1
+            rows += count
+            for path in decoded:
+                names[columnName(path)] = None
+        size = sum(os.path.getsize(filepath) for sequence, filepath in segments(self.path))
+        return {'segments': len(segments(self.path)), 'chunks': chunks, 'rows': rows, 'bytes': size,
+                'columns': list(names)}
+
+
+def argBuilder():
+    argparser = argparse.ArgumentParser(sys.argv[0], description="Read columnar segments written by column submit")
+    argparser.add_argument("path", type=str, help="segment directory or segment file")
+    argparser.add_argument("--info", action="store_true", help="print segments, chunks, rows and columns",
+                           dest="info")
+    argparser.add_argument("--columns", type=str, default=None, help="comma separated column names to read",
+                           dest="columns")
+    argparser.add_argument("--limit", type=int, default=None, help="rows to print", dest="limit")
+    return argparser.parse_args()
+
+
+def main():
+    args = argBuilder()
+    reader = ColumnReader(args.path)
+    if args.info:
+        print(json.dumps(reader.info(), ensure_ascii=False, indent=2))
+        return
+    columns = set(args.columns.split(",")) if args.columns else None
+    for count, row in enumerate(reader.rows(columns)):
+        if args.limit is not None and count >= args.limit:
+            break
+        print(json.dumps(row, ensure_ascii=False, default=str))
+
+
+if __name__ == "__main__":
+    main()
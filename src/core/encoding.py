@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+
+"""
+Encoding 结果编码类
+提交扇出时每种格式只编码一次, 同一份字节交给所有使用该格式的提交器
+安装了 orjson / msgpack 时使用它们, 否则使用标准库和内置的 MessagePack 编码
+
+formats:
+'JsonEachRow'   : one compact json object per line
+'PythonRepr'    : one python repr per line
+'MessagePack'   : MessagePack objects one after another, self-delimiting
+'LengthPrefixed': varint length + MessagePack object, protobuf style framing for readers skipping records
+
+orjson / msgpack are imported when an encoder of their format is first built.
+Sinks writing the result dicts on their own (column chunks) use no format, their results are not encoded at all.
+"""
+
+import abc
+import importlib
+import json
+import struct
+
+_NativeModules = {}  # module name => module, None when not installed
+
+
+def _native(name: str):
+    """
+    Optional native module, imported on first use
+    """
+    if name not in _NativeModules:
+        try:
+            _NativeModules[name] = importlib.import_module(name)
+        except ImportError:
+            _NativeModules[name] = None
+    return _NativeModules[name]
+
+
+class Encoder(object, metaclass=abc.ABCMeta):
+    """
+    Encode one result into bytes (a record), batch records into a stream and read them back
+    """
+    Name = None
+    Binary = False
+    Delimiter = b"\n"
+
+    def __init__(self, native: bool = True):
+        """
+        :param native: use the optional native module (orjson, msgpack) when it is installed
+        """
+        self.native = native
+
+    @abc.abstractmethod
+    def encode(self, item: dict) -> bytes:
+        raise NotImplementedError()
+
+    def decode(self, data: bytes):
+        raise NotImplementedError(f"format '{self.Name}' can not be decoded")
+
+    def batch(self, encoded: list) -> bytes:
+        """
+        Join records into a stream, every record is followed by the delimiter
+        """
+        if not encoded:
+            return b""
+        return self.Delimiter.join(encoded) + self.Delimiter
+
+    def stream(self, data: bytes):
+        """
+        Decode records from a stream written by batch
+        """
+        for line in data.split(self.Delimiter):
+            if line:
+                yield self.decode(line)
+
+
+class JsonEachRow(Encoder):
+    Name = "JsonEachRow"
+
+    def __init__(self, native: bool = True):
+        self.orjson = _native("orjson") if native else None
+        super().__init__(self.orjson is not None)
+        if self.native:
+            self.option = self.orjson.OPT_NON_STR_KEYS | self.orjson.OPT_PASSTHROUGH_DATETIME
+
+    def encode(self, item: dict) -> bytes:
+        if self.native:
+            try:
+                # datetime goes through default=str like the stdlib encoder instead of orjson iso format
+                return self.orjson.dumps(item, default=str, option=self.option)
+            except TypeError:
+                # integers over 64 bits and the like, stdlib json writes them
+                ...
+        return json.dumps(item, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+    def decode(self, data: bytes):
+        if self.native:
+            return self.orjson.loads(data)
+        return json.loads(data)
+
+
+class PythonRepr(Encoder):
+    Name = "PythonRepr"
+
+    def __init__(self, native: bool = True):
+        super().__init__(False)
+
+    def encode(self, item: dict) -> bytes:
+        return repr(item).encode("utf-8")
+
+    def decode(self, data: bytes):
+        import ast
+        return ast.literal_eval(data.decode("utf-8"))
+
+
+def _packObject(obj, out: list):
+    if obj is None:
+        out.append(b"\xc0")
+    elif obj is True:
+        out.append(b"\xc3")
+    elif obj is False:
+        out.append(b"\xc2")
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            out.append(bytes((obj,)))
+        elif -0x20 <= obj < 0:
+            out.append(struct.pack(">b", obj))
+        elif 0 <= obj <= 0xff:
+            out.append(struct.pack(">BB", 0xcc, obj))
+        elif 0 <= obj <= 0xffff:
+            out.append(struct.pack(">BH", 0xcd, obj))
+        elif 0 <= obj <= 0xffffffff:
+            out.append(struct.pack(">BI", 0xce, obj))
+        elif 0 <= obj <= 0xffffffffffffffff:
+            out.append(struct.pack(">BQ", 0xcf, obj))
+        elif -0x80 <= obj < 0:
+            out.append(struct.pack(">Bb", 0xd0, obj))
+        elif -0x8000 <= obj < 0:
+            out.append(struct.pack(">Bh", 0xd1, obj))
+        elif -0x80000000 <= obj < 0:
+            out.append(struct.pack(">Bi", 0xd2, obj))
+        elif -0x8000000000000000 <= obj < 0:
+            out.append(struct.pack(">Bq", 0xd3, obj))
+        else:
+            _packObject(str(obj), out)
+    elif isinstance(obj, float):
+        out.append(struct.pack(">Bd", 0xcb, obj))
+    elif isinstance(obj, str):
+        raw = obj.encode("utf-8")
+        length = len(raw)
+        if length < 0x20:
+            out.append(bytes((0xa0 | length,)))
+        elif length <= 0xff:
+            out.append(struct.pack(">BB", 0xd9, length))
+        elif length <= 0xffff:
+            out.append(struct.pack(">BH", 0xda, length))
+        else:
+            out.append(struct.pack(">BI", 0xdb, length))
+        out.append(raw)
+    elif isinstance(obj, (bytes, bytearray)):
+        length = len(obj)
+        if length <= 0xff:
+            out.append(struct.pack(">BB", 0xc4, length))
+        elif length <= 0xffff:
+            out.append(struct.pack(">BH", 0xc5, length))
+        else:
+            out.append(struct.pack(">BI", 0xc6, length))
+        out.append(bytes(obj))
+    elif isinstance(obj, (list, tuple)):
+        length = len(obj)
+        if length < 0x10:
+            out.append(bytes((0x90 | length,)))
+        elif length <= 0xffff:
+            out.append(struct.pack(">BH", 0xdc, length))
+        else:
+            out.append(struct.pack(">BI", 0xdd, length))
+        for value in obj:
+            _packObject(value, out)
+    elif isinstance(obj, dict):
+        length = len(obj)
+        if length < 0x10:
+            out.append(bytes((0x80 | length,)))
+        elif length <= 0xffff:
+            out.append(struct.pack(">BH", 0xde, length))
+        else:
+            out.append(struct.pack(">BI", 0xdf, length))
+        for key, value in obj.items():
+            _packObject(key, out)
+            _packObject(value, out)
+    else:
+        # same as the json encoders, unknown objects (datetime, ...) are written as strings
+        _packObject(str(obj), out)
+
+
+def packb(obj) -> bytes:
+    """
+    Built-in MessagePack packer, used when msgpack is not installed
+    """
+    out = []
+    _packObject(obj, out)
+    return b"".join(out)
+
+
+_Fixed = {
+    0xcc: struct.Struct(">B"), 0xcd: struct.Struct(">H"), 0xce: struct.Struct(">I"), 0xcf: struct.Struct(">Q"),
+    0xd0: struct.Struct(">b"), 0xd1: struct.Struct(">h"), 0xd2: struct.Struct(">i"), 0xd3: struct.Struct(">q"),
+    0xca: struct.Struct(">f"), 0xcb: struct.Struct(">d"),
+}
+_Lengths = {
+    0xd9: struct.Struct(">B"), 0xda: struct.Struct(">H"), 0xdb: struct.Struct(">I"),  # str
+    0xc4: struct.Struct(">B"), 0xc5: struct.Struct(">H"), 0xc6: struct.Struct(">I"),  # bin
+    0xdc: struct.Struct(">H"), 0xdd: struct.Struct(">I"),  # array
+    0xde: struct.Struct(">H"), 0xdf: struct.Struct(">I"),  # map
+}
+
+
+def _unpackObject(data: bytes, offset: int):
+    """
+    :return: (object, offset after it)
+    """
+    tag = data[offset]
+    offset += 1
+    if tag < 0x80:
+        return tag, offset
+    if tag >= 0xe0:
+        return tag - 0x100, offset
+    if 0xa0 <= tag <= 0xbf:
+        end = offset + (tag & 0x1f)
+        return data[offset:end].decode("utf-8"), end
+    if 0x90 <= tag <= 0x9f:
+        return _unpackArray(data, offset, tag & 0x0f)
+    if 0x80 <= tag <= 0x8f:
+        return _unpackMap(data, offset, tag & 0x0f)
+    match tag:
+        case 0xc0:
+            return None, offset
+        case 0xc2:
+            return False, offset
+        case 0xc3:
+            return True, offset
+    if tag in _Fixed:
+        fixed = _Fixed[tag]
+        return fixed.unpack_from(data, offset)[0], offset + fixed.size
+    if tag in _Lengths:
+        prefix = _Lengths[tag]
+        length = prefix.unpack_from(data, offset)[0]
+        offset += prefix.size
+        if tag in (0xdc, 0xdd):
+            return _unpackArray(data, offset, length)
+        if tag in (0xde, 0xdf):
+            return _unpackMap(data, offset, length)
+        end = offset + length
+        if tag in (0xd9, 0xda, 0xdb):
+            return data[offset:end].decode("utf-8"), end
+        return bytes(data[offset:end]), end
+    raise ValueError(f"MessagePack type 0x{tag:02x} is not supported")
+
+
+def _unpackArray(data: bytes, offset: int, length: int):
+    items = []
+    for i in range(length):
+        item, offset = _unpackObject(data, offset)
+        items.append(item)
+    return items, offset
+
+
+def _unpackMap(data: bytes, offset: int, length: int):
+    items = {}
+    for i in range(length):
+        key, offset = _unpackObject(data, offset)
+        items[key], offset = _unpackObject(data, offset)
+    return items, offset
+
+
+def unpackb(data: bytes):
+    """
+    Built-in MessagePack unpacker, used when msgpack is not installed
+    """
+    item, offset = _unpackObject(data, 0)
+    if offset != len(data):
+        raise ValueError(f"MessagePack data has {len(data) - offset} extra bytes")
+    return item
+
+
+class MessagePack(Encoder):
+    Name = "MessagePack"
+    Binary = True
+    Delimiter = b""
+
+    def __init__(self, native: bool = True):
+        self.msgpack = _native("msgpack") if native else None
+        super().__init__(self.msgpack is not None)
+
+    def encode(self, item: dict) -> bytes:
+        if self.native:
+            return self.msgpack.packb(item, default=str, use_bin_type=True)
+        return packb(item)
+
+    def decode(self, data: bytes):
+        if self.native:
+            return self.msgpack.unpackb(data, raw=False, strict_map_key=False)
+        return unpackb(data)
+
+    def batch(self, encoded: list) -> bytes:
+        return b"".join(encoded)
+
+    def stream(self, data: bytes):
+        if self.native:
+            unpacker = self.msgpack.Unpacker(raw=False, strict_map_key=False)
+            unpacker.feed(data)
+            yield from unpacker
+            return
+        offset = 0
+        while offset < len(data):
+            item, offset = _unpackObject(data, offset)
+            yield item
+
+
+def varint(value: int) -> bytes:
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def readVarint(data: bytes, offset: int):
+    """
+    :return: (value, offset after it)
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+class LengthPrefixed(MessagePack):
+    """
+    Every record is a varint length followed by a MessagePack object, like delimited protobuf messages
+    """
+    Name = "LengthPrefixed"
+
+    def encode(self, item: dict) -> bytes:
+        payload = super().encode(item)
+        return varint(len(payload)) + payload
+
+    def decode(self, data: bytes):
+        length, offset = readVarint(data, 0)
+        return super().decode(data[offset:offset + length])
+
+    def stream(self, data: bytes):
+        offset = 0
+        while offset < len(data):
+            length, offset = readVarint(data, offset)
+            yield MessagePack.decode(self, data[offset:offset + length])
+            offset += length
+
+
+class Unencoded(Encoder):
+    """
+    Results are kept as dicts, every record is empty, so fan-out does no encoding work for the sink
+    """
+    Name = "Unencoded"
+
+    def encode(self, item: dict) -> bytes:
+        return b""
+
+
+EncoderTable = {
+    'JsonEachRow': JsonEachRow,
+    'PythonRepr': PythonRepr,
+    'MessagePack': MessagePack,
+    'LengthPrefixed': LengthPrefixed,
+}
+
+
+def textFormats():
+    return tuple(name for name, encoder in EncoderTable.items() if not encoder.Binary)
+
+
+def getEncoder(name: str, native: bool = True) -> Encoder:
+    """
+    :param name: format name, None for a sink taking the result dicts unencoded
+    """
+    if name is None:
+        return Unencoded(native)
+    if name not in EncoderTable:
+        raise ValueError(f"Submit format must in {','.join(EncoderTable)}, but get value: {name}")
+    return EncoderTable[name](native)
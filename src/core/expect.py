@@ -3,8 +3,27 @@
 """
 Expect class
 预期数据处理类
+
+expect can be a scalar type name, or a schema dict for structured values:
+{"type": "record", "fields": {"MemTotal": "int", ...}, "default": "real"}
+    value is a dict, listed fields are checked by their types (a missing field is None when its type is nullable),
+    other fields are checked by 'default' type, or dropped when 'default' is absent
+{"type": "samples", "value": "real", "labels": ["device", "field"], "separator": "."}
+    value is a list of {"labels": {...}, "value": x}, each labels dict has at least the names in 'labels'.
+    a dict value (e.g. procfs collectors) is converted, every key is split by 'separator' into the label values,
+    from the right, so only the first label may contain the separator (e.g. "eth0.100.rx_bytes" of a vlan device)
+
+expectColumn checks a whole column of values of one type at once, with numpy when it is installed
 """
 
+import builtins
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
 class ExpectError(RuntimeError):
     def __init__(self, msg):
         super().__init__(msg)
@@ -13,6 +32,164 @@ class ExpectError(RuntimeError):
 
 class Expect(object):
     ValidExpectEnum = ('int', 'intOrNull', 'real', 'realOrNull', 'string', 'stringOrNull', 'null')
+    ValidSchemaEnum = ('record', 'samples')
+    NullableEnum = ('intOrNull', 'realOrNull', 'stringOrNull', 'null')
+
+    NumpyThreshold = 64  # columns shorter than this are not worth the array conversion
+    NumpyTypes = {'int': "int64", 'real': "float64"}
+
+    ColumnTypes = {'int': (int, "'int'(int)"), 'real': (float, "'real'(float)"), 'string': (str, "'string'(str)")}
+
+    @staticmethod
+    def expectColumn(type: str, values: list):
+        """
+        Coerce and check a column of values of one type, a bad value does not stop the others
+        :return: (values, errors), a bad value is None in values and (index, message) in errors
+        """
+        nullable = type.endswith("OrNull")
+        base = type[:-len("OrNull")] if nullable else type
+        if base not in Expect.ColumnTypes:
+            if type not in Expect.ValidExpectEnum:
+                raise KeyError(f"type must be one of {Expect.ValidExpectEnum!r}, but '{type}' found")
+            return Expect._expectEach(type, values)
+        convert, typeName = Expect.ColumnTypes[base]
+        try:
+            # whole column at once, in C when every value converts,
+            # numpy takes None as nan and str takes None as "None", so columns with None go per value
+            if numpy is not None and base in Expect.NumpyTypes and len(values) >= Expect.NumpyThreshold:
+                if None not in values:
+                    return numpy.asarray(values, dtype=Expect.NumpyTypes[base]).tolist(), []
+            elif not nullable or None not in values:
+                return list(map(convert, values)), []
+        except (ValueError, TypeError, OverflowError):
+            # some value is bad, find out per value below
+            ...
+        result = []
+        errors = []
+        append = result.append
+        for index, value in enumerate(values):
+            if value is None and nullable:
+                append(None)
+                continue
+            try:
+                append(convert(value))
+            except (ValueError, TypeError, OverflowError):
+                append(None)
+                errors.append((index, f"value expect type {typeName}, but type '{builtins.type(value)}' found"))
+        return result, errors
+
+    @staticmethod
+    def _expectEach(type: str, values: list):
+        result = []
+        errors = []
+        for index, value in enumerate(values):
+            try:
+                result.append(Expect.expect(type, value))
+            except ExpectError as e:
+                result.append(None)
+                errors.append((index, e.msg))
+        return result, errors
+
+    @staticmethod
+    def describeErrors(errors: list, keys: list = None, limit: int = 5):
+        """
+        One line summary of expectColumn errors, keys name the values by index
+        """
+        shown = ", ".join(f"[{keys[index] if keys is not None else index}] {msg}" for index, msg in errors[:limit])
+        more = f" and {len(errors) - limit} more" if len(errors) > limit else ""
+        return f"{len(errors)} value{'s' if len(errors) != 1 else ''} failed: {shown}{more}"
+
+    @staticmethod
+    def checkSchema(schema):
+        """
+        Check an expect config, raise ValueError if it is not a type name or a valid schema
+        """
+        if isinstance(schema, str):
+            if schema not in Expect.ValidExpectEnum:
+                raise ValueError(f"expect must be one of {Expect.ValidExpectEnum!r}, but '{schema}' found")
+            return
+        if not isinstance(schema, dict):
+            raise ValueError(f"expect need str or dict, but '{type(schema)}' found")
+        match schema.get('type'):
+            case "record":
+                fields = schema.get('fields', {})
+                if not isinstance(fields, dict):
+                    raise ValueError(f"record expect 'fields' need dict, but '{type(fields)}' found")
+                for field, typ in fields.items():
+                    Expect.checkSchema(typ)
+                if schema.get('default') is not None:
+                    Expect.checkSchema(schema['default'])
+            case "samples":
+                Expect.checkSchema(schema.get('value', "real"))
+                labels = schema.get('labels', [])
+                if not isinstance(labels, list) or not all(isinstance(label, str) for label in labels):
+                    raise ValueError(f"samples expect 'labels' need a list of str")
+                if not isinstance(schema.get('separator', "."), str) or not schema.get('separator', "."):
+                    raise ValueError(f"samples expect 'separator' need a non-empty str")
+            case default:
+                raise ValueError(f"expect schema type must be one of {Expect.ValidSchemaEnum!r}, "
+                                 f"but '{schema.get('type')}' found")
+
+    @staticmethod
+    def expectRecord(schema: dict, value):
+        if not isinstance(value, dict):
+            raise ExpectError(f"value expect type 'record'(dict), but type '{type(value)}' found")
+        fields = schema.get('fields', {})
+        default = schema.get('default')
+        record = {}
+        for field, typ in fields.items():
+            if field not in value:
+                if not isinstance(typ, str) or typ not in Expect.NullableEnum:
+                    raise ExpectError(f"record field '{field}' expected but not found")
+                record[field] = None
+                continue
+            try:
+                record[field] = Expect.expect(typ, value[field])
+            except ExpectError as e:
+                raise ExpectError(f"record field '{field}': {e.msg}")
+        if default is None:
+            return record
+        others = [field for field in value if field not in fields]
+        if isinstance(default, dict):
+            for field in others:
+                try:
+                    record[field] = Expect.expect(default, value[field])
+                except ExpectError as e:
+                    raise ExpectError(f"record field '{field}': {e.msg}")
+            return record
+        values, errors = Expect.expectColumn(default, [value[field] for field in others])
+        if errors:
+            raise ExpectError(f"record fields {Expect.describeErrors(errors, others)}")
+        record.update(zip(others, values))
+        return record
+
+    @staticmethod
+    def expectSamples(schema: dict, value):
+        typ = schema.get('value', "real")
+        labels = schema.get('labels', [])
+        if isinstance(value, dict):
+            separator = schema.get('separator', ".")
+            samples = []
+            for key, item in value.items():
+                parts = str(key).rsplit(separator, len(labels) - 1) if labels else []
+                if len(parts) != len(labels):
+                    raise ExpectError(f"sample key '{key}' cannot be split into labels {labels!r}")
+                samples.append({'labels': dict(zip(labels, parts)), 'value': item})
+            value = samples
+        if not isinstance(value, list):
+            raise ExpectError(f"value expect type 'samples'(list), but type '{type(value)}' found")
+        for sample in value:
+            if not isinstance(sample, dict) or not isinstance(sample.get('labels'), dict) or "value" not in sample:
+                raise ExpectError(f"sample expect a dict with 'labels' and 'value', but '{sample!r}' found")
+            for label in labels:
+                if label not in sample['labels']:
+                    raise ExpectError(f"sample label '{label}' expected but not found in {sample['labels']!r}")
+        if isinstance(typ, dict):
+            return [{'labels': sample['labels'], 'value': Expect.expect(typ, sample['value'])} for sample in value]
+        values, errors = Expect.expectColumn(typ, [sample['value'] for sample in value])
+        if errors:
+            raise ExpectError(f"samples {Expect.describeErrors(errors)}")
+        return [{'labels': sample['labels'], 'value': item} for sample, item in zip(value, values)]
 
     @staticmethod
     def expectInt(value, nullable: bool):
@@ -57,7 +234,15 @@ class Expect(object):
         return value
 
     @staticmethod
-    def expect(type: str, value):
+    def expect(type, value):
+        if isinstance(type, dict):
+            match type.get('type'):
+                case "record":
+                    return Expect.expectRecord(type, value)
+                case "samples":
+                    return Expect.expectSamples(type, value)
+                case default:
+                    raise KeyError(f"schema type must be one of {Expect.ValidSchemaEnum!r}, but '{type.get('type')}' found")
         match type:
             case "int":
                 return Expect.expectInt(value, nullable=False)
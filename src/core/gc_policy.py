@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""
+GcPolicy 垃圾回收策略类
+代替每次任务执行后的强制 gc.collect()
+
+configs:
+'policy'  : when to run a full collection (choice: "none", "interval", "runs", default: "interval")
+            "none":     leave it to the automatic generational collector
+            "interval": collect at most once every 'interval' seconds
+            "runs":     collect after every 'runs' perfmon runs
+'interval': seconds between collections for "interval" policy (default: 60)
+'runs'    : perfmon runs between collections for "runs" policy (default: 1000)
+'freeze'  : move objects alive after config loaded (perfmon, task instances) to the permanent generation,
+            so collections no longer scan them (default: true)
+"""
+
+import gc
+import time
+
+from src import util
+
+
+class GcPolicy(object):
+    PolicyEnum = ('none', 'interval', 'runs')
+
+    def __init__(self, config: dict = None):
+        if config is None:
+            config = {}
+        try:
+            self.policy = util.checkKey("policy", config, str, "gc")
+        except ValueError:
+            self.policy = "interval"
+        self.policy = util.checkValueEnum(self.policy, GcPolicy.PolicyEnum, valueName="policy")
+
+        try:
+            self.interval = float(util.checkKey("interval", config, (int, float), "gc"))
+        except ValueError:
+            self.interval = 60.0
+
+        try:
+            self.runs = util.checkKey("runs", config, int, "gc")
+        except ValueError:
+            self.runs = 1000
+
+        try:
+            self.freeze = util.checkKey("freeze", config, bool, "gc")
+        except ValueError:
+            self.freeze = True
+
+        if self.interval <= 0 or self.runs <= 0:
+            raise ValueError(f"gc 'interval' and 'runs' must be positive.")
+
+        self.count = 0
+        self.last = time.monotonic()
+        self.collections = 0
+
+    def setup(self):
+        """
+        Called once objects of long life are built
+        """
+        if self.freeze:
+            gc.collect()
+            gc.freeze()
+        self.count = 0
+        self.last = time.monotonic()
+
+    def step(self):
+        """
+        Called after every perfmon run
+        """
+        self.count += 1
+        match self.policy:
+            case "interval":
+                now = time.monotonic()
+                if now - self.last < self.interval:
+                    return
+                self.last = now
+            case "runs":
+                if self.count < self.runs:
+                    return
+                self.count = 0
+            case default:
+                return
+        gc.collect()
+        self.collections += 1
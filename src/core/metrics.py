@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+
+"""
+Metrics Agent自身指标类
+每个进程一个实例, 记录计数器, 仪表和直方图; 工作进程定期把增量快照经反馈队列发给调度器, 由主进程汇总.
+主进程按间隔把汇总结果作为一个内部Perfmon项目的结果提交, 并可在本机HTTP端口上查询.
+
+recorded:
+counter   'task_runs', 'task_errors', 'task_retries'       label: perfmon name
+histogram 'task_latency', 'format_time', 'expect_time'    label: perfmon name, seconds
+histogram 'scheduler_lag'                                 label: perfmon name, seconds actual start after planned
+gauge     'queue_depth'                                   label: "task", "submit", submit sink name
+histogram 'submit_latency' (seconds), 'submit_batch' (results) label: submitter class name
+counter   'submit_failures'                               label: submitter class name
+
+configs:
+'enable'  : record metrics (default: true when 'metrics' config exists)
+'interval': seconds between self-metrics rows, workers send snapshots at least every 5 seconds (default: 60)
+'name'    : perfmon name of self-metrics rows (default: "agent_metrics")
+'listen'  : "host:port" of the local endpoint, GET /metrics (json) or /metrics/prometheus (default: no endpoint)
+"""
+
+import bisect
+import json
+import math
+import threading
+import time
+
+from src import util
+from src.logger import Logger
+
+
+class Histogram(object):
+    TimeBounds = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                  1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    SizeBounds = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+    def __init__(self, bounds: tuple = TimeBounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # last bucket is over the largest bound
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, snapshot: dict):
+        if tuple(snapshot['bounds']) != self.bounds:
+            raise ValueError(f"histogram bounds differ, can not be merged.")
+        for i, count in enumerate(snapshot['counts']):
+            self.counts[i] += count
+        self.count += snapshot['count']
+        self.sum += snapshot['sum']
+        self.max = max(self.max, snapshot['max'])
+
+    def quantile(self, q: float):
+        """
+        :return: upper bound of the bucket holding quantile q, max for the last bucket
+        """
+        if self.count <= 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {'bounds': list(self.bounds), 'counts': list(self.counts), 'count': self.count, 'sum': self.sum,
+                'max': self.max}
+
+    def summary(self):
+        return {'count': self.count, 'mean': self.sum / self.count if self.count else 0.0,
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99), 'max': self.max}
+
+
+class NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        ...
+
+
+class Timer(object):
+    def __init__(self, metrics, name: str, label: str):
+        self.metrics = metrics
+        self.name = name
+        self.label = label
+        self.begin = 0.0
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.begin, self.label)
+
+
+@util.singleton
+class Metrics(object):
+    Null = NullTimer()
+    SnapshotInterval = 5.0
+
+    def __init__(self):
+        self.enabled = False
+        self.interval = 60.0
+        self.name = "agent_metrics"
+        self.listen = None
+        self.mutex = threading.Lock()
+        self.counters = {}  # name => {label: value}
+        self.gauges = {}  # name => {label: value}
+        self.histograms = {}  # name => {label: Histogram}
+        self.probes = {}  # gauge name => {label: callable}, read when a snapshot is taken
+        self.sent_at = time.monotonic()
+
+    def setup(self, config: dict = None):
+        """
+        Called by main process before workers fork, workers inherit the settings
+        """
+        if config is None:
+            self.enabled = False
+            return
+        try:
+            self.enabled = util.checkKey("enable", config, bool, "metrics")
+        except ValueError:
+            self.enabled = True
+        try:
+            self.interval = float(util.checkKey("interval", config, (int, float), "metrics"))
+        except ValueError:
+            self.interval = 60.0
+        if self.interval <= 0:
+            raise ValueError(f"metrics interval must be positive, but '{self.interval}' found.")
+        try:
+            self.name = util.checkKey("name", config, str, "metrics")
+        except ValueError:
+            self.name = "agent_metrics"
+        try:
+            self.listen = util.checkKey("listen", config, str, "metrics")
+        except ValueError:
+            self.listen = None
+        if self.listen is not None:
+            host, _, port = self.listen.rpartition(":")
+            if not port.isdigit() or not 0 < int(port) < 65536:
+                raise ValueError(f"metrics listen must be 'host:port', but '{self.listen}' found.")
+
+    def forked(self):
+        """
+        Called in a worker right after fork: values and probes copied from the main process belong to it,
+        the worker starts empty so its deltas are not merged twice
+        """
+        with self.mutex:
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+            self.probes = {}
+            self.sent_at = time.monotonic()
+
+    def inc(self, name: str, value: float = 1, label: str = ""):
+        if not self.enabled:
+            return
+        with self.mutex:
+            labels = self.counters.setdefault(name, {})
+            labels[label] = labels.get(label, 0) + value
+
+    def gauge(self, name: str, value: float, label: str = ""):
+        if not self.enabled:
+            return
+        with self.mutex:
+            self.gauges.setdefault(name, {})[label] = value
+
+    def observe(self, name: str, value: float, label: str = "", bounds: tuple = Histogram.TimeBounds):
+        if not self.enabled:
+            return
+        with self.mutex:
+            labels = self.histograms.setdefault(name, {})
+            if label not in labels:
+                labels[label] = Histogram(bounds)
+            labels[label].observe(value)
+
+    def timer(self, name: str, label: str = ""):
+        if not self.enabled:
+            return Metrics.Null
+        return Timer(self, name, label)
+
+    def probe(self, name: str, label: str, func):
+        """
+        Register a gauge read from func when a snapshot is taken, e.g. queue depths
+        """
+        self.probes.setdefault(name, {})[label] = func
+
+    def _readProbes(self):
+        for name, labels in self.probes.items():
+            for label, func in labels.items():
+                try:
+                    self.gauge(name, func(), label)
+                except (NotImplementedError, OSError, ValueError):
+                    # multiprocessing queue size is not available on every platform, or queue closed
+                    ...
+
+    def due(self):
+        """
+        Worker snapshots are sent more often than rows, so a row holds the recent worker runs
+        """
+        return self.enabled and time.monotonic() - self.sent_at >= min(self.interval, Metrics.SnapshotInterval)
+
+    def snapshot(self, reset: bool = False):
+        """
+        :param reset: start counters and histograms over, workers send deltas to be merged
+        """
+        self._readProbes()
+        with self.mutex:
+            snapshot = {
+                'counters': {name: dict(labels) for name, labels in self.counters.items()},
+                'gauges': {name: dict(labels) for name, labels in self.gauges.items()},
+                'histograms': {name: {label: histogram.snapshot() for label, histogram in labels.items()}
+                               for name, labels in self.histograms.items()},
+            }
+            if reset:
+                self.counters = {}
+                self.histograms = {}
+                self.sent_at = time.monotonic()
+        return snapshot
+
+    def merge(self, snapshot: dict):
+        """
+        Add a worker snapshot into this process
+        """
+        with self.mutex:
+            for name, labels in snapshot.get('counters', {}).items():
+                mine = self.counters.setdefault(name, {})
+                for label, value in labels.items():
+                    mine[label] = mine.get(label, 0) + value
+            for name, labels in snapshot.get('gauges', {}).items():
+                self.gauges.setdefault(name, {}).update(labels)
+            for name, labels in snapshot.get('histograms', {}).items():
+                mine = self.histograms.setdefault(name, {})
+                for label, histogram in labels.items():
+                    if label not in mine:
+                        mine[label] = Histogram(histogram['bounds'])
+                    mine[label].merge(histogram)
+
+    def summary(self):
+        """
+        :return: counters, gauges and histogram summaries (count, mean, p50, p90, p99, max)
+        """
+        self._readProbes()
+        with self.mutex:
+            return {
+                'counters': {name: dict(labels) for name, labels in self.counters.items()},
+                'gauges': {name: dict(labels) for name, labels in self.gauges.items()},
+                'histograms': {name: {label: histogram.summary() for label, histogram in labels.items()}
+                               for name, labels in self.histograms.items()},
+            }
+
+    def prometheus(self):
+        """
+        :return: summary in prometheus text exposition format
+        """
+        self._readProbes()
+        lines = []
+        with self.mutex:
+            for name, labels in self.counters.items():
+                lines.append(f"# TYPE perfmon_{name} counter")
+                lines.extend(f"perfmon_{name}{_labelText(label)} {value}" for label, value in labels.items())
+            for name, labels in self.gauges.items():
+                lines.append(f"# TYPE perfmon_{name} gauge")
+                lines.extend(f"perfmon_{name}{_labelText(label)} {value}" for label, value in labels.items())
+            for name, labels in self.histograms.items():
+                lines.append(f"# TYPE perfmon_{name} histogram")
+                for label, histogram in labels.items():
+                    cumulative = 0
+                    for bound, count in zip(list(histogram.bounds) + [math.inf], histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == math.inf else repr(float(bound))
+                        lines.append(f"perfmon_{name}_bucket{_labelText(label, le)} {cumulative}")
+                    lines.append(f"perfmon_{name}_sum{_labelText(label)} {histogram.sum}")
+                    lines.append(f"perfmon_{name}_count{_labelText(label)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labelText(label: str, le: str = None):
+    pairs = []
+    if label:
+        escaped = label.replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'label="{escaped}"')
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _metricsHandler():
+    """
+    Request handler class of the local endpoint, http.server is only imported when 'listen' is configured
+    """
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            match self.path.split("?")[0]:
+                case "/metrics":
+                    body = json.dumps(Metrics().summary(), ensure_ascii=False).encode("utf-8")
+                    content_type = "application/json; charset=utf-8"
+                case "/metrics/prometheus":
+                    body = Metrics().prometheus().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                case default:
+                    self.send_error(404)
+                    return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            ...
+
+    return MetricsHandler
+
+
+class MetricsReporter(object):
+    """
+    Main process side: submits a self-metrics row every interval as an internal perfmon item,
+    and serves the local endpoint
+    """
+
+    def __init__(self, submit_queue):
+        self.submit_queue = submit_queue
+        self.event = threading.Event()
+        self.thread = None
+        self.server = None
+        self.server_thread = None
+
+        self.logger = Logger().getLogger(__name__)
+
+    def start(self):
+        metrics = Metrics()
+        if not metrics.enabled:
+            return
+        self.event.clear()
+        self.thread = threading.Thread(None, self._daemon, "metrics_reporter", daemon=True)
+        self.thread.start()
+        if metrics.listen:
+            from http.server import ThreadingHTTPServer
+            host, _, port = metrics.listen.rpartition(":")
+            self.server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), _metricsHandler())
+            self.server_thread = threading.Thread(None, self.server.serve_forever, "metrics_server", daemon=True)
+            self.server_thread.start()
+            self.logger.info(f"Metrics endpoint listening on http://{metrics.listen}/metrics")
+
+    def stop(self):
+        self.event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def row(self):
+        metrics = Metrics()
+        return {
+            'cmd': "result",
+            'name': metrics.name,
+            'params': {'datetime': util.now()},
+            'except': {'type': "record"},
+            'value': metrics.summary(),
+            'errno': 0,
+            'error': "",
+            'timestamp': util.timestamp(),
+        }
+
+    def _daemon(self):
+        while not self.event.wait(Metrics().interval):
+            try:
+                # never block on a full submit queue, the next row replaces a lost one
+                self.submit_queue.put_nowait(self.row())
+            except Exception as e:
+                self.logger.warning(f"Self-metrics row not submitted: {e!r}")
@@ -6,42 +6,70 @@ Perfmon sector
 @Ruilx
 """
 import importlib
-import inspect
 import types
 from multiprocessing import Queue
-from sched import scheduler as Scheduler
 
 from src import util
 from src.base import task_base
 from src.base.task_base import TaskBase
+from src.core.backpressure import Backpressure
+from src.core.metrics import Metrics
 from src.logger import Logger
 
 
 class Perfmon(object):
+    OverrunEnum = ('skip', 'queue', 'parallel')
+
+    # method => (module, class), a task module is imported when a configured task first uses it
     MethodTable = {
-        'readfile': ("ReadFile", "src.task.read_file", "ReadFile"),
-        'execute': ("Execute", "src.task.execute", "Execute"),
-        'dummy': ("Dummy", "src.task.dummy", "Dummy"),
+        'readfile': ("src.task.read_file", "ReadFile"),
+        'execute': ("src.task.execute", "Execute"),
+        'dummy': ("src.task.dummy", "Dummy"),
+        'procstat': ("src.task.procfs", "ProcStat"),
+        'meminfo': ("src.task.procfs", "MemInfo"),
+        'diskstats': ("src.task.procfs", "DiskStats"),
+        'netdev': ("src.task.procfs", "NetDev"),
     }
-
-    def __init__(self, agent_name: str, config: dict, queue: Queue):
+    TaskClasses = {}  # method => imported task class
+
+    def __init__(self, agent_name: str, config: dict, queue: Queue = None, setup_tasks: bool = True,
+                 backpressure: Backpressure = None):
+        """
+        :param setup_tasks: build live task instances, scheduler side only needs the perfmon header
+            (name, delay, priority), task instances are built by worker processes.
+        :param backpressure: policy of putting results into a full submit queue, default blocks
+        """
         self.agent_name = agent_name
         self.name = None
         self.type = None
         self.delay = None
         self.priority = None
+        self.align = False
+        self.overrun = "skip"
+        self.overrun_limit = 1
+        self.run_limit = 0.0
+        self.fanout = False
+        self.pinned = False  # a stateful task runs in the worker owning this perfmon only
         self.queue = queue
+        self.backpressure = backpressure
         self.tasks = []
-        self.scheduler = None
+        self.setup_tasks = setup_tasks
 
         self._parse_perfmon(config)
 
         self.logger = Logger().getLogger(__name__)
 
     def __del__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Release files and processes of all tasks, e.g. when the perfmon is removed or replaced by a config reload
+        """
         for task in self.tasks:
             if isinstance(task, TaskBase):
                 task.reset()
+        self.tasks = []
 
     def _parse_perfmon(self, config: dict):
         self.name = util.checkKey("name", config, str, "perfmon")
@@ -49,50 +77,111 @@ class Perfmon(object):
         self.delay = float(util.checkKey("delay", config, (float, int), "perfmon"))
 
         try:
-            self.priority = util.checkKey("priority", config, str, "perfmon")
+            self.priority = util.checkKey("priority", config, int, "perfmon")
         except ValueError:
             self.priority = 10
 
+        try:
+            self.align = util.checkKey("align", config, bool, "perfmon")
+        except ValueError:
+            self.align = False
+
+        # what to do with a due run while previous runs are still in flight:
+        # "skip": drop the run; "queue": keep at most `overrun_limit` runs waiting;
+        # "parallel": allow at most `overrun_limit` runs in flight at the same time
+        try:
+            self.overrun = util.checkKey("overrun", config, str, "perfmon")
+        except ValueError:
+            self.overrun = "skip"
+        self.overrun = util.checkValueEnum(self.overrun, Perfmon.OverrunEnum, valueName="overrun")
+        try:
+            self.overrun_limit = util.checkKey("overrun_limit", config, int, "perfmon")
+        except ValueError:
+            self.overrun_limit = 1
+        if self.overrun_limit <= 0:
+            raise ValueError(f"Perfmon '{self.name}' overrun_limit must be positive, but '{self.overrun_limit}' found.")
+
+        # submit one row per record field or sample instead of one row holding the whole structured value
+        try:
+            self.fanout = util.checkKey("fanout", config, bool, "perfmon")
+        except ValueError:
+            self.fanout = False
+
         tasks = util.checkKey("tasks", config, (list, dict), "perfmon")
+        # longest time a run may take, tasks run one after another with up to 'retry' attempts of 'timeout' each
+        self.run_limit = 0.0
+        for task in tasks if isinstance(tasks, list) else [tasks]:
+            if isinstance(task, dict) and isinstance(task.get('timeout'), (int, float)):
+                retry = task.get('retry', 3)
+                self.run_limit += task['timeout'] * (retry if isinstance(retry, int) and retry > 0 else 1)
+        self.pinned = any(Perfmon.task_class(util.checkKey("method", task, str, "task")).isStateful(task)
+                          for task in (tasks if isinstance(tasks, list) else [tasks]) if isinstance(task, dict))
+        if not self.setup_tasks:
+            return
         if isinstance(tasks, dict):
             self._parse_task(tasks)
         elif isinstance(tasks, list):
             for task in tasks:
                 self._parse_task(task)
 
-    def _parse_task(self, task: dict):
-        method = util.checkKey("method", task, str, "task")
-        g = globals()
+    @staticmethod
+    def task_class(method: str):
+        classObj = Perfmon.TaskClasses.get(method)
+        if classObj is not None:
+            return classObj
         if method not in Perfmon.MethodTable:
             raise ValueError(f"Method '{method}' has no class task instance, maybe this method is not supported.")
-        (global_var, module_path, class_name) = Perfmon.MethodTable[method]
-        if global_var not in g:
-            g[global_var] = getattr(importlib.import_module(module_path), class_name)
-        classObj = g[global_var]
+        (module_path, class_name) = Perfmon.MethodTable[method]
+        classObj = getattr(importlib.import_module(module_path), class_name)
 
-        if not inspect.isclass(classObj) or not issubclass(classObj, TaskBase):
+        if not isinstance(classObj, type) or not issubclass(classObj, TaskBase):
             raise RuntimeError(f"Task classobj has no class structure handled.")
+        Perfmon.TaskClasses[method] = classObj
+        return classObj
 
+    def _parse_task(self, task: dict):
+        classObj = Perfmon.task_class(util.checkKey("method", task, str, "task"))
         try:
             self.register_task(classObj(self.name, task))
         except TypeError as e:
             raise RuntimeError from e
 
+    @staticmethod
+    def check(agent_name: str, config: dict):
+        """
+        Validate a perfmon config, task configs are checked without opening files or starting processes
+        :return: Perfmon header without tasks
+        """
+        perfmon = Perfmon(agent_name, config, setup_tasks=False)
+        tasks = config['tasks']
+        for task in tasks if isinstance(tasks, list) else [tasks]:
+            if not isinstance(task, dict):
+                raise ValueError(f"Perfmon '{perfmon.name}' task config must be a dict.")
+            classObj = Perfmon.task_class(util.checkKey("method", task, str, "task"))
+            try:
+                classObj.checkConfig(perfmon.name, task)
+            except TypeError as e:
+                raise RuntimeError from e
+        return perfmon
+
     def register_task(self, task: TaskBase):
         self.tasks.append(task)
 
-    def register_schedule(self, scheduler: Scheduler = None):
-        if scheduler is not None:
-            self.scheduler = scheduler
-        if self.scheduler is not None:
-            self.scheduler.enter(self.delay, self.priority, self.run_task, (self.generate_params(),))
-
-    def generate_params(self):
+    @staticmethod
+    def generate_params(ts: float = None):
+        """
+        :param ts: planned wall-clock time of the run, default now
+        """
         return {
-            'datetime': util.now(),
+            'datetime': util.now(ts),
         }
 
     def run_task(self, params: dict):
+        Metrics().inc("task_runs", 1, self.name)
+        with Metrics().timer("task_latency", self.name):
+            self._run_task(params)
+
+    def _run_task(self, params: dict):
         taskCount = len(self.tasks)
         self.logger.debug(f"Perfmon '{self.name}' start running...")
         self.logger.debug(f"Perfmon '{self.name}' has {taskCount} task{'s' if taskCount != 1 else ''}.")
@@ -110,13 +199,33 @@ class Perfmon(object):
             params['_step'][task.getName()] = r_step
         if result is None:
             self.logger.warning(f"Perfmon '{self.name}' returns None result")
+            return
         if "_step" in result['params']:
             del result['params']['_step']
+        if self.fanout and result['cmd'] == "result" and isinstance(result['value'], (dict, list)):
+            for row in self.fanout_rows(result):
+                self.submit(row)
+            return
         self.submit(result)
-        # reload schedule
-        self.register_schedule()
+
+    @staticmethod
+    def fanout_rows(result: dict):
+        """
+        Split a structured result into rows of scalar value,
+        a record gives a row per field with 'field', samples give a row per sample with 'labels'
+        """
+        value = result['value']
+        if isinstance(value, dict):
+            for field, item in value.items():
+                yield {**result, 'field': field, 'value': item}
+        else:
+            for sample in value:
+                yield {**result, 'labels': sample['labels'], 'value': sample['value']}
 
     def submit(self, result):
         self.logger.debug(f"Perfmon '{self.name}' result:")
         self.logger.debug(f"{result!r}")
-        self.queue.put(result)
+        if isinstance(self.backpressure, Backpressure):
+            self.backpressure.put(self.queue, result)
+        else:
+            self.queue.put(result)
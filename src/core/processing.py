@@ -4,14 +4,27 @@
 Processing 进程管理器类
 可以开启指定个进程进行管理
 并在进程异常退出时杀掉重启
+
+每个工作进程有一个控制队列, 热加载配置时由主进程写入增删的Perfmon项目和配置代号;
+工作进程在执行每个任务前读取控制队列, 任务带有更新的代号时先等待对应的加载消息, 只重建变化的Perfmon.
+
+有状态的Perfmon (例如 procfs 计数器差值, 流模式的 execute) 固定在一个工作进程中:
+按名字的 crc32 对进程数取余选出所属进程, 只在该进程中创建, 调度器把它的任务投递到该进程的专属队列.
 """
 
-import gc
+import queue
 import signal
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Process, ProcessError, Queue
 
 from src import util
+from src.core.backpressure import Backpressure
+from src.core.gc_policy import GcPolicy
+from src.core.metrics import Metrics
 from src.core.perfmon import Perfmon
+from src.core.profiler import Profiler
 from src.logger import Logger
 
 
@@ -20,15 +33,43 @@ class ProcessFinished(BaseException):
 
 
 class ProcessEntity(object):
-    def __init__(self, queue_in: Queue, name: str):
+    ControlTimeout = 5
+    ForwardInterval = 0.5  # seconds a forward thread waits on a task queue before checking the loop still runs
+
+    def __init__(self, queue_in: Queue, queue_out: Queue, queue_feedback: Queue, agent_name: str,
+                 perfmon_configs: list, gc_policy: GcPolicy, thread_count: int, name: str,
+                 submit_queue_config: dict = None, queue_control: Queue = None, queue_pinned: Queue = None,
+                 index: int = 0, process_count: int = 1):
+        """
+        :param queue_pinned: runs of pinned perfmons owned by this worker
+        :param index: index of this worker in Processing, owner of pinned perfmons is chosen by it
+        """
         self.logger = Logger().getLogger(__name__)
         self.name = name
+        self.index = index
+        self.process_count = process_count
         self.queue_in = queue_in
+        self.queue_pinned = queue_pinned
+        self.inbox = None  # (queue name, message) moved by the forward threads when queue_pinned is set
+        self.wanted = None  # released when the loop asks for one shared task
+        self.asking = False  # a shared task was asked and not received yet
+        self.queue_control = queue_control  # config reloads of this worker only
+        self.generation = 0  # config generation applied in this worker
+        self.queue_out = queue_out
+        self.queue_feedback = queue_feedback
+        self.agent_name = agent_name
+        self.perfmon_configs = perfmon_configs
+        self.perfmons = {}  # name => Perfmon, built inside the worker process
+        self.gc_policy = gc_policy
+        self.thread_count = thread_count
+        self.pool = None  # runs perfmons concurrently when thread_count > 1
+        self.slots = None
+        self.locks = {}  # name => Lock, one perfmon instance never runs in two threads at the same time
+        self.submit_queue_config = submit_queue_config
+        self.backpressure = None  # policy of the submit queue when it is full, counters kept per worker
 
         self.running = True
 
-        self._setup()
-
     def _setup(self):
         def _signalHandle(sig, var2):
             match sig:
@@ -36,14 +77,217 @@ class ProcessEntity(object):
                     self.logger.info(f"Receive signal SIGINT, stopping process...")
                     self.running = False
                     raise ProcessFinished()
+                case signal.SIGTERM:
+                    self.logger.info(f"Receive signal SIGTERM, stopping process...")
+                    self.running = False
+                    raise ProcessFinished()
 
+        # worker is forked after agent signal handlers installed, override them in worker process
         signal.signal(signal.SIGINT, _signalHandle)
+        signal.signal(signal.SIGTERM, _signalHandle)
+        # config reloads reach workers through the control queue
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        # SIGUSR1/SIGUSR2 forwarded by agent toggle profiling of this worker
+        Profiler().install()
+        # queue depth probes of the agent are copied by fork, they would be read and merged from every worker
+        Metrics().forked()
+
+    def _setup_perfmons(self):
+        self.perfmons = {}
+        self.backpressure = Backpressure(self.submit_queue_config, "submit_queue")
+        for config in self.perfmon_configs:
+            if not self._owns(config):
+                continue
+            perfmon = self._build_perfmon(config)
+            if perfmon is None:
+                continue
+            self.perfmons[perfmon.name] = perfmon
+            self.locks[perfmon.name] = threading.Lock()
+        self.logger.info(f"ProcessEntity '{self.name}' has {len(self.perfmons)} perfmon item"
+                         f"{'s' if len(self.perfmons) != 1 else ''}.")
+
+    def _owns(self, config: dict):
+        """
+        :return: False if the perfmon is pinned to another worker
+        """
+        try:
+            perfmon = Perfmon(self.agent_name, config, setup_tasks=False)
+        except BaseException:
+            # a bad config is reported once by _build_perfmon
+            return True
+        return not perfmon.pinned or Processing.owner(perfmon.name, self.process_count) == self.index
+
+    def _release_perfmon(self, name: str):
+        lock = self.locks.pop(name, None)
+        if lock is None:
+            return
+        with lock:
+            perfmon = self.perfmons.pop(name, None)
+        if isinstance(perfmon, Perfmon):
+            perfmon.reset()
+
+    def _build_perfmon(self, config: dict):
+        try:
+            return Perfmon(self.agent_name, config, self.queue_out, backpressure=self.backpressure)
+        except BaseException as e:
+            self.logger.error(f"ProcessEntity '{self.name}' perfmon setup failed: {e!r}")
+            util.printTraceback(e, self.logger.error)
+            return None
+
+    def _reload(self, message: dict):
+        """
+        Apply a config reload: removed perfmons are released, added and changed ones are rebuilt,
+        all others keep their open files and processes
+        """
+        for name in message.get('remove', []):
+            self._release_perfmon(name)
+        for config in message.get('upsert', []):
+            if not self._owns(config):
+                # changed into a perfmon pinned to another worker
+                self._release_perfmon(config.get('name'))
+                continue
+            perfmon = self._build_perfmon(config)
+            if perfmon is None:
+                continue
+            lock = self.locks.setdefault(perfmon.name, threading.Lock())
+            # a run of the old instance in a pool thread finishes first
+            with lock:
+                old = self.perfmons.get(perfmon.name)
+                self.perfmons[perfmon.name] = perfmon
+            if isinstance(old, Perfmon):
+                old.reset()
+        self.generation = message.get('generation', self.generation)
+        self.logger.info(f"ProcessEntity '{self.name}' config generation {self.generation} applied, "
+                         f"{len(self.perfmons)} perfmon item{'s' if len(self.perfmons) != 1 else ''}.")
+
+    def _check_control(self, generation: int):
+        """
+        Apply reloads waiting in the control queue, a run of a newer generation waits for its reload
+        """
+        if self.queue_control is None:
+            return
+        while True:
+            block = self.generation < generation
+            try:
+                message = self.queue_control.get(block, ProcessEntity.ControlTimeout if block else None)
+            except queue.Empty:
+                if block:
+                    self.logger.warning(f"ProcessEntity '{self.name}' config generation {generation} not received, "
+                                        f"running with generation {self.generation}.")
+                return
+            if isinstance(message, dict) and message.get('cmd') == "reload":
+                self._reload(message)
+
+    def _forward(self, name: str, task_queue: Queue, wanted: threading.Semaphore = None):
+        """
+        Move messages of a task queue into the inbox, a shared task is only taken when the loop asked for one,
+        so the others stay in the shared queue for idle sibling workers
+        """
+        while True:
+            if wanted is not None:
+                wanted.acquire()
+            message = None
+            while self.running and message is None:
+                try:
+                    message = task_queue.get(timeout=ProcessEntity.ForwardInterval)
+                except queue.Empty:
+                    continue
+                except (EOFError, OSError, ValueError):
+                    # queue closed
+                    return
+            if not self.running:
+                if message is not None:
+                    # the loop left meanwhile, the message (e.g. the quit of a sibling) goes back for others
+                    task_queue.put(message)
+                return
+            self.inbox.put((name, message))
+
+    def _next_task(self):
+        """
+        :return: next message of the shared task queue or of the pinned queue of this worker
+        """
+        if self.queue_pinned is None:
+            return self.queue_in.get()
+        if self.inbox is None:
+            self.inbox = queue.SimpleQueue()
+            self.wanted = threading.Semaphore(0)
+            threading.Thread(None, self._forward, "forward_pinned", ("pinned", self.queue_pinned),
+                             daemon=True).start()
+            threading.Thread(None, self._forward, "forward_shared", ("shared", self.queue_in, self.wanted),
+                             daemon=True).start()
+        if not self.asking:
+            self.asking = True
+            self.wanted.release()
+        name, message = self.inbox.get()
+        if name == "shared":
+            self.asking = False
+        return message
+
+    def _run_perfmon(self, task: dict):
+        lock = self.locks.get(task['perfmon'])
+        if lock is None:
+            if task.get('generation', 0) < self.generation:
+                self.logger.debug(f"Perfmon '{task['perfmon']}' removed by config reload, run skipped.")
+            else:
+                self.logger.error(f"Perfmon '{task['perfmon']}' not found in process '{self.name}', skipped.")
+            return
+        with lock:
+            # looked up under the lock, a reload may have replaced the instance meanwhile
+            perfmon = self.perfmons.get(task['perfmon'])
+            if not isinstance(perfmon, Perfmon):
+                return
+            params = task['params'] if isinstance(task.get('params'), dict) else perfmon.generate_params()
+            perfmon.run_task(params)
+
+    def _task(self, task: dict):
+        Profiler().checkpoint()
+        try:
+            self._run_perfmon(task)
+        except Exception as e:
+            self.logger.error(f"Perfmon '{task['perfmon']}' run failed in process '{self.name}': {e!r}")
+            util.printTraceback(e, self.logger.error)
+        finally:
+            # scheduler keeps in-flight count of every perfmon for its overrun policy
+            self.queue_feedback.put({'cmd': "done", 'perfmon': task['perfmon']})
+            if self.slots is not None:
+                self.slots.release()
+            self._send_metrics()
+        self.gc_policy.step()
+
+    def _send_metrics(self, force: bool = False):
+        metrics = Metrics()
+        if metrics.enabled and (force or metrics.due()):
+            self.queue_feedback.put({'cmd': "metrics", 'process': self.name, 'metrics': metrics.snapshot(reset=True)})
+
+    def _setup_pool(self):
+        if self.thread_count > 1:
+            self.pool = ThreadPoolExecutor(self.thread_count, f"{self.name}_thread")
+            # bounds perfmon runs taken from task queue to free threads, others are left to sibling processes
+            self.slots = threading.Semaphore(self.thread_count)
+
+    def _reset_pool(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
 
     def daemon(self):
+        self._setup()
+        self._setup_perfmons()
+        self._setup_pool()
+        self.gc_policy.setup()
         self.logger.info(f"ProcessEntity '{self.name}' daemon is running...")
+        profiler = Profiler()
         while self.running:
+            profiler.checkpoint()
             try:
-                task = self.queue_in.get()
+                # a free thread is taken before the task, so queued runs are left to idle sibling processes
+                if self.slots is not None:
+                    self.slots.acquire()
+                task = self._next_task()
+                if self.slots is not None and not (isinstance(task, dict) and task.get('cmd') == "task"
+                                                   and "perfmon" in task):
+                    # only a perfmon run keeps its thread, released by _task when the run ends
+                    self.slots.release()
                 assert isinstance(task, dict)
                 assert "cmd" in task
                 match task['cmd']:
@@ -54,10 +298,13 @@ class ProcessEntity(object):
                     case "task":
                         # task struct:
                         # "perfmon": perfmon name, will find in perfmon list and do task.
+                        # "params": params generated by scheduler when the run is due.
                         assert "perfmon" in task
-                        perfmon = task['perfmon']
-                        assert isinstance(perfmon, Perfmon)
-                        perfmon.run_task(perfmon.generate_params())
+                        self._check_control(task.get('generation', 0))
+                        if self.pool is None:
+                            self._task(task)
+                        else:
+                            self.pool.submit(self._task, task)
             except ProcessFinished:
                 self.logger.info(f"Processing finished.")
                 self.running = False
@@ -77,14 +324,49 @@ class ProcessEntity(object):
                 self.logger.error(f"Processing has a base exception occurred: {e!r}")
                 util.printTraceback(e, self.logger.error)
                 self.running = False
+        if self.wanted is not None:
+            # the shared forward thread waiting for an ask sees the loop stopped
+            self.wanted.release()
+            while True:
+                try:
+                    name, message = self.inbox.get_nowait()
+                except queue.Empty:
+                    break
+                if name == "shared":
+                    # taken for this worker but not run, left to the siblings
+                    self.queue_in.put(message)
+        # already leaving, the SIGTERM following a quit command must not break the last metrics and profile dumps,
+        # Processing kills the worker if it does not exit in time
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        self._reset_pool()
+        # runs since the last snapshot are not lost, the scheduler merges them if it is still running
+        self._send_metrics(force=True)
+        profiler.close()
+        if isinstance(self.backpressure, Backpressure):
+            self.logger.info(f"ProcessEntity '{self.name}' submit queue: {self.backpressure.get_stats()!r}")
         self.logger.info(f"ProcessEntity '{self.name}' leave daemon <------")
 
 
 class Processing(object):
-    def __init__(self, process_count: int, task_queue_size: int = 50):
+    def __init__(self, process_count: int, agent_name: str, submit_queue: Queue, gc_policy: GcPolicy = None,
+                 thread_count: int = 1, task_queue_size: int = 50, submit_queue_config: dict = None):
+        """
+        :param task_queue_size: size of the shared task queue and of the pinned queue of every worker
+        :param submit_queue_config: backpressure configs of putting results into the submit queue
+        """
         self.process_count = process_count
-        self.processes = {}  # name => {'entity': ProcessEntity, 'process': Process}
+        self.thread_count = thread_count
+        self.agent_name = agent_name
+        self.submit_queue = submit_queue
+        self.submit_queue_config = submit_queue_config
+        self.gc_policy = gc_policy if gc_policy is not None else GcPolicy()
+        self.perfmon_configs = []
+        # name => {'entity': ProcessEntity, 'process': Process, 'control': Queue, 'pinned': Queue}
+        self.processes = {}
+        self.task_queue_size = task_queue_size
         self.queue = Queue(task_queue_size)
+        self.feedback_queue = Queue()
 
         self.logger = Logger().getLogger(__name__)
 
@@ -95,11 +377,55 @@ class Processing(object):
         self.logger.debug(f"PROCESS QUEUE JOINING...")
         self.queue.close()
         self.queue.join_thread()
+        self.feedback_queue.close()
+        self.feedback_queue.join_thread()
         self.logger.debug(f"PROCESS QUEUE JOINED.")
 
     def get_queue(self):
         return self.queue
 
+    def get_feedback_queue(self):
+        return self.feedback_queue
+
+    def pids(self):
+        """
+        :return: pids of running worker processes
+        """
+        return [item['process'].pid for item in self.processes.values()
+                if isinstance(item['process'], Process) and item['process'].pid is not None]
+
+    @staticmethod
+    def owner(name: str, process_count: int):
+        """
+        :return: index of the worker owning a pinned perfmon, stable across restarts and reloads
+        """
+        return zlib.crc32(name.encode("utf-8")) % process_count
+
+    def pinned_queue(self, name: str):
+        """
+        :return: task queue of the worker owning the pinned perfmon
+        """
+        return self.processes["_".join(("process", str(Processing.owner(name, self.process_count))))]['pinned']
+
+    def register_perfmon(self, config: dict):
+        """
+        Perfmon config registered before start, every worker builds its own Perfmon/Task instances from it.
+        """
+        self.perfmon_configs.append(config)
+
+    def reload_perfmons(self, generation: int, upsert: list, remove: list):
+        """
+        Send a config reload to every worker, runs of this generation wait in workers until it is applied
+        :param upsert: configs of added and changed perfmons, rebuilt in workers
+        :param remove: names of removed perfmons
+        """
+        names = set(remove) | {config['name'] for config in upsert}
+        self.perfmon_configs[:] = [config for config in self.perfmon_configs if config.get('name') not in names]
+        self.perfmon_configs.extend(upsert)
+        message = {'cmd': "reload", 'generation': generation, 'upsert': upsert, 'remove': list(remove)}
+        for item in self.processes.values():
+            item['control'].put(message)
+
     def _reset_processes(self):
         if self.processes:
             queue = self.get_queue()
@@ -114,19 +440,28 @@ class Processing(object):
                         process.join()
                     process.close()
                     self.logger.debug(f"Process '{process.name}' terminated.")
+            for item in self.processes.values():
+                for name in ('control', 'pinned'):
+                    item[name].close()
+                    item[name].join_thread()
             self.processes = {}
-            gc.collect()
         self.logger.debug("Process Reset.")
 
     def _setup_processes(self):
         self._reset_processes()
         for i in range(self.process_count):
             name = "_".join(("process", str(i)))
-            entity = ProcessEntity(self.queue, name)
+            control = Queue()
+            pinned = Queue(self.task_queue_size)
+            entity = ProcessEntity(self.queue, self.submit_queue, self.feedback_queue, self.agent_name,
+                                   self.perfmon_configs, self.gc_policy, self.thread_count, name,
+                                   self.submit_queue_config, control, pinned, i, self.process_count)
             process = Process(None, entity.daemon, name)
             self.processes[name] = {
                 'entity': entity,
                 'process': process,
+                'control': control,
+                'pinned': pinned,
             }
             self.logger.info(f"Process '{name}' has been setup.")
 
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+"""
+Profiler 运行时性能剖析类
+SIGUSR1 开关 cProfile, SIGUSR2 开关 tracemalloc, 也可通过本机控制套接字开关; 主进程把信号转发给工作进程.
+关闭时每个进程把 cProfile 统计和 tracemalloc 分配排行写入目录.
+
+调度循环, 工作进程和提交线程在每次循环开始时调用 checkpoint(), 关闭时只比较一次代号, 开销接近于零;
+线程在下一次 checkpoint 时开始或停止剖析自己.
+信号处理函数只把信号编号写入管道, 由 profiler_signal 线程开关和写出, 不会等待被信号打断的线程持有的锁.
+
+Python < 3.12 keeps one cProfile per thread. Since 3.12 cProfile is built on sys.monitoring and only one profiler
+may be active in a process, so one profile is enabled for the whole process and sees every thread.
+
+dump files:
+<dir>/cprofile-<process>-<pid>-<time>.pstats  (pstats.Stats can load it) and .txt (top functions by cumulative time)
+<dir>/tracemalloc-<process>-<pid>-<time>.txt  (top allocations by line)
+
+control socket commands (one line, answered with a json line):
+"cprofile on|off|toggle", "tracemalloc on|off|toggle", "status"
+echo "cprofile toggle" | nc -U /tmp/perfmon.sock
+
+cProfile, pstats, tracemalloc and socket are imported when first used, an agent never profiled does not load them.
+
+configs:
+'dir'   : dump directory (default: <temp dir>/perfmon-profile)
+'socket': unix socket path of the control socket (default: no control socket)
+'top'   : functions / allocations written in text dumps (default: 30)
+'frames': frames kept per allocation by tracemalloc (default: 10)
+"""
+
+import io
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+from src import util
+from src.logger import Logger
+
+
+class _Snapshot(object):
+    """
+    Stats of a profile still enabled in another thread, pstats would disable it from this thread
+    """
+
+    def __init__(self, profile):
+        profile.snapshot_stats()
+        self.stats = profile.stats
+
+    def create_stats(self):
+        ...
+
+
+@util.singleton
+class Profiler(object):
+    PerThread = sys.version_info < (3, 12)
+
+    def __init__(self):
+        self.dir = None  # <temp dir>/perfmon-profile when dumped
+        self.socket_path = None
+        self.top = 30
+        self.frames = 10
+        self.profiling = False
+        self.tracing = False
+        self.generation = 0  # changed on every cProfile toggle, threads compare it in checkpoint
+        self.local = threading.local()
+        self.mutex = threading.Lock()
+        self.control = threading.Lock()  # one toggle at a time, from the signal thread or the control socket
+        self.profiles = {}  # thread name => cProfile.Profile of this generation
+        self.server = None
+        self.children = None  # callable returning pids to forward signals to
+        self.pipe = None  # (read, write) fds, signal handlers write the signal number
+
+        self.logger = Logger().getLogger(__name__)
+
+    def setup(self, config: dict = None):
+        if config is None:
+            config = {}
+        try:
+            self.dir = util.checkKey("dir", config, str, "profile")
+        except ValueError:
+            ...
+        try:
+            self.socket_path = util.checkKey("socket", config, str, "profile")
+        except ValueError:
+            self.socket_path = None
+        try:
+            self.top = util.checkKey("top", config, int, "profile")
+        except ValueError:
+            self.top = 30
+        try:
+            self.frames = util.checkKey("frames", config, int, "profile")
+        except ValueError:
+            self.frames = 10
+        if self.top <= 0 or self.frames <= 0:
+            raise ValueError(f"profile 'top' and 'frames' must be positive.")
+
+    def install(self, children=None):
+        """
+        Install SIGUSR1/SIGUSR2 handlers in this process
+        :param children: callable returning pids of worker processes, the main process forwards signals to them
+        """
+        self.children = children
+        if self.pipe is not None:
+            # copied from the main process by fork, its reading thread is not
+            for fd in self.pipe:
+                os.close(fd)
+        self.pipe = os.pipe()
+        os.set_blocking(self.pipe[1], False)
+        threading.Thread(None, self._signalDaemon, "profiler_signal", daemon=True).start()
+        signal.signal(signal.SIGUSR1, self._signalHandle)
+        signal.signal(signal.SIGUSR2, self._signalHandle)
+
+    def _signalHandle(self, sig, _):
+        # toggling takes locks the interrupted thread may hold, leave it to the signal thread
+        try:
+            os.write(self.pipe[1], bytes((sig,)))
+        except OSError:
+            ...
+
+    def _signalDaemon(self):
+        while True:
+            try:
+                data = os.read(self.pipe[0], 64)
+            except OSError:
+                return
+            if not data:
+                return
+            for sig in data:
+                try:
+                    match sig:
+                        case signal.SIGUSR1:
+                            self.setProfiling(not self.profiling, forward=True)
+                        case signal.SIGUSR2:
+                            self.setTracing(not self.tracing, forward=True)
+                except Exception as e:
+                    self.logger.error(f"Profiler toggle by signal {sig} failed: {e!r}")
+
+    def _forward(self, sig):
+        if self.children is None:
+            return
+        for pid in self.children():
+            try:
+                os.kill(pid, sig)
+            except OSError as e:
+                self.logger.warning(f"Profiler signal not forwarded to process {pid}: {e!r}")
+
+    def checkpoint(self):
+        """
+        Called at the top of every daemon loop, starts or stops profiling of the calling thread
+        """
+        if getattr(self.local, "generation", 0) == self.generation:
+            return
+        self.local.generation = self.generation
+        if not Profiler.PerThread:
+            return
+        profile = getattr(self.local, "profile", None)
+        if profile is not None:
+            profile.disable()
+            self.local.profile = None
+        if self.profiling:
+            import cProfile
+            profile = cProfile.Profile()
+            with self.mutex:
+                self.profiles[threading.current_thread().name] = profile
+            self.local.profile = profile
+            profile.enable()
+
+    def setProfiling(self, enable: bool, forward: bool = False):
+        with self.control:
+            if enable == self.profiling:
+                return
+            if enable:
+                with self.mutex:
+                    self.profiles = {}
+                if not Profiler.PerThread:
+                    import cProfile
+                    profile = cProfile.Profile()
+                    # raises if another profiler (e.g. a debugger or coverage) is active
+                    profile.enable()
+                    with self.mutex:
+                        self.profiles["all threads"] = profile
+                self.profiling = True
+                self.generation += 1
+                self.logger.info(f"cProfile started in process {os.getpid()}.")
+            else:
+                self.profiling = False
+                self.generation += 1
+                if not Profiler.PerThread:
+                    with self.mutex:
+                        for profile in self.profiles.values():
+                            profile.disable()
+                self._dumpProfile()
+        if forward:
+            self._forward(signal.SIGUSR1)
+
+    def setTracing(self, enable: bool, forward: bool = False):
+        with self.control:
+            if enable == self.tracing:
+                return
+            import tracemalloc
+            self.tracing = enable
+            if enable:
+                tracemalloc.start(self.frames)
+                self.logger.info(f"tracemalloc started in process {os.getpid()}.")
+            else:
+                self._dumpTrace()
+                tracemalloc.stop()
+        if forward:
+            self._forward(signal.SIGUSR2)
+
+    def _dumpPath(self, kind: str, suffix: str):
+        if self.dir is None:
+            import tempfile
+            self.dir = os.path.join(tempfile.gettempdir(), "perfmon-profile")
+        os.makedirs(self.dir, exist_ok=True)
+        name = multiprocessing.current_process().name
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        return os.path.join(self.dir, f"{kind}-{name}-{os.getpid()}-{stamp}{suffix}")
+
+    def _dumpProfile(self):
+        with self.mutex:
+            profiles = self.profiles
+            self.profiles = {}
+        import pstats
+        stats = None
+        for profile in profiles.values():
+            if stats is None:
+                stats = pstats.Stats(_Snapshot(profile))
+            else:
+                stats.add(_Snapshot(profile))
+        if stats is None:
+            self.logger.info(f"cProfile stopped in process {os.getpid()}, no thread profiled.")
+            return
+        path = self._dumpPath("cprofile", ".pstats")
+        stats.dump_stats(path)
+        text = io.StringIO()
+        stats.stream = text
+        stats.sort_stats("cumulative").print_stats(self.top)
+        with open(path[:-len(".pstats")] + ".txt", "w") as fd:
+            fd.write(f"threads: {', '.join(profiles)}\n")
+            fd.write(text.getvalue())
+        self.logger.info(f"cProfile stopped in process {os.getpid()}, {len(profiles)} thread"
+                         f"{'s' if len(profiles) != 1 else ''} dumped to '{path}'.")
+
+    def _dumpTrace(self):
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        path = self._dumpPath("tracemalloc", ".txt")
+        with open(path, "w") as fd:
+            fd.write(f"traced: {current} bytes, peak: {peak} bytes\n")
+            for stat in snapshot.statistics("lineno")[:self.top]:
+                fd.write(f"{stat}\n")
+        self.logger.info(f"tracemalloc stopped in process {os.getpid()}, dumped to '{path}'.")
+
+    def status(self):
+        return {'pid': os.getpid(), 'cprofile': self.profiling, 'tracemalloc': self.tracing,
+                'dir': self.dir}
+
+    def command(self, line: str):
+        """
+        Apply a control socket command in this process and forward it to workers
+        :return: status after the command
+        """
+        words = line.split()
+        if not words or words[0] == "status":
+            return self.status()
+        if len(words) != 2 or words[0] not in ("cprofile", "tracemalloc") or words[1] not in ("on", "off", "toggle"):
+            raise ValueError(f"unknown command '{line}'")
+        current = self.profiling if words[0] == "cprofile" else self.tracing
+        enable = not current if words[1] == "toggle" else words[1] == "on"
+        if words[0] == "cprofile":
+            self.setProfiling(enable, forward=True)
+        else:
+            self.setTracing(enable, forward=True)
+        return self.status()
+
+    def serve(self):
+        """
+        Start the control socket of the main process, if configured
+        """
+        if self.socket_path is None:
+            return
+        import socket
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        self.server.listen(4)
+        threading.Thread(None, self._serve, "profiler_control", daemon=True).start()
+        self.logger.info(f"Profiler control socket listening on '{self.socket_path}'.")
+
+    def _serve(self):
+        while self.server is not None:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            with conn:
+                try:
+                    conn.settimeout(5)
+                    line = conn.makefile("r").readline().strip()
+                    reply = self.command(line)
+                except Exception as e:
+                    reply = {'error': f"{e!r}"}
+                try:
+                    conn.sendall(json.dumps(reply).encode("utf-8") + b"\n")
+                except OSError:
+                    ...
+
+    def close(self):
+        if self.server is not None:
+            server = self.server
+            self.server = None
+            server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        # whatever is still running is dumped before exit
+        self.setProfiling(False)
+        self.setTracing(False)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+"""
+RawFile 原始文件描述符读取类
+保持一个只读fd, 用 pread 从偏移0读入复用的缓冲区, 不经过文本解码,
+适用于 /proc 和 /sys 下每次读取都会重新生成内容的文件.
+"""
+
+import os
+
+
+class RawFile(object):
+    def __init__(self, path: str, length: int = 4096):
+        self.path = path
+        self.length = length
+        self.buf = bytearray(length)
+        self.view = memoryview(self.buf)
+        self.fd = None
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def closed(self):
+        return self.fd is None
+
+    def open(self):
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_RDONLY | os.O_CLOEXEC)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def read(self) -> bytes:
+        """
+        Read up to length bytes from offset 0, open file if closed
+        """
+        self.open()
+        if hasattr(os, "preadv"):
+            size = os.preadv(self.fd, [self.view], 0)
+            return bytes(self.view[:size])
+        return os.pread(self.fd, self.length, 0)
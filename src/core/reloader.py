@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""
+Reloader 配置热加载类
+收到 SIGHUP 或配置文件修改时间变化时重新读取配置, 与当前的 perfmon 列表按名字比较,
+只在调度器中增加, 删除或重新调度变化的项目, 并通知工作进程重建变化的 Perfmon;
+提交器, 提交缓冲和未变化项目打开的文件都保持不变. 新配置检查失败时保留原配置.
+
+Only the 'perfmon' list is reloaded, other changed keys (submit, process, ...) are logged and need a restart.
+Every changed item is rescheduled, runs in flight and the phase are kept; an item whose schedule keys changed
+only is not rebuilt in workers.
+
+configs:
+'interval': seconds between config file modification checks, 0 reloads on SIGHUP only (default: 0)
+"""
+
+import os
+import select
+import signal
+import threading
+
+from src import util
+from src.core.agent_config import AgentConfig
+from src.core.perfmon import Perfmon
+from src.core.processing import Processing
+from src.core.scheduler import Scheduler
+from src.logger import Logger
+
+
+class Reloader(object):
+    ScheduleKeys = ("delay", "priority", "align", "overrun", "overrun_limit")
+
+    def __init__(self, config: AgentConfig, scheduler: Scheduler, processing: Processing):
+        self.config = config
+        self.scheduler = scheduler
+        self.processing = processing
+        self.items = {item['name']: item for item in config.getPerfmonItems()}
+        self.stamp = self._stamp()
+        self.event = threading.Event()
+        self.thread = None
+        self.pipe = None  # (read, write) fds, SIGHUP handler wakes the watcher thread through it
+        self.reloads = 0
+        self.failures = 0
+
+        self.interval = Reloader.checkConfig(config)
+
+        self.logger = Logger().getLogger(__name__)
+
+        # reload runs in the scheduler thread, between two ticks
+        self.scheduler.reload_handler = self.reload
+
+    @staticmethod
+    def checkConfig(config: AgentConfig):
+        """
+        :return: seconds between config file checks of the 'reload' config
+        """
+        reload_config = config.getReloadConfig() or {}
+        try:
+            interval = float(util.checkKey("interval", reload_config, (int, float), "reload"))
+        except ValueError:
+            interval = 0.0
+        if interval < 0:
+            raise ValueError(f"reload 'interval' must not be negative, but '{interval}' found.")
+        return interval
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.config.filePath)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def start(self):
+        self.pipe = os.pipe()
+        os.set_blocking(self.pipe[1], False)
+        self.event.clear()
+        # always running, it turns SIGHUP into a reload request and polls the file when 'interval' is set
+        self.thread = threading.Thread(None, self._daemon, "config_watcher", daemon=True)
+        self.thread.start()
+        signal.signal(signal.SIGHUP, self._signalHandle)
+
+    def stop(self):
+        self.event.set()
+        if self.thread is not None:
+            self._wake()
+            self.thread.join()
+            self.thread = None
+        if self.pipe is not None:
+            for fd in self.pipe:
+                os.close(fd)
+            self.pipe = None
+
+    def _signalHandle(self, sig, _):
+        # runs on the interrupted main thread, a queue put here may wait for a lock that thread holds
+        if sig == signal.SIGHUP:
+            self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self.pipe[1], b"\0")
+        except (OSError, TypeError):
+            # pipe full (a wake is pending already) or closed by stop
+            ...
+
+    def request(self):
+        """
+        Ask the scheduler thread to reload, called from threads, never from a signal handler
+        """
+        self.scheduler.feedback_queue.put({'cmd': "reload"})
+
+    def _daemon(self):
+        timeout = self.interval if self.interval > 0 else None
+        while not self.event.is_set():
+            readable, _, _ = select.select([self.pipe[0]], [], [], timeout)
+            if self.event.is_set():
+                return
+            if readable:
+                os.read(self.pipe[0], 64)
+                self.logger.info("Receive signal SIGHUP, reloading config.")
+                self.request()
+                continue
+            stamp = self._stamp()
+            if stamp is not None and stamp != self.stamp:
+                self.stamp = stamp
+                self.logger.info(f"Config file '{self.config.filePath}' changed.")
+                self.request()
+
+    def _check(self, config: AgentConfig):
+        """
+        :return: new perfmon items by name, every added or changed item is checked without building tasks
+        """
+        if config.getAgentName() != self.config.getAgentName():
+            raise ValueError("'agent_name' changed, restart the agent to apply it.")
+        items = {}
+        for item in config.getPerfmonItems():
+            name = item.get('name') if isinstance(item, dict) else None
+            if name in items:
+                raise ValueError(f"Perfmon name '{name}' duplicated.")
+            if item != self.items.get(name):
+                Perfmon.check(config.getAgentName(), item)
+            items[name] = item
+        return items
+
+    @staticmethod
+    def _scheduleOnly(old: dict, new: dict):
+        """
+        :return: True if only schedule keys differ, the item is rescheduled without rebuilding its tasks
+        """
+        return {key: value for key, value in old.items() if key not in Reloader.ScheduleKeys} == \
+            {key: value for key, value in new.items() if key not in Reloader.ScheduleKeys}
+
+    def reload(self):
+        self.stamp = self._stamp()
+        try:
+            config = AgentConfig(self.config.filePath)
+            items = self._check(config)
+        except Exception as e:
+            self.failures += 1
+            self.logger.error(f"Config reload failed, keep the running config: {e!r}")
+            return False
+
+        removed = [name for name in self.items if name not in items]
+        added = [name for name in items if name not in self.items]
+        changed = [name for name in items if name in self.items and items[name] != self.items[name]]
+        rebuilt = added + [name for name in changed if not self._scheduleOnly(self.items[name], items[name])]
+        for key in sorted(set(config.cfg) | set(self.config.cfg)):
+            if key != "perfmon" and config.cfg.get(key) != self.config.cfg.get(key):
+                self.logger.warning(f"Config '{key}' changed, restart the agent to apply it.")
+        if not (removed or added or changed):
+            self.logger.info("Config reloaded, perfmon items not changed.")
+            self.config = config
+            return True
+
+        # workers get the new generation before any run of it is dispatched
+        self.scheduler.generation += 1
+        self.processing.reload_perfmons(self.scheduler.generation, [items[name] for name in rebuilt], removed)
+        for name in removed:
+            self.scheduler.stop(name)
+        for name in added:
+            self.scheduler.register_scheduler(Perfmon(config.getAgentName(), items[name], setup_tasks=False))
+        for name in changed:
+            # task keys decide the entry too (pinning, run expiry), the phase is kept by reschedule
+            self.scheduler.reschedule(Perfmon(config.getAgentName(), items[name], setup_tasks=False))
+
+        self.config = config
+        self.items = items
+        self.reloads += 1
+        self.logger.info(f"Config reloaded as generation {self.scheduler.generation}: added {added}, "
+                         f"removed {removed}, changed {changed}, rebuilt in workers {rebuilt}.")
+        return True
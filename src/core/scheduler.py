@@ -1,26 +1,327 @@
 # -*- coding: utf-8 -*-
 
-from sched import scheduler
+"""
+Scheduler 调度器类
+到期的Perfmon项目按名字投递到Processing的任务队列, 由工作进程执行采集
 
-from src.base.task_base import TaskBase
+Fixed-rate scheduling: tick k of a perfmon item is due at absolute deadline `start + k * delay`
+on the monotonic clock, so the period never stretches by task runtime or queue latency.
+Deadlines of all items are kept in one heap, each tick costs O(log n).
+
+Workers report finished runs through the feedback queue, the scheduler keeps in-flight runs of every item
+and applies its overrun policy, so a stuck collector sheds its own ticks instead of filling the task queue.
+
+A config reload adds, removes or reschedules single items in the scheduler thread, every dispatched run carries
+the config generation so workers apply the matching reload before running it.
+
+Runs of a pinned item (stateful task, e.g. procfs counter deltas) are routed to the queue of its owning worker.
+"""
+
+import collections
+import heapq
+import itertools
+import queue
+import time
+from multiprocessing import Queue
+
+from src.core.metrics import Metrics
 from src.core.perfmon import Perfmon
+from src.core.profiler import Profiler
+from src.logger import Logger
+
+
+class ScheduleEntry(object):
+    def __init__(self, name: str, interval: float, priority: int, align: bool = False, overrun: str = "skip",
+                 overrun_limit: int = 1, expire: float = None, pinned: bool = False):
+        """
+        :param expire: seconds a run may stay in flight, a run whose 'done' never comes (worker died) is
+            forgotten after it, so the overrun policy does not block the item forever
+        :param pinned: runs go to the worker owning the item instead of the shared task queue
+        """
+        self.name = name
+        self.interval = interval
+        self.priority = priority
+        self.align = align
+        self.overrun = overrun
+        self.overrun_limit = overrun_limit
+        self.pinned = pinned
+        self.start = 0.0  # monotonic time of tick 0
+        self.tick = 0  # index of next deadline
+        self.cancelled = False
+
+        self.in_flight = 0
+        self.flights = collections.deque()  # monotonic dispatch time of runs in flight, oldest first
+        self.expire = expire
+        self.pending = collections.deque()  # planned wall-clock time of queued runs
+
+        self.ticks = 0  # dispatched ticks
+        self.skipped = 0  # deadlines passed while scheduler was behind, coalesced into one run
+        self.late = 0  # ticks dispatched later than Scheduler.LateTolerance after its deadline
+        self.dropped = 0  # ticks lost on a full task queue
+        self.overrun_skipped = 0  # ticks shed by overrun policy
+        self.overrun_queued = 0  # ticks delayed by overrun policy
+        self.expired = 0  # runs in flight forgotten after 'expire' seconds
+        self.max_lag = 0.0
+
+    def arm(self, now: float, wall: float):
+        if self.align:
+            # first deadline on a wall-clock boundary which is a multiple of interval
+            self.start = now + (self.interval - wall % self.interval)
+        else:
+            self.start = now + self.interval
+        self.tick = 0
+
+    def deadline(self):
+        return self.start + self.tick * self.interval
+
+    def inherit(self, old):
+        """
+        Take over runs in flight, queued runs and stats of the entry this one replaces,
+        the phase is kept when interval and alignment did not change
+        """
+        self.in_flight = old.in_flight
+        self.flights = old.flights
+        self.pending = old.pending
+        self.ticks = old.ticks
+        self.skipped = old.skipped
+        self.late = old.late
+        self.dropped = old.dropped
+        self.overrun_skipped = old.overrun_skipped
+        self.overrun_queued = old.overrun_queued
+        self.expired = old.expired
+        self.max_lag = old.max_lag
+        if self.interval == old.interval and self.align == old.align:
+            self.start = old.start
+            self.tick = old.tick
+
+    def admit(self, planned: float):
+        """
+        Apply overrun policy on a due tick
+        :return: True if the tick can be dispatched now
+        :rtype: bool
+        """
+        match self.overrun:
+            case "parallel":
+                if self.in_flight < self.overrun_limit:
+                    return True
+            case "queue":
+                if self.in_flight <= 0:
+                    return True
+                if len(self.pending) < self.overrun_limit:
+                    self.pending.append(planned)
+                    self.overrun_queued += 1
+                    return False
+            case default:
+                if self.in_flight <= 0:
+                    return True
+        self.overrun_skipped += 1
+        return False
+
+    def launch(self, now: float):
+        """
+        A run was put into the task queue
+        """
+        self.in_flight += 1
+        self.flights.append(now)
+
+    def expire_flights(self, now: float):
+        """
+        Forget runs in flight for longer than 'expire' seconds
+        :return: count of runs forgotten
+        """
+        count = 0
+        while self.expire is not None and self.flights and now - self.flights[0] > self.expire:
+            self.flights.popleft()
+            self.in_flight = max(self.in_flight - 1, 0)
+            count += 1
+        self.expired += count
+        return count
+
+    def finish(self):
+        """
+        A run finished in worker
+        :return: planned time of a queued run which can be dispatched now, or None
+        """
+        self.in_flight = max(self.in_flight - 1, 0)
+        if self.flights:
+            self.flights.popleft()
+        if self.pending:
+            return self.pending.popleft()
+        return None
+
+    def get_stats(self):
+        return {
+            'interval': self.interval,
+            'ticks': self.ticks,
+            'skipped': self.skipped,
+            'late': self.late,
+            'dropped': self.dropped,
+            'overrun_skipped': self.overrun_skipped,
+            'overrun_queued': self.overrun_queued,
+            'in_flight': self.in_flight,
+            'expired': self.expired,
+            'max_lag': self.max_lag,
+        }
 
 
 class Scheduler(object):
-    def __init__(self):
-        self.scheduler = scheduler()
-        self.scheduler_table = {}
+    LateTolerance = 0.05
+    ExpireGrace = 5.0  # seconds a run may wait in the task queue on top of its run limit
+
+    def __init__(self, task_queue: Queue, feedback_queue: Queue, route=None):
+        """
+        :param route: perfmon name => task queue of the worker owning it, used for pinned items
+        """
+        self.heap = []  # (deadline, priority, seq, ScheduleEntry)
+        self.scheduler_table = {}  # name => ScheduleEntry
+        self.task_queue = task_queue
+        self.feedback_queue = feedback_queue
+        self.route = route
+        self.seq = itertools.count()
+        self.running = False
+        self.generation = 0  # config generation, sent with every run
+        self.reload_handler = None  # called in the scheduler thread on a "reload" feedback
+
+        self.logger = Logger().getLogger(__name__)
+
+    def _entry(self, perfmon: Perfmon):
+        return ScheduleEntry(perfmon.name, perfmon.delay, perfmon.priority, perfmon.align, perfmon.overrun,
+                             perfmon.overrun_limit, perfmon.run_limit + Scheduler.ExpireGrace, perfmon.pinned)
 
     def register_scheduler(self, perfmon: Perfmon):
-        event_id = perfmon.register_schedule(self.scheduler)
-        self.scheduler_table[perfmon.name] = event_id
+        if perfmon.name in self.scheduler_table:
+            raise ValueError(f"Perfmon name '{perfmon.name}' duplicated.")
+        entry = self._entry(perfmon)
+        entry.arm(time.monotonic(), time.time())
+        self.scheduler_table[entry.name] = entry
+        self._push(entry)
 
-    def start(self, blocking=True):
-        self.scheduler.run(blocking)
+    def reschedule(self, perfmon: Perfmon):
+        """
+        Replace the schedule of a registered perfmon, runs in flight and stats are kept
+        """
+        old = self.scheduler_table.get(perfmon.name)
+        if old is None:
+            self.register_scheduler(perfmon)
+            return
+        entry = self._entry(perfmon)
+        entry.arm(time.monotonic(), time.time())
+        entry.inherit(old)
+        old.cancelled = True
+        self.scheduler_table[entry.name] = entry
+        self._push(entry)
+
+    def _push(self, entry: ScheduleEntry):
+        heapq.heappush(self.heap, (entry.deadline(), entry.priority, next(self.seq), entry))
+
+    def _fire(self, entry: ScheduleEntry, now: float):
+        lag = now - entry.deadline()
+        missed = int(lag // entry.interval)
+        if missed > 0:
+            # scheduler was behind for whole periods, run once for the latest passed deadline
+            entry.skipped += missed
+            entry.tick += missed
+            lag -= missed * entry.interval
+            self.logger.warning(f"Perfmon '{entry.name}' scheduler behind, skipped {missed} tick"
+                                f"{'s' if missed != 1 else ''}.")
+        if lag > Scheduler.LateTolerance:
+            entry.late += 1
+        entry.max_lag = max(entry.max_lag, lag)
+        Metrics().observe("scheduler_lag", lag, entry.name)
+        expired = entry.expire_flights(now)
+        if expired:
+            self.logger.warning(f"Perfmon '{entry.name}' has {expired} run{'s' if expired != 1 else ''} not finished "
+                                f"in {entry.expire:.1f} seconds, forgotten by overrun policy.")
 
-    def stop(self, event_id=None):
-        if event_id is None:
-            for event in self.scheduler.queue:
-                self.scheduler.cancel(event)
+        planned = time.time() - lag
+        entry.tick += 1
+        if entry.admit(planned):
+            self._dispatch(entry, planned)
         else:
-            self.scheduler.cancel(event_id)
+            self.logger.debug(f"Perfmon '{entry.name}' has {entry.in_flight} run"
+                              f"{'s' if entry.in_flight != 1 else ''} in flight, overrun policy '{entry.overrun}' applied.")
+
+    def _dispatch(self, entry: ScheduleEntry, planned: float):
+        task_queue = self.route(entry.name) if entry.pinned and self.route is not None else self.task_queue
+        try:
+            # never block the scheduler thread, a full queue means all workers are busy
+            task_queue.put_nowait({'cmd': "task", 'perfmon': entry.name, 'generation': self.generation,
+                                        'params': Perfmon.generate_params(planned)})
+            entry.ticks += 1
+            entry.launch(time.monotonic())
+        except queue.Full:
+            entry.dropped += 1
+            self.logger.warning(f"Task queue is full, perfmon '{entry.name}' run skipped.")
+
+    def _feedback(self, message: dict):
+        match message.get('cmd'):
+            case "quit":
+                self.running = False
+            case "reload":
+                if self.reload_handler is not None:
+                    self.reload_handler()
+            case "metrics":
+                # deltas recorded by a worker since its last snapshot
+                Metrics().merge(message.get('metrics', {}))
+            case "done":
+                entry = self.scheduler_table.get(message.get('perfmon'))
+                if entry is None:
+                    return
+                planned = entry.finish()
+                if planned is not None:
+                    self._dispatch(entry, planned)
+
+    def _wait(self, timeout):
+        """
+        Wait until timeout or a worker feedback arrived, then handle all arrived feedbacks.
+        """
+        try:
+            self._feedback(self.feedback_queue.get(timeout=timeout))
+            while self.running:
+                self._feedback(self.feedback_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+    def start(self, blocking=True):
+        """
+        Run the schedule loop, when not blocking run all due ticks and return the seconds until next deadline.
+        """
+        self.running = True
+        profiler = Profiler()
+        while self.running:
+            profiler.checkpoint()
+            if not self.heap:
+                if not blocking:
+                    return None
+                self._wait(None)
+                continue
+            deadline, _, _, entry = self.heap[0]
+            if entry.cancelled:
+                heapq.heappop(self.heap)
+                continue
+            now = time.monotonic()
+            if deadline > now:
+                if not blocking:
+                    self._wait(0)
+                    return deadline - now
+                self._wait(deadline - now)
+                continue
+            heapq.heappop(self.heap)
+            self._fire(entry, now)
+            self._push(entry)
+        return None
+
+    def stop(self, name=None):
+        if name is None:
+            if self.running:
+                self.running = False
+                # wake up the loop waiting on feedback queue
+                self.feedback_queue.put({'cmd': "quit"})
+            for name, stats in self.get_stats().items():
+                if stats['skipped'] or stats['dropped'] or stats['overrun_skipped'] or stats['expired']:
+                    self.logger.info(f"Perfmon '{name}' schedule stats: {stats!r}")
+        elif name in self.scheduler_table:
+            self.scheduler_table.pop(name).cancelled = True
+
+    def get_stats(self):
+        return {name: entry.get_stats() for name, entry in self.scheduler_table.items()}
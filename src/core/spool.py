@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+
+"""
+Spool 磁盘暂存类
+发送失败的批次追加写入目录中的分段文件, 总大小超过上限时从最旧的分段开始淘汰,
+读取位置保存在游标文件中, 重启后从游标继续回放.
+
+segment file: <sequence>.seg, frames of tag(1 byte) + length(4 bytes, big endian) + payload
+    tag b"J": payload is a json array of results, tag b"B": payload is raw bytes
+cursor file: json {"segment": <sequence>, "offset": <offset of next frame>}
+
+configs:
+'path'         : spool directory (required)
+'segment_bytes': roll to a new segment file after this size (default: 4194304)
+'max_bytes'    : total size of segments, oldest segments are evicted over it (default: 268435456)
+'rate'         : max batches replayed per second once the submitter recovers (default: 5)
+'retry_interval': seconds between replay attempts while the submitter is failing (default: 5)
+'fsync'        : fsync segment after every append, survives power loss but slower (default: false)
+'policy'       : what to do with a new batch when the spool is at 'max_bytes'
+                 (choice: "block", "drop_oldest", "drop_newest", "sample", default: "drop_oldest")
+                 "drop_oldest" evicts the oldest segment, "block" keeps the batch in the submitter buffer,
+                 see src.core.backpressure
+"""
+
+import json
+import os
+import struct
+import threading
+
+from src import util
+from src.core.backpressure import Backpressure
+from src.logger import Logger
+
+
+class Spool(object):
+    Header = struct.Struct(">cI")
+    Suffix = ".seg"
+    CursorName = "cursor"
+    checking = False  # built by checkConfig, the directory is not touched
+
+    def __init__(self, config: dict):
+        self.path = util.checkKey("path", config, str, "spool")
+        try:
+            self.segment_bytes = util.checkKey("segment_bytes", config, int, "spool")
+        except ValueError:
+            self.segment_bytes = 4194304
+        try:
+            self.max_bytes = util.checkKey("max_bytes", config, int, "spool")
+        except ValueError:
+            self.max_bytes = 268435456
+        try:
+            self.rate = float(util.checkKey("rate", config, (int, float), "spool"))
+        except ValueError:
+            self.rate = 5.0
+        try:
+            self.retry_interval = float(util.checkKey("retry_interval", config, (int, float), "spool"))
+        except ValueError:
+            self.retry_interval = 5.0
+        try:
+            self.fsync = util.checkKey("fsync", config, bool, "spool")
+        except ValueError:
+            self.fsync = False
+        if self.segment_bytes <= 0 or self.max_bytes < self.segment_bytes or self.rate <= 0:
+            raise ValueError(f"spool 'segment_bytes', 'rate' must be positive and 'max_bytes' not less than "
+                             f"'segment_bytes'.")
+
+        # spool size is limited by its own 'max_bytes', backpressure only decides what to do over it
+        self.backpressure = Backpressure({key: config[key] for key in ("policy", "sample") if key in config},
+                                         "spool", policy="drop_oldest")
+
+        self.logger = Logger().getLogger(__name__)
+        self.mutex = threading.Lock()
+        self.segments = {}  # sequence => size
+        self.frames = {}  # sequence => frame count
+        self.writer = None  # file object of the last segment
+        self.cursor = (0, 0)  # (sequence, offset) of the next frame to replay
+        self.evicted = 0  # segments evicted over max_bytes
+        self.appended = 0
+        self.replayed = 0
+
+        if not self.checking:
+            os.makedirs(self.path, exist_ok=True)
+            self._recover()
+
+    @classmethod
+    def checkConfig(cls, config: dict):
+        """
+        Parse and check spool configs, the spool directory is not created or read
+        """
+        spool = cls.__new__(cls)
+        spool.checking = True
+        spool.__init__(config)
+        return spool
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        with self.mutex:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+
+    def _segmentPath(self, sequence: int):
+        return os.path.join(self.path, f"{sequence:016d}{Spool.Suffix}")
+
+    def _recover(self):
+        for name in os.listdir(self.path):
+            if name.endswith(Spool.Suffix) and name[:-len(Spool.Suffix)].isdigit():
+                sequence = int(name[:-len(Spool.Suffix)])
+                self.segments[sequence] = os.path.getsize(self._segmentPath(sequence))
+                valid, self.frames[sequence] = self._scan(sequence)
+        try:
+            with open(os.path.join(self.path, Spool.CursorName), "r") as fd:
+                cursor = json.load(fd)
+            self.cursor = (int(cursor['segment']), int(cursor['offset']))
+        except (OSError, ValueError, KeyError, TypeError):
+            self.cursor = (min(self.segments), 0) if self.segments else (0, 0)
+        if self.segments:
+            # a frame cut by a crash at the tail of the last segment is truncated before appending
+            last = max(self.segments)
+            valid = self._scan(last)[0]
+            if valid != self.segments[last]:
+                os.truncate(self._segmentPath(last), valid)
+                self.logger.warning(f"Spool segment '{last}' has a broken tail frame, truncated to {valid} bytes.")
+                self.segments[last] = valid
+            count = len(self.segments)
+            self.logger.info(f"Spool '{self.path}' recovered {count} segment{'s' if count != 1 else ''}, "
+                             f"{self.size()} bytes.")
+
+    def _scan(self, sequence: int):
+        """
+        :return: (length of whole frames, frame count) of a segment
+        """
+        offset = 0
+        frames = 0
+        size = self.segments[sequence]
+        with open(self._segmentPath(sequence), "rb") as fd:
+            while True:
+                header = fd.read(Spool.Header.size)
+                if len(header) < Spool.Header.size:
+                    return offset, frames
+                tag, length = Spool.Header.unpack(header)
+                if tag not in (b"J", b"B") or offset + Spool.Header.size + length > size:
+                    return offset, frames
+                offset += Spool.Header.size + length
+                frames += 1
+                fd.seek(offset)
+
+    def size(self):
+        return sum(self.segments.values())
+
+    def empty(self):
+        with self.mutex:
+            return not self.segments or (self.cursor[0] >= max(self.segments) and
+                                         self.cursor[1] >= self.segments[max(self.segments)])
+
+    def append(self, batch):
+        """
+        Append a batch of results (list, stored as json) or raw bytes as one frame
+        :return: "stored", "dropped" when the batch is dropped by policy,
+            or "blocked" when the batch should stay with the caller
+        """
+        if isinstance(batch, (bytes, bytearray)):
+            tag, payload = b"B", bytes(batch)
+        else:
+            tag, payload = b"J", json.dumps(batch, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        frame = Spool.Header.pack(tag, len(payload)) + payload
+        with self.mutex:
+            if self.segments and self.size() + len(frame) > self.max_bytes:
+                match self.backpressure.action():
+                    case "block":
+                        self.backpressure.block(0.0)
+                        return "blocked"
+                    case "drop_newest":
+                        self.backpressure.dropNewest()
+                        return "dropped"
+            last = max(self.segments) if self.segments else None
+            if last is None or self.segments[last] >= self.segment_bytes:
+                if self.writer is not None:
+                    self.writer.close()
+                    self.writer = None
+                if last is None:
+                    # replay starts from the first frame of the new segment
+                    last = self.cursor[0] + 1
+                    self._saveCursor((last, 0))
+                else:
+                    last += 1
+                self.segments[last] = 0
+                self.frames[last] = 0
+            if self.writer is None:
+                self.writer = open(self._segmentPath(last), "ab")
+            self.writer.write(frame)
+            self.writer.flush()
+            if self.fsync:
+                os.fsync(self.writer.fileno())
+            self.segments[last] += len(frame)
+            self.frames[last] += 1
+            self.appended += 1
+            self._evict()
+            return "stored"
+
+    def _evict(self):
+        while self.size() > self.max_bytes and len(self.segments) > 1:
+            oldest = min(self.segments)
+            self.backpressure.dropOldest(self.frames.get(oldest, 0))
+            self._remove(oldest)
+            self.evicted += 1
+            self.logger.warning(f"Spool '{self.path}' over {self.max_bytes} bytes, evicted oldest segment '{oldest}'.")
+            if self.cursor[0] <= oldest:
+                self._saveCursor((min(self.segments), 0))
+
+    def _remove(self, sequence: int):
+        del self.segments[sequence]
+        self.frames.pop(sequence, None)
+        try:
+            os.unlink(self._segmentPath(sequence))
+        except FileNotFoundError:
+            ...
+
+    def _saveCursor(self, cursor: tuple):
+        self.cursor = cursor
+        temp = os.path.join(self.path, Spool.CursorName + ".tmp")
+        with open(temp, "w") as fd:
+            json.dump({'segment': cursor[0], 'offset': cursor[1]}, fd)
+        os.replace(temp, os.path.join(self.path, Spool.CursorName))
+
+    def peek(self):
+        """
+        :return: (batch, next cursor) of the oldest frame not replayed, or None if spool is empty
+        """
+        with self.mutex:
+            for sequence in sorted(self.segments):
+                if sequence < self.cursor[0]:
+                    continue
+                offset = self.cursor[1] if sequence == self.cursor[0] else 0
+                if offset < self.segments[sequence]:
+                    with open(self._segmentPath(sequence), "rb") as fd:
+                        fd.seek(offset)
+                        tag, length = Spool.Header.unpack(fd.read(Spool.Header.size))
+                        payload = fd.read(length)
+                    batch = json.loads(payload) if tag == b"J" else payload
+                    return batch, (sequence, offset + Spool.Header.size + length)
+            return None
+
+    def commit(self, cursor: tuple):
+        """
+        Mark frames before cursor replayed, fully replayed segments except the one written are removed
+        """
+        with self.mutex:
+            last = max(self.segments) if self.segments else None
+            for sequence in sorted(self.segments):
+                if sequence >= cursor[0] or sequence == last:
+                    break
+                self._remove(sequence)
+            if cursor[0] in self.segments and cursor[0] != last and cursor[1] >= self.segments[cursor[0]]:
+                # whole segment replayed, move on to the next one
+                self._remove(cursor[0])
+                cursor = (min(self.segments), 0)
+            self._saveCursor(cursor)
+            self.replayed += 1
+
+    def get_stats(self):
+        with self.mutex:
+            return {
+                'segments': len(self.segments),
+                'bytes': self.size(),
+                'appended': self.appended,
+                'replayed': self.replayed,
+                'evicted': self.evicted,
+                'backpressure': self.backpressure.get_stats(),
+            }
+
+
+class SpoolDrainer(object):
+    """
+    Replay spooled batches through `send` (returns True when delivered) in a background thread,
+    at most `spool.rate` batches per second, waiting `spool.retry_interval` seconds after a failure
+    """
+
+    def __init__(self, spool: Spool, send, name: str):
+        self.spool = spool
+        self.send = send
+        self.name = name
+        self.event = threading.Event()
+        self.thread = None
+
+        self.logger = Logger().getLogger(__name__)
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.event.clear()
+        self.thread = threading.Thread(None, self._daemon, self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.event.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def _daemon(self):
+        while not self.event.is_set():
+            try:
+                entry = self.spool.peek()
+            except (OSError, ValueError, struct.error) as e:
+                self.logger.error(f"Spool '{self.spool.path}' read failed: {e!r}")
+                self.event.wait(self.spool.retry_interval)
+                continue
+            if entry is None:
+                self.event.wait(self.spool.retry_interval)
+                continue
+            batch, cursor = entry
+            try:
+                delivered = self.send(batch)
+            except Exception as e:
+                self.logger.error(f"Spool '{self.spool.path}' replay failed: {e!r}")
+                delivered = False
+            if not delivered:
+                self.event.wait(self.spool.retry_interval)
+                continue
+            self.spool.commit(cursor)
+            self.event.wait(1 / self.spool.rate)
@@ -3,13 +3,19 @@
 """
 Submitting 线程管理器类
 可以注册多个submit模块
+扇出线程从结果队列取出结果, 每种格式只编码一次, 交给各个提交器自己的队列和线程
 """
-import gc
+import importlib
+import queue
 from multiprocessing import Queue
 from threading import Thread, ThreadError
 
 from src import util
 from src.base.submit_base import SubmitBase
+from src.core.agent_config import AgentConfig
+from src.core.backpressure import Backpressure
+from src.core.metrics import Metrics
+from src.core.profiler import Profiler
 from src.logger import Logger
 
 
@@ -17,21 +23,81 @@ class SubmitQuit(BaseException):
     ...
 
 
+class SinkEntity(object):
+    """
+    Queue and threads of one submitter, a slow submitter does not hold the others back
+    """
+
+    def __init__(self, submitter: SubmitBase, thread_count: int, queue_config: dict, name: str):
+        self.logger = Logger().getLogger(__name__)
+        self.name = name
+        self.submitter = submitter
+        self.thread_count = thread_count
+        self.backpressure = Backpressure(queue_config, f"{name}_queue", limit=1000, policy="block")
+        self.queue = queue.Queue(self.backpressure.limit)
+        self.threads = [Thread(None, self.daemon, f"{name}_{i}") for i in range(thread_count)]
+
+    def put(self, data: dict, encoded: bytes):
+        self.backpressure.put(self.queue, {'cmd': "result", 'data': data, 'encoded': encoded})
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        for thread in self.threads:
+            if thread.is_alive():
+                self.queue.put({'cmd': "quit"})
+        for thread in self.threads:
+            if thread.is_alive():
+                self.logger.info(f"Thread '{thread.name}' joining...")
+                thread.join()
+                self.logger.info(f"Thread '{thread.name}' joined.")
+
+    def daemon(self):
+        profiler = Profiler()
+        while True:
+            profiler.checkpoint()
+            item = self.queue.get()
+            if item['cmd'] == "quit":
+                break
+            try:
+                self.submitter.submit(item['data'], item['encoded'])
+            except Exception as e:
+                self.logger.error(f"Submitter '{self.name}' submit failed: {e!r}")
+                util.printTraceback(e, self.logger.error)
+
+
 class SubmitEntity(object):
-    def __init__(self, queue_in: Queue, submitters: list, name: str):
+    def __init__(self, queue_in: Queue, sinks: list, name: str):
         self.logger = Logger().getLogger(__name__)
         self.name = name
         self.queue_in = queue_in
-        self.submitters = submitters
+        self.sinks = sinks
 
         self.running = True
 
     def set_running(self, r):
         self.running = r
 
+    def dispatch(self, result: dict):
+        """
+        Encode result once for each format used by submitters and hand the same bytes to all of them
+        """
+        if "submit_time" not in result:
+            result['submit_time'] = util.now()
+        encoded = {}
+        for sink in self.sinks:
+            format = sink.submitter.getFormat()
+            if format not in encoded:
+                encoded[format] = sink.submitter.encoder.encode(result)
+            sink.put(result, encoded[format])
+
     def daemon(self):
         self.logger.info(f"SubmitEntity '{self.name}' daemon is running...")
+        profiler = Profiler()
         while self.running:
+            profiler.checkpoint()
             try:
                 result = self.queue_in.get()
                 assert isinstance(result, dict)
@@ -44,10 +110,7 @@ class SubmitEntity(object):
                     case "result" | "error":
                         # result struct
                         try:
-                            for index, submitter in enumerate(self.submitters):
-                                if not isinstance(submitter, SubmitBase):
-                                    raise ValueError(f"Submitter [{index}] is not a submit class")
-                                submitter.submit(result)
+                            self.dispatch(result)
                         except ValueError as e:
                             self.logger.error(str(e))
                             util.printTraceback(e, self.logger.error)
@@ -74,9 +137,20 @@ class SubmitEntity(object):
 
 
 class Submitting(object):
+    SubmitTable = {
+        'print': ("src.submits.print_submit", "PrintSubmit"),
+        'file': ("src.submits.file_submit", "FileSubmit"),
+        'http': ("src.submits.http_submit", "HttpSubmit"),
+        'column': ("src.submits.column_submit", "ColumnSubmit"),
+    }
+
     def __init__(self, submit_count: int, submit_queue_size: int = 20):
+        """
+        :param submit_count: fan-out threads taking results from the submit queue
+        """
         self.submit_count = submit_count
         self.submitters = []
+        self.sinks = []  # SinkEntity of every submitter
         self.submit_threads = {}
         self.queue = Queue(submit_queue_size)
 
@@ -89,6 +163,9 @@ class Submitting(object):
         for submitter in self.submitters:
             if isinstance(submitter, SubmitBase):
                 submitter.reset()
+        for submitter in self.submitters:
+            if isinstance(submitter, SubmitBase):
+                self.logger.info(f"Submitter '{submitter.__class__.__name__}': {submitter.get_stats()!r}")
         self.logger.debug("SUBMIT QUEUE JOINING...")
         self.queue.close()
         self.queue.join_thread()
@@ -97,14 +174,76 @@ class Submitting(object):
     def get_queue(self):
         return self.queue
 
-    def register_submit(self, submit: SubmitBase):
+    @staticmethod
+    def submit_class(submit_config: dict):
+        """
+        Submitter class of one item of the 'submit' config, its module (and e.g. requests for http) is imported when used
+        """
+        submit_type = util.checkKey("type", submit_config, str, "submit")
+        if submit_type not in Submitting.SubmitTable:
+            raise ValueError(f"Submit type '{submit_type}' is not supported, "
+                             f"support {', '.join(Submitting.SubmitTable)}.")
+        (module_path, class_name) = Submitting.SubmitTable[submit_type]
+        classObj = getattr(importlib.import_module(module_path), class_name)
+        if not isinstance(classObj, type) or not issubclass(classObj, SubmitBase):
+            raise RuntimeError(f"Submit classobj has no class structure handled.")
+        return classObj
+
+    @staticmethod
+    def create_submit(config: AgentConfig, submit_config: dict, checking: bool = False) -> SubmitBase:
+        """
+        Build a submitter from one item of the 'submit' config
+        :param checking: only parse and check the config, no file, socket or spool is opened
+        """
+        classObj = Submitting.submit_class(submit_config)
+        kwargs = {}
+        for key in ("capacity", "timeout"):
+            if key in submit_config:
+                kwargs[key] = submit_config[key]
+        if checking:
+            return classObj.checkConfig(config, submit_config=submit_config, **kwargs)
+        return classObj(config, submit_config=submit_config, **kwargs)
+
+    @staticmethod
+    def sink_config(submit_config: dict):
+        """
+        :return: (thread_count, queue_config) of the sink running one submitter
+        """
+        try:
+            thread_count = util.checkKey("threads", submit_config, int, "submit")
+        except ValueError:
+            thread_count = 1
+        if thread_count <= 0:
+            raise ValueError(f"submit threads must be positive, but '{thread_count}' found.")
+        try:
+            queue_config = util.checkKey("queue", submit_config, dict, "submit")
+        except ValueError:
+            queue_config = None
+        return thread_count, queue_config
+
+    def register_config(self, config: AgentConfig, submit_config: dict):
+        """
+        Build and register a submitter with its 'threads' and 'queue' configs
+        """
+        thread_count, queue_config = Submitting.sink_config(submit_config)
+        self.register_submit(self.create_submit(config, submit_config), thread_count, queue_config)
+
+    def register_submit(self, submit: SubmitBase, thread_count: int = 1, queue_config: dict = None):
         if submit not in self.submitters:
             self.submitters.append(submit)
         else:
             raise ValueError(f"SubmitBase duplicated.")
+        name = f"sink_{len(self.sinks)}_{submit.__class__.__name__}"
+        self.sinks.append(SinkEntity(submit, thread_count, queue_config, name))
+        self.logger.info(f"Submit sink '{name}' has been setup with {thread_count} thread"
+                         f"{'s' if thread_count != 1 else ''}.")
 
     def _reset_threads(self):
         if self.submit_threads:
+            for submitter in self.submitters:
+                # a submit thread blocked on a full buffer gives up waiting
+                if isinstance(submitter, SubmitBase):
+                    submitter.interrupt()
             for name, item in self.submit_threads.items():
                 thread = item['thread']
                 entity = item['entity']
@@ -117,14 +256,16 @@ class Submitting(object):
                         thread.join()
                         self.logger.info(f"Thread '{thread.name}' joined.")
             self.submit_threads = {}
-            gc.collect()
+            # fan-out threads are gone, sink threads finish what is queued and quit
+            for sink in self.sinks:
+                sink.stop()
         self.logger.debug("Threads Reset.")
 
     def _setup_threads(self):
         self._reset_threads()
         for i in range(self.submit_count):
             name = "_".join(("submit", str(i)))
-            entity = SubmitEntity(self.queue, self.submitters, name)
+            entity = SubmitEntity(self.queue, self.sinks, name)
             thread = Thread(None, entity.daemon, name)
             self.submit_threads[name] = {
                 'entity': entity,
@@ -134,6 +275,10 @@ class Submitting(object):
 
     def start(self):
         self.logger.info("Ready to start submit threads...")
+        Metrics().probe("queue_depth", "submit", self.queue.qsize)
+        for sink in self.sinks:
+            Metrics().probe("queue_depth", sink.name, sink.queue.qsize)
+            sink.start()
         for name, item in self.submit_threads.items():
             if not isinstance(item['thread'], Thread):
                 self.logger.error(f"Thread name '{name}' has a non Thread instance! Skipped.")
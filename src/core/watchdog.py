@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+"""
+Watchdog 任务超时看门狗类
+每个工作进程只有一个看门狗线程, 用堆记录所有执行中任务的截止时间,
+到期后标记任务超时并调用任务的取消函数 (例如杀掉子进程), 任务自身在返回后检查超时标记.
+
+A cancel runs with the watchdog lock held and unwatch takes the lock too, so once unwatch returned the cancel of
+that run never fires; a run attaches the cancel of what it started (process, future) to its own token.
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from typing import Callable
+
+from src import util
+from src.logger import Logger
+
+
+class WatchToken(object):
+    def __init__(self, name: str, deadline: float, cancel: Callable = None):
+        self.name = name
+        self.deadline = deadline
+        self.cancel = cancel
+        self.expired = False
+        self.done = False
+        self.latency = None  # seconds between deadline and the moment watchdog fired
+
+
+@util.singleton
+class Watchdog(object):
+    def __init__(self):
+        self.heap = []  # (deadline, seq, WatchToken)
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.local = threading.local()  # token of the run in the calling thread
+        self.thread = None
+        self.pid = None
+        self.mutex = threading.Lock()
+
+        self.expired = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+        self.logger = Logger().getLogger(__name__)
+
+    def _ensure_thread(self):
+        if self.pid != os.getpid():
+            # the singleton is inherited by forked workers but its thread is not, start one per process
+            self.pid = os.getpid()
+            self.heap = []
+            self.cond = threading.Condition()
+            self.local = threading.local()
+            self.mutex = threading.Lock()
+            self.thread = None
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.mutex:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(None, self._daemon, "watchdog", daemon=True)
+                self.thread.start()
+
+    def watch(self, name: str, timeout: float, cancel: Callable = None):
+        """
+        Start watching a running task
+        :param cancel: called from the watchdog thread when the deadline expired, it must not block
+        :rtype: WatchToken
+        """
+        self._ensure_thread()
+        token = WatchToken(name, time.monotonic() + timeout, cancel)
+        with self.cond:
+            heapq.heappush(self.heap, (token.deadline, next(self.seq), token))
+            if self.heap[0][2] is token:
+                self.cond.notify()
+        self.local.token = token
+        return token
+
+    def attach(self, cancel: Callable):
+        """
+        Cancel what the run of the calling thread just started (process, future) when its deadline expires,
+        the callable is bound to this run, a later attempt of the task is never cancelled by it
+        """
+        token = getattr(self.local, "token", None)
+        if token is None:
+            return
+        with self.cond:
+            if token.done:
+                return
+            token.cancel = cancel
+            if token.expired:
+                # expired before the run got here
+                self._cancel(token)
+
+    def unwatch(self, token: WatchToken):
+        # removed lazily by the watchdog thread, a cancel is never called after this returns
+        with self.cond:
+            token.done = True
+        if getattr(self.local, "token", None) is token:
+            self.local.token = None
+
+    def get_stats(self):
+        return {
+            'watching': len(self.heap),
+            'expired': self.expired,
+            'latency_max': self.latency_max,
+            'latency_avg': self.latency_total / self.expired if self.expired else 0.0,
+        }
+
+    def _daemon(self):
+        while True:
+            with self.cond:
+                while self.heap and self.heap[0][2].done:
+                    heapq.heappop(self.heap)
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                deadline, _, token = self.heap[0]
+                now = time.monotonic()
+                if deadline > now:
+                    self.cond.wait(deadline - now)
+                    continue
+                heapq.heappop(self.heap)
+                token.expired = True
+                token.latency = now - deadline
+                self.expired += 1
+                self.latency_total += token.latency
+                self.latency_max = max(self.latency_max, token.latency)
+                self._cancel(token)
+
+    def _cancel(self, token: WatchToken):
+        """
+        Called with cond held, the run of token is not unwatched yet
+        """
+        if callable(token.cancel):
+            try:
+                token.cancel()
+            except Exception as e:
+                self.logger.error(f"Watchdog cancel task '{token.name}' failed: {e!r}")
+                util.printTraceback(e, self.logger.error)
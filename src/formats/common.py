@@ -8,7 +8,7 @@ Common formats
 from src.formats.format import format, FormatError
 
 
-@format("toInt")
+@format("toInt", binary=True)
 def toInt(value):
     try:
         return int(value)
@@ -16,7 +16,7 @@ def toInt(value):
         raise FormatError(e) from e
 
 
-@format("toIntOrNull")
+@format("toIntOrNull", binary=True)
 def toIntOrNull(value):
     try:
         return int(value)
@@ -24,15 +24,7 @@ def toIntOrNull(value):
         return None
 
 
-@format("toFloat")
-def toFloat(value):
-    try:
-        return float(value)
-    except (ValueError, TypeError) as e:
-        return float(0)
-
-
-@format("toFloatOrNone")
+@format("toFloatOrNone", binary=True)
 def toFloatOrNone(value):
     try:
         return float(value)
@@ -40,7 +32,7 @@ def toFloatOrNone(value):
         return None
 
 
-@format("toFloat")
+@format("toFloat", binary=True)
 def toFloat(value):
     try:
         return float(value)
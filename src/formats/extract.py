@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""
+Extract formats
+parameterized formats replacing awk/grep wrappers, configured as {"name": <format name>, <parameters>...}
+@ Ruilx
+
+regex  : 'pattern' regex, 'group' index or name of the capture group (default: 1, or 0 without groups),
+         'multiline' ^ and $ match at each line (default: true), gives None when nothing matched
+field  : 'field' index of the field (negative from the end), 'sep' separator (default: whitespace),
+         'line' index of the line to split (default: whole value), gives None when out of range
+kv     : parse a "key: value" table into a dict, 'sep' separator between key and value (default: ":"),
+         'keys' list of keys to keep (default: all), 'each' format config applied to each value
+jsonptr: 'pointer' RFC 6901 JSON pointer (e.g. "/data/0/value"), value is a json text or an already parsed value,
+         gives None when the pointer does not exist
+unit   : parse a number with an optional unit suffix ("4 kB", "1.5G", "300ms"), scaled to 'to' unit (default: ""),
+         'base' of byte units without "i" (default: 1024, like procfs "kB"), "KiB"-style units are always 1024
+scale  : value * 'factor' + 'offset' (default: 1, 0)
+"""
+
+import json
+import re
+
+from src.formats.format import FormatError, FormatFactory, formatBuilder
+
+
+def _text(value):
+    return value.decode("utf-8") if isinstance(value, (bytes, bytearray)) else value
+
+
+@formatBuilder("regex")
+def regex(pattern: str, group=None, multiline: bool = True):
+    try:
+        compiled = re.compile(pattern, re.MULTILINE if multiline else 0)
+    except re.error as e:
+        raise ValueError(f"regex format pattern '{pattern}' invalid: {e}") from e
+    if group is None:
+        group = 1 if compiled.groups else 0
+
+    def extract(value):
+        match = compiled.search(_text(value))
+        if match is None:
+            return None
+        return match.group(group)
+
+    return extract
+
+
+@formatBuilder("field", binary=True)
+def field(field: int, sep: str = None, line: int = None):
+    def extract(value):
+        if isinstance(value, (bytes, bytearray)):
+            value = value.decode("utf-8")
+        if line is not None:
+            lines = value.splitlines()
+            if not -len(lines) <= line < len(lines):
+                return None
+            value = lines[line]
+        fields = value.split(sep)
+        if not -len(fields) <= field < len(fields):
+            return None
+        return fields[field].strip()
+
+    return extract
+
+
+@formatBuilder("kv")
+def kv(sep: str = ":", keys: list = None, each=None):
+    wanted = set(keys) if keys is not None else None
+    convert = FormatFactory().compile(each)
+
+    def extract(value):
+        table = {}
+        for line in _text(value).splitlines():
+            key, found, item = line.partition(sep)
+            if not found:
+                continue
+            key = key.strip()
+            if wanted is not None and key not in wanted:
+                continue
+            table[key] = convert(item.strip())
+        return table
+
+    return extract
+
+
+@formatBuilder("jsonptr", binary=True)
+def jsonptr(pointer: str):
+    if pointer and not pointer.startswith("/"):
+        raise ValueError(f"jsonptr format pointer '{pointer}' must be empty or start with '/'")
+    tokens = [token.replace("~1", "/").replace("~0", "~") for token in pointer.split("/")[1:]]
+
+    def extract(value):
+        if isinstance(value, (str, bytes, bytearray)):
+            try:
+                value = json.loads(value)
+            except ValueError as e:
+                raise FormatError(f"jsonptr format value is not a json text: {e}") from e
+        for token in tokens:
+            if isinstance(value, dict):
+                if token not in value:
+                    return None
+                value = value[token]
+            elif isinstance(value, list):
+                if not token.isdigit() or int(token) >= len(value):
+                    return None
+                value = value[int(token)]
+            else:
+                return None
+        return value
+
+    return extract
+
+
+UnitPattern = re.compile(r"^\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*([A-Za-z%]*)\s*$")
+TimeUnits = {'ns': 1e-9, 'us': 1e-6, 'ms': 1e-3, 's': 1, 'm': 60, 'min': 60, 'h': 3600, 'd': 86400}
+BytePrefixes = "kmgtpe"
+
+
+def _unitFactor(unit: str, base: int):
+    if unit in TimeUnits:
+        return TimeUnits[unit]
+    lower = unit.lower()
+    if lower in ("", "b", "%"):
+        return 1
+    prefix = lower[0]
+    if prefix not in BytePrefixes or lower[1:] not in ("", "b", "ib", "i"):
+        raise ValueError(f"unit '{unit}' is not a byte or time unit")
+    return (1024 if "i" in lower[1:] else base) ** (BytePrefixes.index(prefix) + 1)
+
+
+@formatBuilder("unit", binary=True)
+def unit(to: str = "", base: int = 1024):
+    if base not in (1000, 1024):
+        raise ValueError(f"unit format base must be 1000 or 1024, but '{base}' found")
+    target = _unitFactor(to, base)
+    factors = {}  # unit suffix => factor, units seen in values are resolved once
+
+    def extract(value):
+        match = UnitPattern.match(_text(value))
+        if match is None:
+            raise FormatError(f"unit format value '{value!r}' is not a number with unit")
+        suffix = match.group(2)
+        if suffix not in factors:
+            try:
+                factors[suffix] = _unitFactor(suffix, base) / target
+            except ValueError as e:
+                raise FormatError(str(e)) from e
+        return float(match.group(1)) * factors[suffix]
+
+    return extract
+
+
+@formatBuilder("scale", binary=True)
+def scale(factor: float = 1, offset: float = 0):
+    def extract(value):
+        try:
+            return float(value) * factor + offset
+        except (ValueError, TypeError) as e:
+            raise FormatError(e) from e
+
+    return extract
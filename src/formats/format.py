@@ -2,14 +2,22 @@
 
 """
 Format factory class
+
+a format config item is a format name, or a dict of a parameterized format name and its parameters,
+e.g. {"name": "regex", "pattern": "MemTotal:\\s+(\\d+)"}, the built format is cached by its parameters
 """
 
+import json
+
 from src.util import singleton
 
 @singleton
 class FormatFactory(object):
     def __init__(self):
         self.__formats = {}
+        self.__binary = set()  # formats accept bytes value as well as str
+        self.__builders = {}  # parameterized format name => builder(**params) returning a format function
+        self.__built = {}  # parameters json => built format function
 
     def __setitem__(self, key: str, value):
         self.__formats[key] = value
@@ -20,22 +28,101 @@ class FormatFactory(object):
         raise KeyError(f"format has no format method names '{key}'")
 
     def __contains__(self, key: str):
-        return key in self.__formats
+        return key in self.__formats or key in self.__builders
+
+    def setBuilder(self, key: str, builder):
+        self.__builders[key] = builder
+
+    def build(self, spec: dict):
+        """
+        Build a parameterized format, same parameters share one built function
+        """
+        name = spec.get('name')
+        if name not in self.__builders:
+            raise KeyError(f"format has no parameterized format method names '{name}'")
+        key = json.dumps(spec, sort_keys=True)
+        if key not in self.__built:
+            params = {k: v for k, v in spec.items() if k != "name"}
+            try:
+                self.__built[key] = self.__builders[name](**params)
+            except TypeError as e:
+                raise ValueError(f"format '{name}' parameters {params!r} invalid: {e}") from e
+        return self.__built[key]
+
+    def setBinary(self, key: str):
+        self.__binary.add(key)
+
+    def isBinary(self, key: str):
+        return key in self.__binary
+
+    def compile(self, spec):
+        """
+        Build the format config of a task into one callable, names are looked up once here
+        :param spec: None, a format name, or a (nested) list of names applied in order,
+            each step takes the output of the previous one, a None output ends the chain with None
+        """
+        funcs = self.__resolve(spec)
+        match len(funcs):
+            case 0:
+                return _identity
+            case 1:
+                return funcs[0]
+
+        def pipeline(value):
+            for func in funcs:
+                value = func(value)
+                if value is None:
+                    return None
+            return value
 
+        return pipeline
 
-def format(name: str):
+    def __resolve(self, spec):
+        if spec is None:
+            return []
+        elif isinstance(spec, str):
+            return [self[spec]]
+        elif isinstance(spec, dict):
+            return [self.build(spec)]
+        elif isinstance(spec, list):
+            return [func for item in spec for func in self.__resolve(item)]
+        raise ValueError(f"format name type need str or dict, but '{type(spec)}' found")
+
+
+def _identity(value):
+    return value
+
+
+def format(name: str, binary: bool = False):
+    """
+    :param binary: format function also accepts bytes, readers can skip decoding before it
+    """
     def decorator(func):
+        if not callable(func):
+            raise ValueError(f"Format function '{func}' is not callable")
         if name not in FormatFactory():
             FormatFactory()[name] = func
+            if binary:
+                FormatFactory().setBinary(name)
+            return func
+        else:
+            raise NameError(f"format name '{name}' already registered into format factory")
+    return decorator
 
-            def inner(value):
-                if callable(func):
-                    return func(value)
-                raise ValueError(f"Format function '{func}' is not callable")
 
-            return inner
-        else:
+def formatBuilder(name: str, binary: bool = False):
+    """
+    Register a parameterized format, the decorated builder takes the parameters of a format config item
+    and returns the format function, expensive parts (e.g. regex compiling) are done in the builder
+    :param binary: built format function also accepts bytes
+    """
+    def decorator(builder):
+        if name in FormatFactory():
             raise NameError(f"format name '{name}' already registered into format factory")
+        FormatFactory().setBuilder(name, builder)
+        if binary:
+            FormatFactory().setBinary(name)
+        return builder
     return decorator
 
 
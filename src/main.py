@@ -15,23 +15,65 @@ import threading
 from core.agent_config import AgentConfig
 from logger import Logger
 from src import util
+from src.core.backpressure import Backpressure
+from src.core.gc_policy import GcPolicy
+from src.core.metrics import Metrics, MetricsReporter
+from src.core.profiler import Profiler
+from src.core.reloader import Reloader
 from src.core.submitting import Submitting
 from src.core.scheduler import Scheduler
 from src.core.processing import Processing
 from src.core.perfmon import Perfmon
-from src.submits.print_submit import PrintSubmit
 
 
 def argBuilder():
     argparser = argparse.ArgumentParser(sys.argv[0], description="Perfmon agent")
     argparser.add_argument("-c", "--config", type=str, required=True, help="config file", dest="config")
+    argparser.add_argument("--check", action="store_true", help="validate config and exit", dest="check")
     return argparser.parse_args()
 
 
+def check(config: AgentConfig):
+    """
+    Validate the config without starting workers or submitters, tasks and submitters are parsed by their
+    constructors but open no file, socket or process, only the modules of configured task methods and
+    submit types are imported
+    :return: True if the config is valid
+    """
+    logger = Logger().getLogger(__name__)
+    try:
+        names = set()
+        for item in config.getPerfmonItems():
+            perfmon = Perfmon.check(config.getAgentName(), item)
+            if perfmon.name in names:
+                raise ValueError(f"Perfmon name '{perfmon.name}' duplicated.")
+            names.add(perfmon.name)
+        submit_configs = config.getSubmitConfigs()
+        if not submit_configs:
+            raise ValueError("Config need 'submit' item")
+        for submit_config in submit_configs:
+            Submitting.create_submit(config, submit_config, checking=True)
+            thread_count, queue_config = Submitting.sink_config(submit_config)
+            Backpressure(queue_config, "sink_queue", limit=1000, policy="block")
+        Backpressure(config.getSubmitQueueConfig() or {}, "submit_queue", limit=20)
+        GcPolicy(config.getGcConfig())
+        Metrics().setup(config.getMetricsConfig())
+        Profiler().setup(config.getProfileConfig())
+        Reloader.checkConfig(config)
+    except Exception as e:
+        logger.error(f"Config check failed: {e!r}")
+        return False
+    logger.info(f"Config check passed: {len(names)} perfmon item{'s' if len(names) != 1 else ''}, "
+                f"{len(submit_configs)} submitter{'s' if len(submit_configs) != 1 else ''}.")
+    return True
+
+
 def main():
     logger = Logger().getLogger(__name__)
     args = argBuilder()
     config = AgentConfig(args.config)
+    if args.check:
+        sys.exit(0 if check(config) else 1)
     print(config.getAgentName())
     print(config.getReportUrl())
     process_count = config.getProcessCount()
@@ -39,13 +81,27 @@ def main():
         process_count = util.cpuCount()
         logger.info(f"Worker count is set to '{process_count}' as CPU count.")
 
-    submitting = Submitting(1)
-    submit = PrintSubmit(config)
-    submitting.register_submit(submit)
+    # workers forked later inherit the metrics settings
+    Metrics().setup(config.getMetricsConfig())
 
-    scheduler = Scheduler()
+    # results a worker puts into a full submit queue are blocked or dropped by this policy
+    submit_queue_config = config.getSubmitQueueConfig() or {}
+    submit_queue_size = Backpressure(submit_queue_config, "submit_queue", limit=20).limit
+    submitting = Submitting(1, submit_queue_size)
+    submit_configs = config.getSubmitConfigs()
+    if not submit_configs:
+        raise ValueError("Config need 'submit' item")
+    for submit_config in submit_configs:
+        submitting.register_config(config, submit_config)
 
-    processing = Processing(process_count)
+    thread_count = config.getThreadCount() or 1
+
+    gc_policy = GcPolicy(config.getGcConfig())
+    processing = Processing(process_count, config.getAgentName(), submitting.get_queue(), gc_policy, thread_count,
+                            submit_queue_config=submit_queue_config)
+
+    scheduler = Scheduler(processing.get_queue(), processing.get_feedback_queue(), processing.pinned_queue)
+    reporter = MetricsReporter(submitting.get_queue())
 
     def signal_handle(sig, _):
         signals = [signal.SIGINT, signal.SIGTERM]
@@ -56,20 +112,38 @@ def main():
 
     signal.signal(signal.SIGINT, signal_handle)
     signal.signal(signal.SIGTERM, signal_handle)
+    # SIGUSR1 toggles cProfile, SIGUSR2 toggles tracemalloc, in agent and all workers
+    Profiler().setup(config.getProfileConfig())
+    Profiler().install(processing.pids)
 
     for item in config.getPerfmonItems():
-        perfmon = Perfmon(config.getAgentName(), item, submitting.get_queue())
+        # scheduler side only keeps the perfmon header, tasks are built in worker processes
+        perfmon = Perfmon(config.getAgentName(), item, setup_tasks=False)
         scheduler.register_scheduler(perfmon)
+        processing.register_perfmon(item)
+
+    # SIGHUP or a changed config file reloads the perfmon list in the scheduler thread
+    reloader = Reloader(config, scheduler, processing)
+
+    # freeze long-lived objects before workers fork, workers freeze again after their tasks built
+    gc_policy.setup()
 
     try:
         submitting.start()
         processing.start()
+        Metrics().probe("queue_depth", "task", processing.get_queue().qsize)
+        reporter.start()
+        reloader.start()
+        Profiler().serve()
         scheduler.start()
     except BaseException as e:
         logger.error(f"BaseException: {e!r}")
         util.printTraceback(e, logger.error)
     finally:
         scheduler.stop()
+        reloader.stop()
+        reporter.stop()
+        Profiler().close()
         processing.stop()
         submitting.stop()
 
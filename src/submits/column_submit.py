@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+from src import util
+from src.base.submit_base import SubmitBase
+from src.core import columnar
+from src.core.agent_config import AgentConfig
+
+"""
+ColumnSubmit
+列式存储提交类
+结果按列缓冲, 每个批次写一个压缩列块, 用于在本机保留长时间的高频采样, 见 src.core.columnar
+
+configs:
+'path'         : segment directory (required)
+'engine'       : column chunk writer (choice: "auto", "arrow", "builtin", default: "auto")
+                 "arrow" writes Parquet and needs pyarrow, "auto" uses it when installed
+'level'        : zlib level of builtin chunks (default: 6)
+'segment_bytes': builtin segment rolls over after this size (default: 67108864)
+'buffer'       : backpressure configs of the buffer, see src.core.backpressure; results are not encoded for this
+                 sink, so the buffer is limited by count and 'max_bytes' is not supported
+"""
+
+
+class ColumnSubmit(SubmitBase):
+
+    def __init__(self, config: AgentConfig, capacity: int = 1000, timeout: float = 60, submit_config: dict = None):
+        self.submit_config = submit_config if submit_config is not None else config.getSubmitConfig() or {}
+        self.writer = None
+        try:
+            buffer = util.checkKey("buffer", self.submit_config, dict, "submit")
+        except ValueError:
+            buffer = None
+        # the writer takes the result dicts, encoding them on fan-out would be thrown away
+        super().__init__(capacity, timeout, buffer=buffer, format=None)
+        if self.buffer.max_bytes is not None:
+            raise ValueError("column submit buffer is limited by count, 'max_bytes' is not supported.")
+        self.config = config
+        self.filepath = util.checkKey("path", self.submit_config, str, "submit")
+
+        try:
+            self.engine = util.checkKey("engine", self.submit_config, str, "submit")
+        except ValueError:
+            self.engine = "auto"
+        self.engine = util.checkValueEnum(self.engine, columnar.EngineEnum, valueName="engine")
+        try:
+            self.level = util.checkKey("level", self.submit_config, int, "submit")
+        except ValueError:
+            self.level = 6
+        try:
+            self.segment_bytes = util.checkKey("segment_bytes", self.submit_config, int, "submit")
+        except ValueError:
+            self.segment_bytes = 67108864
+
+        if self.checking:
+            columnar.resolveEngine(self.engine)
+        else:
+            self.writer = columnar.ColumnWriter(self.filepath, self.engine, self.level, self.segment_bytes)
+
+    def reset(self):
+        super().reset()
+        if self.writer is not None:
+            self.writer.close()
+
+    def _send(self, batch: list, encoded: list) -> bool:
+        count = len(batch)
+        if count <= 0:
+            return False
+        self.writer.write(batch)
+        self.logger.debug(f"data has been write, total: {count} row{'s' if count != 1 else ''} in a chunk.")
+        return True
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats['columnar'] = self.writer.get_stats()
+        return stats
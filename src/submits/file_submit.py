@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
-import io
-import json
+import gzip
+import os
+import shutil
+import threading
+import time
 
 from pathlib import Path
 
@@ -12,33 +15,207 @@ from src.core.agent_config import AgentConfig
 """
 FileSubmit
 通过FILE提交数据类
+每个批次一次写入, 按大小或时间滚动文件, 滚动出的分段可在后台压缩, 按组提交间隔fsync
+
+configs:
+'path'           : file path (required)
+'rotate_bytes'   : roll the file over when it reaches this size in bytes (default: no size rotation)
+'rotate_interval': roll the file over every this many seconds (default: no time rotation)
+'compress'       : compress rolled segments in background (choice: "none", "gzip", default: "none")
+'keep'           : rolled segments kept, older ones are removed (default: keep all)
+'fsync'          : fsync written batches (default: true)
+'fsync_interval' : seconds between fsyncs, batches written in between share one fsync, 0 fsyncs every batch
+                   (default: 1)
 """
 
 
 class FileSubmit(SubmitBase):
-    Encoding = "utf-8"
+    CompressEnum = ("none", "gzip")
+    CompressSuffix = {'gzip': ".gz"}
 
-    def __init__(self, config: AgentConfig, capacity: int = 20, timeout: float = 10):
-        super().__init__(capacity, timeout)
+    def __init__(self, config: AgentConfig, capacity: int = 20, timeout: float = 10, submit_config: dict = None):
+        self.submit_config = submit_config if submit_config is not None else config.getSubmitConfig() or {}
+        try:
+            buffer = util.checkKey("buffer", self.submit_config, dict, "submit")
+        except ValueError:
+            buffer = None
+        try:
+            format = util.checkKey("format", self.submit_config, str, "submit")
+        except ValueError:
+            format = "JsonEachRow"
+        super().__init__(capacity, timeout, buffer=buffer, format=format)
         self.config = config
-        self.filepath = self.config.getReportUrl()  # will fix next
+        self.filepath = util.checkKey("path", self.submit_config, str, "submit")
+
+        try:
+            self.rotate_bytes = util.checkKey("rotate_bytes", self.submit_config, int, "submit")
+        except ValueError:
+            self.rotate_bytes = None
+        try:
+            self.rotate_interval = float(util.checkKey("rotate_interval", self.submit_config, (int, float), "submit"))
+        except ValueError:
+            self.rotate_interval = None
+        if (self.rotate_bytes is not None and self.rotate_bytes <= 0) or \
+                (self.rotate_interval is not None and self.rotate_interval <= 0):
+            raise ValueError(f"file submit 'rotate_bytes' and 'rotate_interval' must be positive.")
+        try:
+            self.compress = util.checkKey("compress", self.submit_config, str, "submit")
+        except ValueError:
+            self.compress = "none"
+        self.compress = util.checkValueEnum(self.compress, FileSubmit.CompressEnum, valueName="compress")
+        try:
+            self.keep = util.checkKey("keep", self.submit_config, int, "submit")
+        except ValueError:
+            self.keep = None
+        if self.keep is not None and self.keep <= 0:
+            raise ValueError(f"file submit 'keep' must be positive, but '{self.keep}' found.")
+        try:
+            self.fsync = util.checkKey("fsync", self.submit_config, bool, "submit")
+        except ValueError:
+            self.fsync = True
+        try:
+            self.fsync_interval = float(util.checkKey("fsync_interval", self.submit_config, (int, float), "submit"))
+        except ValueError:
+            self.fsync_interval = 1.0
 
         self.path = Path(self.filepath)
-        self.fd = self.path.open("a", encoding=FileSubmit.Encoding)
+        self.fd = None
+        self.size = 0  # bytes of the current file
+        self.opened_at = 0.0
+        self.dirty = False  # written but not fsynced yet
+        self.synced_at = time.monotonic()
+        self.compressing = []  # background compress threads
+        self.rotated = 0
+        self.fsyncs = 0
+        if not self.checking:
+            self._open()
+
+    def _open(self):
+        # binary formats are written as they are, unbuffered so a batch is one write call
+        self.fd = open(self.path, "ab", buffering=0)
+        self.size = self.fd.seek(0, os.SEEK_END)
+        self.opened_at = time.time()
+
+    def close(self):
+        if self.fd is not None and not self.fd.closed:
+            self._sync(True)
+            self.fd.close()
+        for thread in self.compressing:
+            thread.join()
+        self.compressing = []
+
+    def reset(self):
+        super().reset()
+        self.close()
+
+    def _sync(self, force: bool = False):
+        """
+        Group commit, fsync once for all batches written in the last 'fsync_interval' seconds
+        """
+        if not self.fsync or not self.dirty:
+            return
+        now = time.monotonic()
+        if force or now - self.synced_at >= self.fsync_interval:
+            os.fsync(self.fd.fileno())
+            self.dirty = False
+            self.synced_at = now
+            self.fsyncs += 1
+
+    def _shouldRotate(self, incoming: int) -> bool:
+        if self.size <= 0:
+            return False
+        if self.rotate_bytes is not None and self.size + incoming > self.rotate_bytes:
+            return True
+        return self.rotate_interval is not None and time.time() - self.opened_at >= self.rotate_interval
+
+    def _rotate(self):
+        self._sync(True)
+        self.fd.close()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.opened_at))
+        # segments opened in the same second are numbered after the ones kept
+        index = 1 + max((key[1] for key in self._segments().values() if key[0] == stamp), default=-1)
+        target = self.path.with_name(f"{self.path.name}.{stamp}.{index}")
+        os.replace(self.path, target)
+        self.rotated += 1
+        self.logger.info(f"File '{self.path!s}' rotated to '{target!s}'.")
+        self._open()
+
+        self.compressing = [thread for thread in self.compressing if thread.is_alive()]
+        if self.compress != "none":
+            thread = threading.Thread(None, self._compressSegment, f"compress_{target.name}", (target,))
+            thread.start()
+            self.compressing.append(thread)
+        else:
+            self._removeOld()
+
+    def _compressSegment(self, segment: Path):
+        target = segment.with_name(segment.name + FileSubmit.CompressSuffix[self.compress])
+        temp = segment.with_name(target.name + ".tmp")
+        try:
+            with open(segment, "rb") as src, gzip.open(temp, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1048576)
+            os.replace(temp, target)
+            os.unlink(segment)
+        except OSError as e:
+            self.logger.error(f"File segment '{segment!s}' compress failed: {e!r}")
+            return
+        self._removeOld()
 
-    def __del__(self):
-        if isinstance(self.fd, io.TextIOWrapper):
-            if not self.fd.closed:
-                self.fd.close()
+    def _segments(self):
+        """
+        :return: rolled segments of path, oldest first => (time opened, index)
+        """
+        prefix = self.path.name + "."
+        segments = {}
+        for item in self.path.parent.iterdir():
+            if not item.name.startswith(prefix) or item.name.endswith(".tmp"):
+                continue
+            # <path>.<time opened>.<index>[.gz]
+            parts = item.name[len(prefix):].split(".")
+            if len(parts) >= 2 and parts[1].isdigit():
+                segments[item] = (parts[0], int(parts[1]))
+        return dict(sorted(segments.items(), key=lambda item: item[1]))
 
-    def _send(self) -> bool:
-        count = len(self.buf)
+    def _removeOld(self):
+        if self.keep is None:
+            return
+        try:
+            segments = list(self._segments())
+            for segment in segments[:max(len(segments) - self.keep, 0)]:
+                segment.unlink()
+                self.logger.info(f"File segment '{segment!s}' removed, keep {self.keep}.")
+        except OSError as e:
+            self.logger.error(f"File segments of '{self.path!s}' remove failed: {e!r}")
+
+    def _timerEvent(self):
+        super()._timerEvent()
+        # batches written right before an idle period are synced within about 'timeout' seconds
+        if self.mutex.acquire(blocking=False):
+            try:
+                if self.fd is not None and not self.fd.closed:
+                    self._sync()
+            finally:
+                self.mutex.release()
+
+    def _send(self, batch: list, encoded: list) -> bool:
+        count = len(batch)
         if count <= 0:
             return False
-        if self.fd.closed:
+        if self.fd is None or self.fd.closed:
             raise RuntimeError(f"Submit: file: {self.path!s} closed.")
-        for item in self.buf:
-            self.fd.write(json.dumps(item))
-            self.fd.write('\n')
-        self.logger.debug(f"data has been write, total: {count} line{'s' if count != 1 else ''}.")
+        data = memoryview(self.encoder.batch(encoded))
+        if self._shouldRotate(len(data)):
+            self._rotate()
+        written = 0
+        while written < len(data):
+            written += self.fd.write(data[written:])
+        self.size += written
+        self.dirty = True
+        self._sync(self.fsync_interval <= 0)
+        self.logger.debug(f"data has been write, total: {count} record{'s' if count != 1 else ''}.")
         return True
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats.update({'bytes': self.size, 'rotated': self.rotated, 'fsyncs': self.fsyncs})
+        return stats
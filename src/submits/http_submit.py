@@ -1,14 +1,39 @@
 # -*- coding: utf-8 -*-
 
+import gzip
+import random
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
 
 from src import util
 from src.base.submit_base import SubmitBase
 from src.core.agent_config import AgentConfig
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 """
 HttpSubmit
 通过HTTP提交数据类
+结果以JsonEachRow格式编码, 批量以JSON数组POST, 可压缩, 失败后按指数退避(带抖动)延后重试, 不阻塞提交线程
+
+configs:
+'url'          : report url (default: agent 'report' config)
+'header'       : extra http request headers
+'retry'        : failed sends before the oldest 'capacity' results are dropped (default: 3), without 'spool' only
+'compress'     : request body encoding (choice: "none", "gzip", "zstd", default: "none"), "zstd" needs zstandard module
+'compress_level': compress level (default: 6 for gzip, 3 for zstd)
+'backoff'      : first retry delay in seconds, doubled every failure (default: 1)
+'backoff_max'  : max retry delay in seconds (default: 60)
+'pool_size'    : kept-alive connections of the session (default: 4)
+'max_bytes'    : send when buffered json reaches this size in bytes (default: 1048576)
+'request_timeout': seconds to wait for the server (default: 10)
+'spool'        : spool configs, failed batches go to a disk spool and are replayed later, see src.core.spool
+'buffer'       : backpressure configs of the buffer while batches cannot be sent, see src.core.backpressure
 """
 
 
@@ -17,13 +42,97 @@ class HttpSubmit(SubmitBase):
         'Accept': "application/json;q=0.9;charset=utf-8",
         'User-Agent': "Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/55.0.2883.87 Safari/537.36 Perfmon/1.0 (Client 1.0) Trust-Agent/1.0"
     }
+    CompressEnum = ("none", "gzip", "zstd")
 
-    def __init__(self, config: AgentConfig, retry: int = 3, capacity: int = 20, timeout: float = 10):
-        super().__init__(capacity, timeout)
-        self.retry = retry
-        self.session = requests.Session()
+    def __init__(self, config: AgentConfig, retry: int = 3, capacity: int = 20, timeout: float = 10,
+                 submit_config: dict = None):
         self.config = config
-        util.checkUrl(self.config.getReportUrl())
+        self.submit_config = submit_config if submit_config is not None else config.getSubmitConfig() or {}
+        try:
+            if util.checkKey("format", self.submit_config, str, "submit") != "JsonEachRow":
+                raise TypeError(f"http submit only supports format 'JsonEachRow'.")
+        except ValueError:
+            ...
+
+        try:
+            max_bytes = util.checkKey("max_bytes", self.submit_config, int, "submit")
+        except ValueError:
+            max_bytes = 1048576
+        try:
+            spool = util.checkKey("spool", self.submit_config, dict, "submit")
+        except ValueError:
+            spool = None
+        try:
+            buffer = util.checkKey("buffer", self.submit_config, dict, "submit")
+        except ValueError:
+            buffer = None
+        super().__init__(capacity, timeout, max_bytes, spool, buffer, "JsonEachRow")
+
+        try:
+            self.url = util.checkKey("url", self.submit_config, str, "submit")
+        except ValueError:
+            self.url = self.config.getReportUrl()
+        util.checkUrl(self.url)
+
+        try:
+            self.retry = util.checkKey("retry", self.submit_config, int, "submit")
+        except ValueError:
+            self.retry = retry
+        if self.retry <= 0:
+            raise ValueError(f"http submit retry must be positive, but '{self.retry}' found.")
+
+        try:
+            self.compress = util.checkKey("compress", self.submit_config, str, "submit")
+        except ValueError:
+            self.compress = "none"
+        self.compress = util.checkValueEnum(self.compress, HttpSubmit.CompressEnum, valueName="compress")
+        if self.compress == "zstd" and zstandard is None:
+            raise ValueError(f"http submit compress 'zstd' needs module 'zstandard' installed.")
+        try:
+            self.compress_level = util.checkKey("compress_level", self.submit_config, int, "submit")
+        except ValueError:
+            self.compress_level = 3 if self.compress == "zstd" else 6
+
+        try:
+            self.backoff = float(util.checkKey("backoff", self.submit_config, (int, float), "submit"))
+        except ValueError:
+            self.backoff = 1.0
+        try:
+            self.backoff_max = float(util.checkKey("backoff_max", self.submit_config, (int, float), "submit"))
+        except ValueError:
+            self.backoff_max = 60.0
+
+        try:
+            self.pool_size = util.checkKey("pool_size", self.submit_config, int, "submit")
+        except ValueError:
+            self.pool_size = 4
+
+        try:
+            self.request_timeout = float(util.checkKey("request_timeout", self.submit_config, (int, float), "submit"))
+        except ValueError:
+            self.request_timeout = 10.0
+
+        self.headers = dict(HttpSubmit.Headers)
+        try:
+            self.headers.update(util.checkKey("header", self.submit_config, dict, "submit"))
+        except ValueError:
+            ...
+        self.headers['Content-Type'] = "application/json; charset=utf-8"
+        if self.compress != "none":
+            self.headers['Content-Encoding'] = self.compress
+
+        self.session = None
+        if not self.checking:
+            self.session = requests.Session()
+            # retries are done here with backoff, not by urllib3 in place
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+        self.compressor = zstandard.ZstdCompressor(level=self.compress_level) if self.compress == "zstd" else None
+
+        self.failures = 0
+        self.retry_at = 0.0
+        self.dropped = 0
 
     def checkResponse(self, response: requests.Response):
         assert response.status_code == 200, f"report server response status code '{response.status_code}'"
@@ -35,24 +144,51 @@ class HttpSubmit(SubmitBase):
             ))
         return json_t
 
-    def _send(self) -> bool:
-        if len(self.buf) <= 0:
+    def _body(self, encoded: list) -> bytes:
+        # results are encoded as json already, the body is a json array of them
+        body = b"[" + b",".join(encoded) + b"]"
+        match self.compress:
+            case "gzip":
+                return gzip.compress(body, self.compress_level)
+            case "zstd":
+                return self.compressor.compress(body)
+        return body
+
+    def _delay(self) -> float:
+        # exponential backoff with full jitter, agents failing together do not retry together
+        return random.uniform(0, min(self.backoff * (2 ** (self.failures - 1)), self.backoff_max))
+
+    def _send(self, batch: list, encoded: list) -> bool:
+        if len(batch) <= 0:
+            return False
+        if time.monotonic() < self.retry_at:
+            # backing off, results stay buffered (or spooled) and are sent later
             return False
-        errmsg = []
-        result = ""
-        for i in range(self.retry):
-            try:
-                res = self.session.post(self.config.getReportUrl(), json=self.buf, headers=HttpSubmit.Headers)
-                self.checkResponse(res)
-                result = res.content
-                break
-            except BaseException as e:
-                errmsg.append(str(e))
-        if result:
-            self.logger.debug("data has been sent")
-            return True
-        else:
-            self.logger.debug("data send failure")
-            for index, content in enumerate(errmsg):
-                self.logger.debug(f"==> (try {index + 1}): {content}")
+        try:
+            res = self.session.post(self.url, data=self._body(encoded), headers=self.headers,
+                                    timeout=self.request_timeout)
+            self.checkResponse(res)
+        except Exception as e:
+            self.failures += 1
+            if self.failures >= self.retry and self.spool is None:
+                # the batch holds everything buffered during backoff, only the oldest 'capacity' results are
+                # dropped, the rest goes back to the buffer which is bounded by its backpressure policy
+                count = min(len(batch), self.capacity)
+                self.dropped += count
+                self.logger.error(f"data send failure {self.failures} times, dropped {count} oldest result"
+                                  f"{'s' if count != 1 else ''}: {e!r}")
+                self.failures = 0
+                self.retry_at = 0.0
+                if count >= len(batch):
+                    return True
+                del batch[:count]
+                del encoded[:count]
+                return False
+            delay = self._delay()
+            self.retry_at = time.monotonic() + delay
+            self.logger.debug(f"data send failure (try {self.failures}), retry in {delay:.1f}s: {e!r}")
             return False
+        self.logger.debug("data has been sent")
+        self.failures = 0
+        self.retry_at = 0.0
+        return True
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 
 import subprocess
+from concurrent.futures import CancelledError
 
 from src import util
 from src.base.task_base import TaskBase
+from src.core.async_exec import AsyncExecutor, StreamProcess
+from src.core.watchdog import Watchdog
 
 """
 Execute task instance
@@ -18,11 +21,26 @@ configs:
 'exec'  : command or shell execute (required)
 'params': list for command params (required)
 'stdin' : write to stdin when program started
+'engine': process engine: (choice: "async", "popen", default: "async")
+          "async": run on the worker asyncio executor, output drained incrementally, process group killed on timeout,
+                   commands of concurrent perfmon runs in one worker do not block each other
+          "popen": run with subprocess.Popen and wait in the worker thread
+'length': max bytes kept of stdout and stderr (default: 4096)
+'mode'  : run mode: (choice: "oneshot", "stream", default: "oneshot")
+          "oneshot": fork and exec the command on every run
+          "stream":  keep the command alive (e.g. "vmstat 1"), every run reads the latest output line,
+                     the command is restarted with backoff when it exits; the item is pinned to one worker,
+                     so only that worker starts the command
+'match' : for "stream" mode, regex an output line must match to be a sample, e.g. "^\\s*\\d" skips headers
+'max_age': for "stream" mode, a sample older than this seconds is an error, null for no limit (default: 60)
+'backoff': for "stream" mode, max seconds waiting before restart the command (default: 60)
 """
 
 
 class Execute(TaskBase):
     ProgramExitCode_OK = 0
+    EngineEnum = ("async", "popen")
+    ModeEnum = ("oneshot", "stream")
 
     def __init__(self, name: str, config: dict):
         self.exec = util.checkKey("exec", config, str, "config")
@@ -33,6 +51,42 @@ class Execute(TaskBase):
         except ValueError as e:
             self.stdin = ""
 
+        try:
+            self.engine = util.checkKey("engine", config, str, "config")
+        except ValueError:
+            self.engine = "async"
+        self.engine = util.checkValueEnum(self.engine, Execute.EngineEnum, valueName="engine")
+
+        try:
+            self.length = util.checkKey("length", config, int, "config")
+        except ValueError:
+            self.length = 4096
+        if self.length <= 0:
+            raise ValueError(f"'execute' task length cannot be zero or negative like '{self.length}'")
+
+        try:
+            self.mode = util.checkKey("mode", config, str, "config")
+        except ValueError:
+            self.mode = "oneshot"
+        self.mode = util.checkValueEnum(self.mode, Execute.ModeEnum, valueName="mode")
+
+        try:
+            self.match = util.checkKey("match", config, str, "config")
+        except ValueError:
+            self.match = None
+
+        try:
+            self.max_age = util.checkKey("max_age", config, (int, float), "config", canBeNone=True)
+        except ValueError:
+            self.max_age = 60
+        if self.max_age is not None and self.max_age <= 0:
+            raise ValueError(f"'execute' task max_age cannot be zero or negative like '{self.max_age}'")
+
+        try:
+            self.backoff = util.checkKey("backoff", config, (int, float), "config")
+        except ValueError:
+            self.backoff = 60
+
         if not self.exec:
             raise ValueError(f"'execute' task param 'exec' required.")
 
@@ -41,9 +95,15 @@ class Execute(TaskBase):
                 raise ValueError("'execute' task param 'param' each list item should be string type, but one of it "
                                  f"founded '{type(param)}'")
 
-        super().__init__(name, config)
         self.program = None
+        self.stream = None
         self.status_code = None
+        super().__init__(name, config)
+
+    @classmethod
+    def isStateful(cls, config: dict):
+        # a stream command is kept running by the worker which built the task
+        return config.get('mode') == "stream"
 
     def _checkProcess(self):
         if self.method != "execute":
@@ -52,35 +112,84 @@ class Execute(TaskBase):
             raise ValueError(f"Execute class exec command is empty")
 
     def _setup(self):
-        self.timeoutType = Execute.TimeoutTypeEnum.CustomType
+        if self.mode == "stream":
+            command = [self.exec]
+            command.extend(self.exec_params)
+            self.stream = StreamProcess(command, self.stdin, self.match, min(1.0, self.backoff), self.backoff)
+            self.stream.start()
+
+    @staticmethod
+    def _killProgram(program: subprocess.Popen):
+        if program.poll() is None:
+            program.kill()
 
     def _run(self, params: dict):
+        if self.mode == "stream":
+            self._runStream(params)
+            return
         command = [self.exec]
         command.extend(self.exec_params)
-        self.program = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                        encoding="utf-8")
-        if not self.program.stdin.closed:
-            if self.stdin:
-                self.program.stdin.write(self.stdin)
-            self.program.stdin.close()
-        else:
-            self.logger.warning("program STDIN closed, stdin data not send to program.")
+        match self.engine:
+            case "async":
+                self._runAsync(command, params)
+            case default:
+                self._runPopen(command, params)
+
+    def _runAsync(self, command: list, params: dict):
+        future = AsyncExecutor().run(command, self.stdin, self.timeout, self.length)
+        # cancelling the executor coroutine kills the process group
+        Watchdog().attach(future.cancel)
+        try:
+            result = future.result()
+        except CancelledError:
+            # cancelled by watchdog, TaskBase reports the timeout
+            return
 
+        exitcode = result.returncode
+        params['_returncode'] = exitcode
+        self.value = result.stdout.decode("utf-8", errors="replace")
+        params['_stderr'] = result.stderr.decode("utf-8", errors="replace")
+
+        if result.timeout:
+            raise TimeoutError(f"Program '{self.exec}' running time exceeded in {self.timeout} second"
+                               f"{'s' if self.timeout != 1 else ''}, process group killed.")
+        if exitcode != Execute.ProgramExitCode_OK:
+            self.error = f"Program '{self.exec}' exited with code '{exitcode}'"
+
+    def _runStream(self, params: dict):
+        sample = self.stream.sample()
+        params['_restarts'] = self.stream.restarts
+        if sample is None:
+            raise RuntimeError(f"Program '{self.exec}' has no output sample yet.")
+        age, line = sample
+        if self.max_age is not None and age > self.max_age:
+            raise RuntimeError(f"Program '{self.exec}' latest output sample is {age:.1f} seconds old, last exit code "
+                               f"'{self.stream.returncode}'.")
+        self.value = line
+
+    def _runPopen(self, command: list, params: dict):
+        self.program = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                        encoding="utf-8", errors="replace")
+        program = self.program
+        Watchdog().attach(lambda: Execute._killProgram(program))
         try:
-            self.program.wait(timeout=self.timeout)
+            # communicate drains both pipes, a child writing more than pipe buffer never blocks
+            stdout, stderr = self.program.communicate(self.stdin or None, timeout=self.timeout)
         except subprocess.TimeoutExpired:
-            self.program.terminate()
             self.program.kill()
+            stdout, stderr = self.program.communicate()
 
         exitcode = self.program.returncode
         params['_returncode'] = exitcode
-        self.value = self.program.stdout.read(4096)
-        params['_stderr'] = self.program.stderr.read(4096)
+        self.value = stdout[:self.length]
+        params['_stderr'] = stderr[:self.length]
 
         if exitcode != Execute.ProgramExitCode_OK:
             self.error = f"Program '{self.exec}' exited with code '{exitcode}'"
 
     def _join(self):
+        if isinstance(self.stream, StreamProcess):
+            self.stream.stop()
         if isinstance(self.program, subprocess.Popen):
             if self.program.poll() is None:
                 self.program.terminate()
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import time
+
+from src import util
+from src.base.task_base import TaskBase
+from src.core.raw_file import RawFile
+
+"""
+Procfs collector task instances
+parse kernel files directly into flat numeric dicts, keys are "<device>.<field>",
+counters are turned into per-interval deltas or rates inside the worker
+@ Ruilx
+
+configs:
+'method':  <for TaskBase use> Fixed: "procstat", "meminfo", "diskstats" or "netdev"
+'format':  <for TaskBase use> usually null, value is already numeric
+'expect':  <for TaskBase use> usually "real", applied to each value of the dict
+'timeout': <for TaskBase use>
+
+'path'   : kernel file to read, change it when host proc is mounted elsewhere (e.g. "/host/proc/stat")
+           (default: "/proc/stat", "/proc/meminfo", "/proc/diskstats", "/proc/net/dev")
+'output' : how counters are reported (choice: "rate", "delta", "total", default: "rate")
+           "rate":  change per second since last run, cpu times are percentage of the interval
+           "delta": change since last run
+           "total": raw counter value
+           first run of "rate" and "delta" has no previous sample, only gauges are reported
+'devices': list of cpu, disk or interface names to keep (e.g. ["cpu", "sda", "eth0"]), default all
+'exclude': regex of cpu, disk or interface names to drop (default: "^(loop|ram)\\d+$" for diskstats, none for others)
+'length' : read buffer length (default: 262144)
+
+values:
+procstat : cpu[N].{user,nice,system,idle,iowait,irq,softirq,steal,guest,guest_nice} in seconds,
+           system.{ctxt,intr,processes} counters, system.{procs_running,procs_blocked} gauges
+meminfo  : every /proc/meminfo field in bytes (or plain count for HugePages_*), all gauges
+diskstats: <disk>.{reads,reads_merged,read_bytes,read_ms,writes,writes_merged,write_bytes,write_ms,
+           io_ms,weighted_io_ms} counters, <disk>.in_progress gauge, <disk>.util percentage in "rate" output
+netdev   : <iface>.{rx,tx}_{bytes,packets,errs,drop,fifo} counters,
+           <iface>.{rx_frame,rx_compressed,rx_multicast,tx_colls,tx_carrier,tx_compressed} counters
+"""
+
+
+class ProcfsTask(TaskBase):
+    OutputEnum = ("rate", "delta", "total")
+    Method = None
+    DefaultPath = None
+    DefaultExclude = None
+
+    def __init__(self, name: str, config: dict):
+        try:
+            self.path = util.checkKey("path", config, str, "config")
+        except ValueError:
+            self.path = self.DefaultPath
+
+        try:
+            self.output = util.checkKey("output", config, str, "config")
+        except ValueError:
+            self.output = "rate"
+        self.output = util.checkValueEnum(self.output, ProcfsTask.OutputEnum, valueName="output")
+
+        try:
+            self.devices = set(util.checkKey("devices", config, list, "config"))
+        except ValueError:
+            self.devices = None
+
+        try:
+            exclude = util.checkKey("exclude", config, str, "config", canBeNone=True)
+        except ValueError:
+            exclude = self.DefaultExclude
+        self.exclude = re.compile(exclude) if exclude else None
+
+        try:
+            self.length = util.checkKey("length", config, int, "config")
+        except ValueError:
+            self.length = 262144
+        if self.length <= 0:
+            raise ValueError(f"'{self.Method}' task length cannot be zero or negative like '{self.length}'")
+
+        self.raw = None
+        self.prev = None  # (monotonic time, counters) of last run
+        super().__init__(name, config)
+
+    @classmethod
+    def isStateful(cls, config: dict):
+        # deltas and rates are computed against the previous run
+        return config.get('output', "rate") != "total"
+
+    def _checkProcess(self):
+        if self.method != self.Method:
+            raise TypeError(f"{self.__class__.__name__} class need a {self.Method}-type config, "
+                            f"but find '{self.method}' type")
+        if not os.path.isabs(self.path):
+            raise ValueError(f"{self.__class__.__name__} class file path '{self.path!r}' need a absolute path.")
+
+    def _setup(self):
+        self.raw = RawFile(self.path, self.length)
+
+    def _want(self, device: str):
+        if self.devices is not None and device not in self.devices:
+            return False
+        return self.exclude is None or not self.exclude.search(device)
+
+    def _parse(self, data: bytes):
+        """
+        :return: (counters, gauges) flat dicts of "<device>.<field>" => number
+        """
+        raise NotImplementedError()
+
+    def _rates(self, deltas: dict, elapsed: float):
+        return {key: delta / elapsed for key, delta in deltas.items()}
+
+    def _run(self, params: dict):
+        now = time.monotonic()
+        counters, gauges = self._parse(self.raw.read())
+        if self.output == "total":
+            self.value = {**counters, **gauges}
+            return
+
+        prev = self.prev
+        self.prev = (now, counters)
+        value = {}
+        if prev is not None and now > prev[0]:
+            deltas = {}
+            for key, count in counters.items():
+                last = prev[1].get(key)
+                # new device, or counter wrapped or reset (device re-added), skip it this interval
+                if last is not None and count >= last:
+                    deltas[key] = count - last
+            value = deltas if self.output == "delta" else self._rates(deltas, now - prev[0])
+        value.update(gauges)
+        self.value = value
+
+    def _join(self):
+        if isinstance(self.raw, RawFile):
+            self.raw.close()
+
+
+class ProcStat(ProcfsTask):
+    Method = "procstat"
+    DefaultPath = "/proc/stat"
+    CpuFields = ("user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal", "guest", "guest_nice")
+    Counters = {b"ctxt": "system.ctxt", b"intr": "system.intr", b"processes": "system.processes"}
+    Gauges = {b"procs_running": "system.procs_running", b"procs_blocked": "system.procs_blocked"}
+
+    def __init__(self, name: str, config: dict):
+        self.tick = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        super().__init__(name, config)
+
+    def _parse(self, data: bytes):
+        counters = {}
+        gauges = {}
+        for line in data.splitlines():
+            fields = line.split()
+            if not fields:
+                continue
+            head = fields[0]
+            if head.startswith(b"cpu"):
+                cpu = head.decode()
+                if not self._want(cpu):
+                    continue
+                for field, jiffies in zip(ProcStat.CpuFields, fields[1:]):
+                    counters[f"{cpu}.{field}"] = int(jiffies) / self.tick
+            elif head in ProcStat.Counters and len(fields) > 1:
+                counters[ProcStat.Counters[head]] = int(fields[1])
+            elif head in ProcStat.Gauges and len(fields) > 1:
+                gauges[ProcStat.Gauges[head]] = int(fields[1])
+        return counters, gauges
+
+    def _rates(self, deltas: dict, elapsed: float):
+        # cpu time is reported as percentage of the cpu's busy + idle time in the interval,
+        # guest time is already accounted in user time so it is left out of the sum
+        totals = {}
+        for key, delta in deltas.items():
+            cpu, field = key.split(".", 1)
+            if cpu.startswith("cpu") and not field.startswith("guest"):
+                totals[cpu] = totals.get(cpu, 0) + delta
+        rates = {}
+        for key, delta in deltas.items():
+            cpu = key.split(".", 1)[0]
+            if cpu in totals:
+                rates[key] = delta * 100 / totals[cpu] if totals[cpu] else 0.0
+            else:
+                rates[key] = delta / elapsed
+        return rates
+
+
+class MemInfo(ProcfsTask):
+    Method = "meminfo"
+    DefaultPath = "/proc/meminfo"
+
+    @classmethod
+    def isStateful(cls, config: dict):
+        # gauges only, any worker can read it
+        return False
+
+    def _parse(self, data: bytes):
+        gauges = {}
+        for line in data.splitlines():
+            fields = line.split()
+            if len(fields) < 2:
+                continue
+            key = fields[0].rstrip(b":").decode()
+            if not self._want(key):
+                continue
+            value = int(fields[1])
+            if len(fields) > 2 and fields[2] == b"kB":
+                value *= 1024
+            gauges[key] = value
+        return {}, gauges
+
+
+class DiskStats(ProcfsTask):
+    Method = "diskstats"
+    DefaultPath = "/proc/diskstats"
+    DefaultExclude = r"^(loop|ram)\d+$"
+    SectorSize = 512
+    # column after major, minor, name => (field, multiplier)
+    Fields = (("reads", 1), ("reads_merged", 1), ("read_bytes", SectorSize), ("read_ms", 1),
+              ("writes", 1), ("writes_merged", 1), ("write_bytes", SectorSize), ("write_ms", 1),
+              (None, 1), ("io_ms", 1), ("weighted_io_ms", 1))
+
+    def _parse(self, data: bytes):
+        counters = {}
+        gauges = {}
+        for line in data.splitlines():
+            fields = line.split()
+            if len(fields) < 14:
+                continue
+            disk = fields[2].decode()
+            if not self._want(disk):
+                continue
+            for (field, multiplier), count in zip(DiskStats.Fields, fields[3:]):
+                if field is None:
+                    gauges[f"{disk}.in_progress"] = int(count)
+                else:
+                    counters[f"{disk}.{field}"] = int(count) * multiplier
+        return counters, gauges
+
+    def _rates(self, deltas: dict, elapsed: float):
+        rates = super()._rates(deltas, elapsed)
+        for key, delta in deltas.items():
+            disk, field = key.rsplit(".", 1)
+            if field == "io_ms":
+                # time spent doing io in the interval, capped since io_ms is sampled in jiffies
+                rates[f"{disk}.util"] = min(delta / (elapsed * 10), 100.0)
+        return rates
+
+
+class NetDev(ProcfsTask):
+    Method = "netdev"
+    DefaultPath = "/proc/net/dev"
+    Fields = ("rx_bytes", "rx_packets", "rx_errs", "rx_drop", "rx_fifo", "rx_frame", "rx_compressed",
+              "rx_multicast", "tx_bytes", "tx_packets", "tx_errs", "tx_drop", "tx_fifo", "tx_colls",
+              "tx_carrier", "tx_compressed")
+
+    def _parse(self, data: bytes):
+        counters = {}
+        for line in data.splitlines()[2:]:
+            name, sep, rest = line.partition(b":")
+            if not sep:
+                continue
+            iface = name.strip().decode()
+            if not self._want(iface):
+                continue
+            for field, count in zip(NetDev.Fields, rest.split()):
+                counters[f"{iface}.{field}"] = int(count)
+        return counters, {}
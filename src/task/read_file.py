@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
+import glob
 import io
+import time
 from pathlib import Path
 from src import util
 from src.base.task_base import TaskBase
+from src.core.raw_file import RawFile
 
 """
 ReadFile task instance
@@ -14,19 +17,41 @@ configs:
 'expect':  <for TaskBase use>
 'timeout': <for TaskBase use>
 
-'path'  : the path to file (required)
+'path'  : the path to file (required without 'paths')
+'paths' : batch mode, list of absolute paths or glob patterns (e.g. "/sys/class/net/*/statistics/*"),
+          all files are read in one run, value is a dict of path => content, format and expect apply to each content
 'length': every read length (default: 4096)
+'io'    : read method: (choice: "text", "pread", default: "pread" for /proc, /sys and batch mode, "text" for others)
+          "text":  read with a text-mode file object, seek to start every read
+          "pread": keep a raw fd and pread from offset 0 into a reused buffer,
+                   content is decoded only when format or expect need text
+'rescan': batch mode, seconds between glob pattern expansions (default: 60)
 'close' : close policy: (choice: "always", "never", "on_exception")
           "always": close file every read
-          "never":  never close file, only use seek to reset pointer, except file closed unexpectedly, 
+          "never":  never close file, only use seek to reset pointer, except file closed unexpectedly,
                     will try open it in next time.
           "on_exception": file will close while on read exception, will try open it in next time.
 """
 
 
 class ReadFile(TaskBase):
+    IoEnum = ("text", "pread")
+    RawPrefix = ("/proc/", "/sys/")
+
     def __init__(self, name: str, config: dict):
-        self.path = Path(util.checkKey("path", config, str, "config"))
+        try:
+            self.paths = util.checkKey("paths", config, list, "config")
+        except ValueError:
+            self.paths = None
+
+        if self.paths is None:
+            self.path = Path(util.checkKey("path", config, str, "config"))
+        else:
+            self.path = None
+            for path in self.paths:
+                if not isinstance(path, str):
+                    raise ValueError(f"'readfile' task 'paths' each list item should be string type, but one of it "
+                                     f"founded '{type(path)}'")
 
         try:
             self.length = util.checkKey("length", config, int, "config")
@@ -35,6 +60,22 @@ class ReadFile(TaskBase):
         if self.length <= 0:
             raise ValueError(f"'readfile' task length cannot be zero or negative like '{self.length}'")
 
+        try:
+            self.io = util.checkKey("io", config, str, "config")
+        except ValueError:
+            if self.paths is not None or str(self.path).startswith(ReadFile.RawPrefix):
+                self.io = "pread"
+            else:
+                self.io = "text"
+        self.io = util.checkValueEnum(self.io, ReadFile.IoEnum, valueName="io")
+        if self.paths is not None and self.io != "pread":
+            raise ValueError(f"'readfile' task batch mode 'paths' only support 'pread' io.")
+
+        try:
+            self.rescan = util.checkKey("rescan", config, (int, float), "config")
+        except ValueError:
+            self.rescan = 60
+
         try:
             self.close = util.checkKey("close", config, str, "config")
         except ValueError as e:
@@ -42,12 +83,21 @@ class ReadFile(TaskBase):
         self.close = util.checkValueEnum(self.close, ("always", "never", "on_exception"), False, "close")
 
         self.fd = None
+        self.raws = {}  # path => RawFile
+        self.scanned = None
+        self.decode = True
         super().__init__(name, config)
 
     def _checkProcess(self):
         if self.method != "readfile":
             raise TypeError(f"ReadFile class need a readfile-type config, but find '{self.method}' type")
 
+        if self.paths is not None:
+            for path in self.paths:
+                if not Path(path).is_absolute():
+                    raise ValueError(f"Readfile class file path '{path!r}' need a absolute path.")
+            return
+
         if not self.path.is_absolute():
             raise ValueError(f"Readfile class file path '{self.path!r}' need a absolute path.")
 
@@ -55,21 +105,80 @@ class ReadFile(TaskBase):
             raise ValueError(f"Readfile class file path '{self.path!r}' must be a regular file.")
 
     def openFile(self, reset: bool = False):
+        if self.io == "pread":
+            for raw in self.raws.values():
+                if reset:
+                    raw.close()
+                raw.open()
+            return
         if reset and (isinstance(self.fd, io.TextIOWrapper) or not self.fd.closed):
             self.fd.close()
         if not isinstance(self.fd, io.TextIOWrapper) or self.fd.closed:
             self.fd = self.path.open("r", encoding="utf-8")
 
     def closeFile(self):
+        for raw in self.raws.values():
+            raw.close()
         if isinstance(self.fd, io.TextIOWrapper) and not self.fd.closed:
             self.fd.close()
 
+    def _scan(self):
+        # expand glob patterns, keep fds of files still matched, new files are opened on first read
+        found = []
+        for pattern in self.paths:
+            found.extend(sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern])
+        raws = {}
+        for path in found:
+            if path in raws or not Path(path).is_file():
+                continue
+            raws[path] = self.raws.pop(path) if path in self.raws else RawFile(path, self.length)
+        for raw in self.raws.values():
+            raw.close()
+        self.raws = raws
+        self.scanned = time.monotonic()
+
     def _setup(self):
+        # the value can skip utf-8 decoding when every format (or expect) takes bytes
+        self.decode = not self.acceptBytes()
+        if self.paths is not None:
+            self._scan()
+            return
         if not isinstance(self.path, Path):
             raise RuntimeError(f"Perfmon item {self.name} with readfile method has no valid path: '{self.path!r}'")
+        if self.io == "pread":
+            self.raws = {str(self.path): RawFile(str(self.path), self.length)}
         self.openFile()
 
+    def _readRaw(self, raw: RawFile):
+        try:
+            data = raw.read()
+        except OSError:
+            if self.close != "never":
+                raw.close()
+            raise
+        if self.close == "always":
+            raw.close()
+        return data.decode("utf-8") if self.decode else data
+
     def _run(self, params: dict):
+        if self.paths is not None:
+            if self.scanned is None or time.monotonic() - self.scanned >= self.rescan:
+                self._scan()
+            value = {}
+            for path, raw in list(self.raws.items()):
+                try:
+                    value[path] = self._readRaw(raw)
+                except OSError:
+                    # file vanished (e.g. network interface removed), forget it until next scan
+                    raw.close()
+                    del self.raws[path]
+            self.value = value
+            return
+
+        if self.io == "pread":
+            self.value = self._readRaw(self.raws[str(self.path)])
+            return
+
         self.openFile(self.close == "always")
         self.fd.seek(0)
         self.value = self.fd.read(self.length)
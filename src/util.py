@@ -4,23 +4,23 @@ import time
 import traceback
 from datetime import datetime
 from functools import wraps
-
-from urllib3.util import parse_url
 from typing import Callable
+from urllib.parse import urlsplit
 
 
 def checkKey(key: str, cfg: dict, typ, cfgName: str, canBeNone: bool = False):
+    typName = "|".join(t.__name__ for t in typ) if isinstance(typ, tuple) else typ.__name__
     if key in cfg:
         if canBeNone and cfg[key] is None:
             return None
         if not isinstance(cfg[key], typ):
             raise ValueError(
-                f"Given '{cfgName if cfgName else 'config'}' item need key named '{key}' with type '{typ.__name__}' but got '{type(cfg[key])}.'")
+                f"Given '{cfgName if cfgName else 'config'}' item need key named '{key}' with type '{typName}' but got '{type(cfg[key])}.'")
         else:
             return cfg[key]
     else:
         raise ValueError(
-            f"Given '{cfgName if cfgName else 'config'}' item need key named '{key}' with type '{typ.__name__}'.")
+            f"Given '{cfgName if cfgName else 'config'}' item need key named '{key}' with type '{typName}'.")
 
 
 def checkValueEnum(value, valueMustInList: (list, tuple), valueCanBeNone=False, valueName=""):
@@ -35,9 +35,11 @@ def checkValueEnum(value, valueMustInList: (list, tuple), valueCanBeNone=False,
 
 
 def checkUrl(url: str):
-    url_t = parse_url(url)
-    assert url_t.scheme not in (
+    # urllib.parse keeps urllib3 (and everything it imports) off the startup path of every agent
+    url_t = urlsplit(url)
+    assert url_t.scheme in (
         "http", "https"), f"server scheme only support 'HTTP' or 'HTTPS', but '{url_t.scheme}' found."
+    assert url_t.hostname, f"server url '{url}' has no host."
     return True
 
 
@@ -63,8 +65,8 @@ def timestamp():
     return int(time.time())
 
 
-def now():
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def now(ts: float = None):
+    return (datetime.now() if ts is None else datetime.fromtimestamp(ts)).strftime("%Y-%m-%d %H:%M:%S")
 
 
 def cpuCount():